@@ -5,6 +5,62 @@ class leg:
     b = 16
     d = 0
 
+class ik_table:
+    # closed form solution is faster with numpy on x86, check on the robot before enabling
+    enabled = False
+    step = 0.1 # cm between grid nodes
+    max_error = 0.05 # degrees, cells with larger interpolation error are solved exactly
+
+class sequence_cache:
+    enabled = True
+    items_limit = 2000 # least recently used sequences above it are removed
+    reduce_every = 50 # new sequences between removals
+    warm_up_max_cycles = 4 # gait cycles walked from every pose by warm up
+
+class keyframes:
+    buffer_size = 256 # frames kept by a kinematic model, longest command is about 40
+
+class ik_differential:
+    # keyframes with end points close to the start position are solved with jacobian, without full IK
+    enabled = False # opt-in, until then every keyframe is solved with full IK
+    max_delta = 1 # cm, linearization error is up to 0.15 degrees
+    max_condition = 10 # near-singular legs (straightened knee) are solved exactly
+
+class workspace:
+    step = 0.1 # cm between grid nodes
+    max_body_shift = 10 # cm, how far body can be moved along z to make a move feasible
+    body_shift_step = 1
+
+class terrain:
+    # feedback walking remembers where legs found ground
+    cell_size = 2 # cm
+    max_samples = 5 # heights averaged in a cell
+    search_cells = 1 # neighbour cells used for a cell with no heights
+    clearance = 2 # cm above the expected ground, where a leg is put before touching
+
+class validation:
+    # whole sequences are checked before the first frame is sent
+    max_joint_step = 120 # degrees between keyframes with no fixed duration, larger ones are wrapped angles
+    # cm between end points of neighbour legs, None turns the check off.
+    # It needs real body.mounts, set it to 5 once they are measured
+    min_feet_distance = None
+
+class body:
+    # leg mount points from the body center, cm, legs 1-6. x is forward, y is to the left.
+    # PLACEHOLDERS, not measured on the robot yet. They are the center of body_pose rotations,
+    # world coordinates of TerrainMap and feet positions of the validation.min_feet_distance check
+    mounts = (
+        (10, 6, 0),
+        (0, 8, 0),
+        (-10, 6, 0),
+        (-10, -6, 0),
+        (0, -8, 0),
+        (10, -6, 0),
+    )
+    look_angle = 8 # degrees of pitch for a look_up or look_down command
+    max_look_angle = 24
+    pose_frames = 4 # frames of a body pose move
+
 class robot:
     horizontal_x = 11 # 18
     horizontal_y = 11 # 18
@@ -38,6 +94,25 @@ class robot:
 class movement:
     command_advance_ms = 0.05
 
+class motion_timing:
+    # 0.16 sec / 60 degrees for 7.4V+, servos are not commanded faster
+    servo_max_speed = 60 / 160 # degrees per ms
+    packet_time = 0.87 # ms on the bus for one move packet, 10 bytes at 115200 baud
+    send_time = 27 # ms to send a frame and read targets back on both buses at once, first estimate
+    send_time_smoothing = 0.2 # weight of the last measured frame in the estimate
+    # targets are preloaded with SERVO_MOVE_TIME_WAIT_WRITE and all servos are started
+    # by a broadcast SERVO_MOVE_START on both buses at once, so joints do not start one by one
+    synchronized_start = True
+
+class htd45h_async:
+    deadline = 0.02 # s for a servo to respond to a read request
+    max_in_flight = 1 # reads waiting for responses on one bus, servos answer at once, so more of them collide on the half-duplex bus
+
+class verification:
+    # targets of a frame are read back while servos move: 'never', 'every' servo
+    # or 'round_robin', one servo of every board per frame. Servos that missed a frame get the next one twice
+    policy = 'round_robin'
+
 class speed:
     run = 250
     walk = 500
@@ -51,6 +126,31 @@ class speed:
     feedback_legs = 600
     # run_slow_down_coef = 0.8 # start slowing down after 80% of move done
 
+class trajectories:
+    swing_points = None # opt-in, frames per half-step of two-legged gaits; None keeps lift and lower keyframes only
+    period = 40 # ms between streamed frames
+    overlap = 1.5 # servos get period * overlap to reach a frame, so they don't stop between frames
+
+class gait_engine:
+    rate = 25 # frames per second
+    gait = 'tripod'
+    neutral_tolerance = 0.3 # cm, legs closer to neutral point do not step when robot stops
+    frames_per_command = 13 # frames sent before a new command is read, about a half of cycle
+    # duty factor and phase offsets of legs 1-6
+    gaits = {
+        'tripod': (1 / 2, (0, 1 / 2, 0, 1 / 2, 0, 1 / 2)),
+        'ripple': (2 / 3, (0, 1 / 3, 2 / 3, 0, 2 / 3, 1 / 3)),
+        'wave': (5 / 6, (0, 1 / 6, 2 / 6, 5 / 6, 4 / 6, 3 / 6)),
+    }
+    # cycle time in seconds, max speed in cm/s and max yaw rate in degrees/s of every gait.
+    # Swing lasts 0.5 s in all gaits, so that servos keep up with the lift at motion_timing.servo_max_speed.
+    # Speeds are the largest, at which every direction passes validation with frames of 1 / rate
+    limits = {
+        'tripod': (1.0, 10, 30),
+        'ripple': (1.5, 4, 10),
+        'wave': (3.0, 2, 10),
+    }
+
 @dataclass
 class limit:
     min: int
@@ -60,6 +160,9 @@ class angles_limits:
     alpha = limit(-70, 90)
     beta = limit(-145, 0)
     tetta = limit(-90, 90)
+    # beta of the stance is about +17, out of the beta limits above,
+    # so they are not checked by validation and workspace until the mechanical range is measured
+    check_beta = False
 
 servos_mapping = {
     "l1t" : 11,
@@ -51,7 +51,8 @@ class CommandsWriter:
         try:
             while True:
                 symbol = input('Enter command:\n')
-                command = self.symbols.get(symbol, 'none')
+                # continuous gait commands are written as they are, e.g. 'gait 5 0 0 tripod'
+                command = symbol if symbol.startswith('gait') else self.symbols.get(symbol, 'none')
                 speed = 500
                 if command in [
                     'forward_two_legged',
@@ -1,19 +1,27 @@
 import time
 import datetime
+import math
 import pickle
-from typing import Callable, Optional, Union
+from typing import Callable, Optional, Tuple, Union
 import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from cybernetic_core.kinematics import Kinematics
-from cybernetic_core.sequence_getter import VirtualRobot
-from cybernetic_core.geometry.angles import AnglesException
-from robot_hardware.robot_servos import RobotServos
+from cybernetic_core.sequence_getter import VirtualRobot, get_sequence_cache
+from cybernetic_core.geometry.angles import (
+    AnglesException,
+    DistanceException,
+    TettasException,
+    RobotPosition,
+    convert_legs_angles_to_kinematic_C
+)
+from cybernetic_core.gait_engine import GaitEngine
+from robot_hardware.robot_servos import RobotServos, FrameAbortedException
 from core.utils.multiphase_moves import CommandsForwarder
+from core.utils.warm_up import build_gait_graph
 import configs.code_config as code_config
 from configs import config as cfg
 import logging.config
-from copy import deepcopy
 
 
 class MovementProcessor:
@@ -26,13 +34,16 @@ class MovementProcessor:
         
         fk = Kinematics()
         self.vf = VirtualRobot(self.logger)
+        # steady walking is taken from the graph without IK
+        self.vf.gait_graph = build_gait_graph(self.logger)
         self.cf = CommandsForwarder()
         self.rs = RobotServos()
         #self.ftfs = FenixTofs()
         #self.ftc = FenixTofCamera()
         
         self.robot_position = fk.current_position
-
+        # continuous gait, created by the first gait command
+        self.gait_engine = None
         
         self.speed = 400
         self.body_speed = cfg.speed.body
@@ -66,7 +77,7 @@ class MovementProcessor:
         if self.max_processed_command_id == 0:
             self.max_processed_command_id = command_id
         elif self.max_processed_command_id == command_id and \
-            command not in repeating_commands:
+            command not in repeating_commands and not command.startswith('gait'):
             # command has already been processed
             #print(f'Command {contents} has already been processed')
             return None
@@ -80,6 +91,20 @@ class MovementProcessor:
             self.speed = speed
             print(f'Setting speed to {speed}')
 
+        if command.startswith('gait'):
+            try:
+                vx, vy, yaw_rate, gait = self.parse_gait_command(command)
+            except ValueError as e:
+                self.logger.info(f'[GAIT] Ignoring command - {str(e)}')
+                return
+            if self.cf.current_status:
+                # exit move of a two-legged gait
+                self.run_sequence(self.cf.get_move(command))
+            self.run_gait(vx, vy, yaw_rate, gait)
+            return
+        if self.gait_engine is not None:
+            self.stop_gait()
+
         # first we finish movements that are in progress
         if command in self.cf.moves:
             next_move = self.cf.get_move(command)
@@ -96,6 +121,65 @@ class MovementProcessor:
             else:    
                 self.run_sequence(command, kwargs)
 
+    @staticmethod
+    def parse_gait_command(command: str) -> Tuple[float, float, float, Optional[str]]:
+        """
+        command is 'gait vx vy yaw_rate [gait type]', e.g. 'gait 5 0 0 tripod'.
+        Returns velocities and gait type, None if it is not given.
+        Raises ValueError for a malformed command or an unknown gait type
+        """
+        values = command.split()
+        if values[0] != 'gait' or len(values) not in (4, 5):
+            raise ValueError(f'Expected "gait vx vy yaw_rate [gait type]", got "{command}"')
+        vx, vy, yaw_rate = (float(value) for value in values[1:4])
+        if not all(math.isfinite(value) for value in (vx, vy, yaw_rate)):
+            raise ValueError(f'Velocities should be finite, got "{command}"')
+        gait = values[4] if len(values) == 5 else None
+        if gait is not None and gait not in cfg.gait_engine.gaits:
+            raise ValueError(f'Unknown gait {gait}, expected one of {list(cfg.gait_engine.gaits)}')
+        return vx, vy, yaw_rate, gait
+
+    def run_gait(self, vx: float, vy: float, yaw_rate: float, gait: str = None) -> None:
+        """
+        Velocities are in cm/s and degrees/s, gait type is kept if it is None.
+        Sends gait_engine.frames_per_command frames, then next command can change velocity mid-stride
+        """
+        if self.gait_engine is None:
+            self.gait_engine = GaitEngine(Kinematics(robot_position=self.robot_position, init_snapshot=False).C)
+        if gait is not None and gait != self.gait_engine.gait:
+            self.gait_engine.set_gait(gait)
+        self.gait_engine.set_command(vx, vy, yaw_rate)
+        self.send_gait_frames(cfg.gait_engine.frames_per_command)
+
+    def stop_gait(self) -> None:
+        """
+        Puts all legs back to their neutral points
+        """
+        self.gait_engine.set_command(0, 0, 0)
+        while self.gait_engine is not None and self.gait_engine.moving:
+            self.send_gait_frames(cfg.gait_engine.frames_per_command)
+        self.gait_engine = None
+
+    def send_gait_frames(self, frames_number: int) -> None:
+        if not self.gait_engine.moving:
+            return
+        try:
+            frames = self.gait_engine.servo_frames(frames_number)
+        except (DistanceException, TettasException, AnglesException) as e:
+            self.logger.info(f'[GAIT] Gait stopped - {str(e)}')
+            self.gait_engine = None
+            return
+
+        period = 1000 / cfg.gait_engine.rate
+        try:
+            for frame in frames:
+                angles = RobotPosition.from_array(frame)
+                self.rs.set_servo_values_streamed(angles, period)
+                self.robot_position = convert_legs_angles_to_kinematic_C(angles)
+        except (AnglesException, FrameAbortedException) as e:
+            self.logger.info(f'[GAIT] Gait stopped - {str(e)}')
+            self.gait_engine = None
+
     def move_function_dispatch(self, command: str) -> Callable:
         if command in ['hit_1', 'hit_2', 'forward_one_legged']:
             self.logger.info('Using function set_servo_values_paced')
@@ -109,50 +193,73 @@ class MovementProcessor:
             return self.rs.set_servo_values_not_paced_v2
             #return self.rs.set_servo_values_paced
                         
+    def recover(self, sent: list) -> None:
+        """
+        Goes back through the sent snapshots of a failed command to the pose it started from,
+        so no leg is left in the air
+        """
+        if not sent:
+            return
+        self.logger.info(f'[MOVE] Recovering through {len(sent) - 1} snapshots')
+        self.rs.set_speed(self.speed)
+        try:
+            for angles in reversed(sent[:-1]):
+                self.rs.set_servo_values_paced(angles)
+                self.robot_position = convert_legs_angles_to_kinematic_C(angles)
+        except (ValueError, FrameAbortedException) as e:
+            self.logger.info(f'[MOVE] Recovery failed - {str(e)}')
+
     def run_sequence(self, command: str, kwargs=None) -> None:        
         self.logger.info(f'[MOVE] Started run_sequence : {datetime.datetime.now()}')
-        try:            
-            self.logger.info(f'MOVE. Trying command {command}')
-            before_sequence_time = datetime.datetime.now()
-            #sequence, new_position = get_sequence_for_command_cached(command, self.robot_position)
+        self.logger.info(f'MOVE. Trying command {command}')
+        before_sequence_time = datetime.datetime.now()
+
+        #prev_angles = None
+        move_function = self.move_function_dispatch(command)
+
+        original_move_function = move_function
+        sent = []
+        try:
+            # whole sequence is solved and validated before the first snapshot is sent
             sequence, new_position = self.vf.get_sequence(command, self.robot_position, kwargs)
-            
-            if sequence is None:
-                self.logger.info(f'MOVE. Command aborted')
-                return
             self.logger.info(f'[TIMING] Sequence calculation took : {datetime.datetime.now() - before_sequence_time}')
-            self.robot_position = deepcopy(new_position)
-        except (ValueError, AnglesException) as e:
+            self.logger.info(f'[MOVE] Started: {datetime.datetime.now()}')
+            start_time = datetime.datetime.now()
+
+            for move_snapshot in sequence:
+                angles = move_snapshot.angles_snapshot
+                #if move_snapshot.move_type == 'body' and self.speed != self.body_speed:
+                #    self.rs.set_speed(self.body_speed)
+                if move_snapshot.move_type == 'body':
+                    self.rs.set_speed(self.body_speed)
+                else:
+                    self.rs.set_speed(self.speed)
+                            
+                if move_snapshot.move_type == 'touch':
+                    self.logger.info('[MP] Using function set_servo_values_touching')
+                    move_function = self.rs.set_servo_values_touching
+                elif move_snapshot.move_type == 'swing':
+                    # dense frames of a swing arc, servos get the next frame before they stop
+                    move_function = lambda angles: self.rs.set_servo_values_streamed(
+                        angles, cfg.trajectories.period, int(cfg.trajectories.period * cfg.trajectories.overlap)
+                    )
+                else:
+                    move_function = original_move_function
+
+                self.logger.info(f'[MP] Moving to {angles}. Move type: {move_snapshot.move_type}')
+                self.logger.info(f'Speed: {self.rs.speed}')
+                move_function(angles)
+                sent.append(angles)
+                self.robot_position = convert_legs_angles_to_kinematic_C(angles)
+        except (ValueError, AnglesException, DistanceException, TettasException, FrameAbortedException) as e:
             print(f'MOVE Failed. Could not process command - {str(e)}')
             self.logger.info(f'MOVE Failed. Could not process command - {str(e)}')
+            self.recover(sent)
             time.sleep(0.3)
             return
-        
-        self.logger.info(f'[MOVE] Started: {datetime.datetime.now()}')    
-        start_time = datetime.datetime.now()
-        #prev_angles = None
-        move_function = self.move_function_dispatch(command)
-
-        original_move_function = move_function
-        for move_snapshot in sequence:
-            angles = move_snapshot.angles_snapshot
-            #if move_snapshot.move_type == 'body' and self.speed != self.body_speed:
-            #    self.rs.set_speed(self.body_speed)
-            if move_snapshot.move_type == 'body':
-                self.rs.set_speed(self.body_speed)
-            else:
-                self.rs.set_speed(self.speed)
-                        
-            if move_snapshot.move_type == 'touch':
-                self.logger.info('[MP] Using function set_servo_values_touching')
-                move_function = self.rs.set_servo_values_touching
-            else:
-                move_function = original_move_function
-
-            self.logger.info(f'[MP] Moving to {angles}. Move type: {move_snapshot.move_type}')
-            self.logger.info(f'Speed: {self.rs.speed}')
-            move_function(angles)
 
+        self.robot_position = new_position
+        self.logger.info(f'[CACHE] {self.vf.gait_graph}. {get_sequence_cache()}')
         self.logger.info(f'[MOVE] finished: {datetime.datetime.now()}')
         self.logger.info(f'[TIMING] Step took : {datetime.datetime.now() - start_time}')
 
@@ -171,6 +278,9 @@ class MovementProcessor:
 
                 if command == 'disable_torque':
                     self.rs.disable_torque()
+
+                elif command == 'warm_up_cache':
+                    self.vf.gait_graph = build_gait_graph(self.logger)
                     
                 else:
                     #try:
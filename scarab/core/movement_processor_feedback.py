@@ -4,11 +4,18 @@ import pickle
 from typing import Callable, Optional, Union
 import os
 import sys
+import numpy as np
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from cybernetic_core.kinematics import Kinematics
-from cybernetic_core.geometry.angles import build_position_from_servos, convert_legs_angles_to_kinematic_C
-from cybernetic_core.sequence_getter_feedback import get_sequence_for_command, get_angles_for_sequence
-from cybernetic_core.geometry.angles import AnglesException, DistanceException, TettasException
+from cybernetic_core.geometry.angles import (
+    build_position_from_servos,
+    convert_legs_angles_to_kinematic_C,
+    calculate_legs_C_points_from_servos
+)
+from cybernetic_core.sequence_getter_feedback import get_sequence_for_command, apply_move, Move
+from cybernetic_core.geometry.angles import AnglesException, DistanceException, TettasException, GeometryException
+from cybernetic_core.geometry.workspace import get_workspace_index
+from cybernetic_core.terrain import TerrainMap
 from core.utils.multiphase_moves import CommandsForwarder
 import configs.code_config as code_config
 import configs.config as cfg
@@ -29,6 +36,10 @@ class MovementProcessor:
         self.cf = CommandsForwarder()
         
         self.robot_position = fk.current_position
+        self.legs_C = fk.C.copy()
+        self.workspace = get_workspace_index()
+        self.terrain = TerrainMap()
+        self.legs_down = self.read_legs_down()
 
         self.rs = RobotServos()
         
@@ -94,9 +105,65 @@ class MovementProcessor:
             else:
                 self.run_sequence(command, kwargs)
 
-    def get_and_move_to_angles(self, move):
+    def read_legs_down(self) -> Optional[np.ndarray]:
+        """
+        Mask of shape (6) from the end switches, None if there is no valid reading
+        """
+        with open(cfg.files.neopixel, "r") as f:
+            legs_down = f.readline().split(',')[0].strip()
+        if len(legs_down) != 6 or any(value not in '01' for value in legs_down):
+            self.logger.info(f'[MP] No valid reading of end switches: {legs_down!r}')
+            return None
+        return np.array([value == '1' for value in legs_down])
+
+    def update_terrain(self, prev_C: np.ndarray) -> None:
+        legs_down = self.read_legs_down()
+        # nothing is known about the ground without a reading before and after the move
+        if legs_down is not None and self.legs_down is not None:
+            self.terrain.move_body(prev_C, self.legs_C, self.legs_down & legs_down)
+        if legs_down is not None:
+            self.terrain.record(self.legs_C, legs_down)
+        self.legs_down = legs_down
+
+    def lower_to_terrain(self) -> None:
+        """
+        Puts legs, that are in the air, right above the ground remembered under them,
+        so that the next touch move finds it at once
+        """
+        if self.legs_down is None:
+            return
+        expected_z = self.terrain.expected_legs_z(self.legs_C) + cfg.terrain.clearance
+        lowest_z = self.legs_C[:, 2] + cfg.robot.touch_down * cfg.robot.touch_down_iterations
+        legs = ~self.legs_down & (expected_z < self.legs_C[:, 2])
+        if not legs.any():
+            return
+        targets = {
+            int(leg_num): round(float(max(expected_z[leg_num - 1], lowest_z[leg_num - 1])), 1)
+            for leg_num in np.flatnonzero(legs) + 1
+        }
+        self.logger.info(f'[MP] Lowering legs to terrain: {targets}. {self.terrain}')
+        self.get_and_move_to_angles(Move('legs_z', {'z': targets}), body_shift_allowed=False)
+
+    def get_and_move_to_angles(self, move, body_shift_allowed=True):
         #print(f'Position before: {self.robot_position}')
-        sequence = get_angles_for_sequence(move, self.robot_position)
+        rk = Kinematics(robot_position=self.robot_position, init_snapshot=False)
+        start_C = rk.C.copy()
+        apply_move(rk, move)
+
+        # checking the whole move against workspace index before any servo moves
+        keyframes = rk.keyframe_points
+        bad_frame = self.workspace.first_bad_frame(keyframes)
+        if bad_frame is not None:
+            body_shift = None
+            if body_shift_allowed:
+                body_shift = self.workspace.feasible_body_shift(keyframes, start_C)
+            if body_shift is None:
+                raise GeometryException(f'Move {move} is out of workspace in frame {bad_frame}')
+            self.logger.info(f'[MP] Move {move} is out of workspace in frame {bad_frame}. Shifting body by {body_shift}')
+            self.get_and_move_to_angles(Move('body_movement', {'deltas': [0, 0, body_shift]}), body_shift_allowed=False)
+            return self.get_and_move_to_angles(move, body_shift_allowed=False)
+
+        sequence = rk.sequence
         print(f'Inner sequence: {len(sequence)}')
         for next_angles in sequence:
             angles_snapshot = next_angles.angles_snapshot
@@ -126,6 +193,11 @@ class MovementProcessor:
             
             print('New position set')
             self.robot_position = convert_legs_angles_to_kinematic_C(new_angles)
+            # end points where legs really are, may differ from the target
+            prev_C = self.legs_C
+            self.legs_C = calculate_legs_C_points_from_servos(new_angles.array[np.newaxis])[0]
+            self.logger.info(f'[MP] Legs end points: {np.round(self.legs_C, 2).tolist()}')
+            self.update_terrain(prev_C)
             #print(f'convert_legs_angles_to_kinematic: {self.robot_position}')
             #import math
             #for k, v in self.robot_position.__dict__.items():
@@ -143,9 +215,20 @@ class MovementProcessor:
         self.logger.info(f'[MOVE] Started: {datetime.datetime.now()}')    
         start_time = datetime.datetime.now()
         print(f'Outer Sequence len: {len(sequence)}')
+        prev_move_type = None
         for move in sequence:
             print(f'Move: {move}')
             #time.sleep(5)
+            if move.move_type == 'touch' and self.legs_down is not None:
+                if self.legs_down.all():
+                    self.logger.info('[MP] All legs are down, touch skipped')
+                    continue
+                if prev_move_type != 'touch':
+                    try:
+                        self.lower_to_terrain()
+                    except (AnglesException, DistanceException, TettasException, GeometryException) as e:
+                        self.logger.info(f'[MP] Lowering to terrain skipped: {e}')
+            prev_move_type = move.move_type
             command_executed = False
             attempts = 1
             while not command_executed and attempts < 6:
@@ -170,6 +253,10 @@ class MovementProcessor:
                 except TettasException as e:
                     print(f'Attempt {attempts}. Execution of command UP resulted in:\n{e}\nMoving down')
                     # Here we should change length of step
+                except GeometryException as e:
+                    print(f'Execution of command {command} rejected:\n{e}')
+                    self.logger.info(f'[MOVE] Command {command} rejected: {e}')
+                    return False
                     
                 #if attempts == 4:
                 #    print('Executing reset')
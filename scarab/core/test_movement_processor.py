@@ -0,0 +1,15 @@
+import sys
+import os
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.movement_processor import MovementProcessor
+
+
+def test_parse_gait_command():
+    assert MovementProcessor.parse_gait_command('gait 5 0 -10') == (5, 0, -10, None)
+    assert MovementProcessor.parse_gait_command('gait 2.5 1 0 wave') == (2.5, 1, 0, 'wave')
+
+    for command in ['gait', 'gait 5', 'gait 5 0', 'gait x 0 0', 'gait 5 0 nan', 'gait 5 0 0 gallop', 'gait 5 0 0 tripod 1', 'gaits 5 0 0']:
+        with pytest.raises(ValueError):
+            MovementProcessor.parse_gait_command(command)
@@ -0,0 +1,53 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from cybernetic_core.kinematics import Kinematics
+from cybernetic_core.sequence_getter import get_sequence_cache, get_trajectory_for_command
+from cybernetic_core.gait_graph import GaitGraph
+from core.utils.multiphase_moves import CommandsForwarder
+from configs import config as cfg
+
+
+def get_mode_poses(solve) -> list:
+    """
+    Initial pose and poses after every mode switch, without duplicates
+    """
+    initial_position = Kinematics().current_position
+    poses = [initial_position]
+    for mode in vars(cfg.modes):
+        if mode.startswith('__'):
+            continue
+        _, _, mode_position = solve(mode, initial_position)
+        if mode_position not in poses:
+            poses.append(mode_position)
+    return poses
+
+def build_gait_graph(logger=None) -> GaitGraph:
+    """
+    Explores every two-legged gait of CommandsForwarder from every mode pose.
+    Moves are solved through SequenceCache, so this warms up the disk cache too
+    """
+    cache = get_sequence_cache()
+    solve = get_trajectory_for_command if cache is None else cache.get
+
+    gait_graph = GaitGraph()
+    gait_graph.explore(
+        CommandsForwarder.moves,
+        get_mode_poses(solve),
+        solve,
+        cfg.sequence_cache.warm_up_max_cycles,
+        logger
+    )
+
+    if cache is not None:
+        cache.reduce_size()
+    if logger:
+        logger.info(f'[CACHE] Warm up done. {gait_graph}. {cache}')
+    return gait_graph
+
+
+if __name__ == '__main__':
+    # python warm_up.py
+    print(build_gait_graph())
+    print(get_sequence_cache())
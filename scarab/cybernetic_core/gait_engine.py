@@ -0,0 +1,172 @@
+import math
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configs import config as cfg
+from cybernetic_core.geometry.angles import (
+    DistanceException,
+    TettasException,
+    AnglesException,
+    calculate_legs_angles,
+    convert_legs_angles_to_servos
+)
+from cybernetic_core.geometry.validation import first_violation
+from cybernetic_core.geometry.trajectories import swing_profile
+
+
+class GaitEngine:
+    """
+    Continuous gait, driven by body velocity (vx, vy) in cm/s and yaw_rate in degrees/s.
+    Every leg has its own phase in the gait cycle: phase of the gait plus the phase offset of the leg.
+    For the first duty_factor of the cycle leg is on the ground and moves against the body,
+    for the rest of it leg swings to its landing point: neutral point plus half a stride.
+    Landing point is recalculated on every frame, so velocity can be changed mid-stride.
+    Frames are end points of shape (6, 3) at gait_engine.rate frames per second.
+    As in Kinematics.turn, legs are rotated around the origin of their coordinates
+    """
+    def __init__(self, neutral_C: np.ndarray, gait: str = cfg.gait_engine.gait):
+        self.neutral_C = np.array(neutral_C, dtype=float)
+        self.C = self.neutral_C.copy()
+        self.dt = 1 / cfg.gait_engine.rate
+        self.leg_up = cfg.robot.leg_up
+        self.phase = 0.0
+        self.velocity = np.zeros(2)
+        self.yaw_rate = 0.0
+        # legs, that are lifted in this swing
+        self.stepping = np.zeros(6, dtype=bool)
+        # last frame of servo_frames, speed of joints is checked from it
+        self.angles = None
+        self.set_gait(gait)
+
+    def set_gait(self, gait: str) -> None:
+        self.gait = gait
+        self.duty_factor, phase_offsets = cfg.gait_engine.gaits[gait]
+        self.phase_offsets = np.array(phase_offsets, dtype=float)
+        self.cycle_time, self.max_speed, self.max_yaw_rate = cfg.gait_engine.limits[gait]
+        # command of the previous gait can be too fast for this one
+        self.set_command(*self.velocity, math.degrees(self.yaw_rate))
+
+    def set_command(self, vx: float, vy: float, yaw_rate: float) -> None:
+        speed = math.hypot(vx, vy)
+        if speed > self.max_speed:
+            vx, vy = vx * self.max_speed / speed, vy * self.max_speed / speed
+        self.velocity = np.array([vx, vy], dtype=float)
+        yaw_rate = max(-self.max_yaw_rate, min(self.max_yaw_rate, yaw_rate))
+        self.yaw_rate = math.radians(yaw_rate)
+
+    @property
+    def legs_phases(self) -> np.ndarray:
+        return (self.phase + self.phase_offsets) % 1
+
+    @property
+    def swing(self) -> np.ndarray:
+        """
+        Mask of shape (6), True for legs in the air
+        """
+        return self.legs_phases >= self.duty_factor
+
+    @property
+    def moving(self) -> bool:
+        """
+        Gait keeps going while there is a command, any leg is stepping or is off its neutral point
+        """
+        return bool(self.velocity.any() or self.yaw_rate or self.stepping.any() or self.off_neutral().any())
+
+    def off_neutral(self) -> np.ndarray:
+        return np.linalg.norm(self.C[:, :2] - self.neutral_C[:, :2], axis=-1) > cfg.gait_engine.neutral_tolerance
+
+    @staticmethod
+    def rotate(xy: np.ndarray, angle: float) -> np.ndarray:
+        cos_a, sin_a = math.cos(angle), math.sin(angle)
+        return np.stack([xy[..., 0] * cos_a - xy[..., 1] * sin_a, xy[..., 0] * sin_a + xy[..., 1] * cos_a], axis=-1)
+
+    def landing_points(self) -> np.ndarray:
+        """
+        Points, where legs in swing should be put down, so that they are back at neutral in the middle of stance
+        """
+        half_stance = self.duty_factor * self.cycle_time / 2
+        return self.rotate(self.neutral_C[:, :2], self.yaw_rate * half_stance) + self.velocity * half_stance
+
+    def swing_progress(self, phases: np.ndarray) -> np.ndarray:
+        return np.clip((phases - self.duty_factor) / (1 - self.duty_factor), 0, 1)
+
+    def swing_xy(self, target_xy: np.ndarray, s: np.ndarray, s_next: np.ndarray) -> np.ndarray:
+        """
+        Horizontal position at swing progress s_next, along the swing arc of geometry.trajectories.
+        Remaining distance is covered proportionally, so the target can change between frames
+        """
+        done, _ = swing_profile(s)
+        done_next, _ = swing_profile(s_next)
+        fraction = (done_next - done) / np.maximum(1 - done, 1e-9)
+        return self.C[:, :2] + (target_xy - self.C[:, :2]) * fraction[:, np.newaxis]
+
+    def swing_lift(self, s: np.ndarray) -> np.ndarray:
+        _, lift = swing_profile(s)
+        return self.leg_up * lift
+
+    def step(self) -> np.ndarray:
+        """
+        Moves gait by one frame, returns end points of shape (6, 3)
+        """
+        if not self.moving:
+            return self.C.copy()
+
+        phases = self.legs_phases
+        swing = phases >= self.duty_factor
+        self.phase = (self.phase + self.dt / self.cycle_time) % 1
+        next_phases = self.legs_phases
+        # phase of a leg wraps to 0 at the end of swing
+        next_swing = (next_phases >= self.duty_factor) & (next_phases > phases)
+
+        target_xy = self.landing_points()
+        s = np.where(swing, self.swing_progress(phases), 0)
+        # whether leg is lifted, is decided at the start of its swing
+        lifting = next_swing & (s == 0)
+        self.stepping[lifting] = bool(self.velocity.any() or self.yaw_rate) \
+            | self.off_neutral()[lifting] \
+            | (np.linalg.norm(self.C[:, :2] - target_xy, axis=-1)[lifting] > cfg.gait_engine.neutral_tolerance)
+
+        s_next = np.where(next_swing, self.swing_progress(next_phases), 1)
+        # legs on the ground move against the body
+        stance_xy = self.rotate(self.C[:, :2], -self.yaw_rate * self.dt) - self.velocity * self.dt
+        swing_xy = self.swing_xy(target_xy, s, s_next)
+
+        moving_in_air = swing & self.stepping
+        self.C[:, :2] = np.where(moving_in_air[:, np.newaxis], swing_xy, np.where(swing[:, np.newaxis], self.C[:, :2], stance_xy))
+        self.C[:, 2] = self.neutral_C[:, 2] + np.where(next_swing & self.stepping, self.swing_lift(s_next), 0)
+
+        self.stepping &= next_swing
+        return self.C.copy()
+
+    def frames(self, frames_number: int) -> np.ndarray:
+        """
+        End points of the next frames, shape (frames_number, 6, 3)
+        """
+        return np.stack([self.step() for _ in range(frames_number)])
+
+    def servo_frames(self, frames_number: int) -> np.ndarray:
+        """
+        Servo angles of the next frames, shape (frames_number, 18) in JOINTS order.
+        Gait state is not changed if any frame can not be reached
+        """
+        state = self.C.copy(), self.phase, self.stepping.copy()
+        C = self.frames(frames_number)
+        tettas, alphas, betas, reachable = calculate_legs_angles(C)
+        if not reachable.all():
+            self.C, self.phase, self.stepping = state
+            frame, leg_index = np.argwhere(~reachable)[0]
+            raise DistanceException(f'Gait. No decisions for leg {leg_index + 1} in frame {frame}. C: {C[frame, leg_index].tolist()}')
+
+        angles = convert_legs_angles_to_servos(tettas, alphas, betas)
+        # servos get a frame period to reach every frame
+        violation = first_violation(angles, self.angles, np.full(frames_number, 1000 * self.dt))
+        if violation is not None:
+            self.C, self.phase, self.stepping = state
+            if violation.check == 'tettas':
+                raise TettasException(f'Gait. Bad tettas. {violation}')
+            raise AnglesException(f'Gait. {violation}')
+        self.angles = angles[-1]
+        return angles
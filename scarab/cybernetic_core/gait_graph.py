@@ -0,0 +1,65 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cybernetic_core.geometry.angles import RobotPosition, AnglesException, DistanceException, TettasException
+
+
+Solved = Tuple[List[str], np.ndarray, RobotPosition]
+
+class GaitGraph:
+    """
+    Solved gait moves, kept in memory.
+    Nodes are (gait status, pose), edges are start, next and exit moves of a gait between them.
+    Graph is explored once at startup from the mode poses,
+    so steady walking is a dict lookup and IK runs only for moves off the graph.
+    Poses are compared by RobotPosition hash, i.e. quantized to POSITION_QUANTUM
+    """
+    def __init__(self):
+        self.edges: Dict[Tuple[str, RobotPosition], Solved] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __repr__(self):
+        return f'GaitGraph(edges={len(self.edges)}, hits={self.hits}, misses={self.misses})'
+
+    def lookup(self, command: str, robot_position: RobotPosition, kwargs=None) -> Optional[Solved]:
+        solved = None if kwargs else self.edges.get((command, robot_position))
+        if solved is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return solved
+
+    def explore(self, moves: dict, poses: List[RobotPosition], solve: Callable[[str, RobotPosition], Solved], max_cycles: int, logger=None) -> None:
+        """
+        moves are MoveMappings of CommandsForwarder.
+        From every pose: start move, then next moves until the gait comes to a known node,
+        and exit move from every node on the way
+        """
+        def add_edge(command, position):
+            if (command, position) not in self.edges:
+                try:
+                    self.edges[(command, position)] = solve(command, position)
+                except (AnglesException, DistanceException, TettasException) as e:
+                    if logger:
+                        logger.info(f'[GAIT GRAPH] {command} failed: {e}')
+                    return None
+            return self.edges[(command, position)][2]
+
+        for pose in poses:
+            for mapping in moves.values():
+                status, position = mapping.start.status, add_edge(mapping.start.action, pose)
+                visited = []
+                while position is not None and (status, position) not in visited \
+                        and len(visited) < 2 * max_cycles:
+                    visited.append((status, position))
+                    add_edge(mapping.exit[status].action, position)
+                    next_status = mapping.next[status]
+                    status, position = next_status.status, add_edge(next_status.action, position)
@@ -1,6 +1,8 @@
 import math
+from array import array
 from functools import lru_cache
-from typing import List
+from typing import List, Tuple
+import numpy as np
 
 import sys
 import os
@@ -8,7 +10,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
 
 from cybernetic_core.geometry.lines import Point
 
-from configs.config import leg, servos_mapping
+from configs.config import leg, servos_mapping, ik_table
 import configs.code_config as code_config
 import logging.config
 
@@ -24,6 +26,24 @@ class TettasException(Exception):
 class GeometryException(Exception):
     pass
 
+# servo angles of a whole robot are kept in this order in (..., 18) arrays
+JOINTS = (
+    "l1t", "l1a", "l1b",
+    "l2t", "l2a", "l2b",
+    "l3t", "l3a", "l3b",
+    "l4t", "l4a", "l4b",
+    "l5t", "l5a", "l5b",
+    "l6t", "l6a", "l6b"
+)
+LEG_NUMBERS = np.arange(1, 7)
+# angles closer than that are the same position for hashing and comparison
+POSITION_QUANTUM = 1e-4
+
+TETTAS_LIMIT = 12
+SAME_SIGN_TETTAS_LIMIT = 30
+# pairs of neighbour legs, which tettas should not cross
+TETTAS_PAIRS = ((1, 2), (2, 3), (4, 5), (5, 6))
+
 class RobotPositionLeg():
     def __init__(self, alpha, beta, tetta):
         self.alpha = alpha
@@ -34,42 +54,86 @@ class RobotPositionLeg():
         return f'a: {self.alpha}, b: {self.beta}, t: {self.tetta}'
 
 class RobotPosition():
-    valid_fields = (
-        "l1a", "l1b", "l1t", 
-        "l2a", "l2b", "l2t", 
-        "l3a", "l3b", "l3t", 
-        "l4a", "l4b", "l4t", 
-        "l5a", "l5b", "l5t", 
-        "l6a", "l6b", "l6t"
-    )
+    """
+    Angles of all 18 joints, kept in array('d') in JOINTS order.
+    Position is immutable, so copies return the same object.
+    Hash and equality use angles quantized to POSITION_QUANTUM,
+    so equal positions can be used as cache keys
+    """
+    __slots__ = ('_values', '_hash')
+    valid_fields = JOINTS
+    _indices = {joint: index for index, joint in enumerate(JOINTS)}
+
     def __init__(self, **kwargs):
+        values = array('d', bytes(8 * len(JOINTS)))
         for k, v in kwargs.items():
-            if k not in self.valid_fields:
+            if k not in self._indices:
                 raise TypeError(f'Wrong attribute: {k}')
-            self.__setattr__(k, v)
-        #leg1 = RobotPositionLeg(self.l1a, self.l1b, self.l1t)
-        #leg2 = RobotPositionLeg(self.l2a, self.l2b, self.l2t)
-        #leg3 = RobotPositionLeg(self.l3a, self.l3b, self.l3t)
-        #leg4 = RobotPositionLeg(self.l4a, self.l4b, self.l4t)
-        #leg5 = RobotPositionLeg(self.l5a, self.l5b, self.l5t)
-        #leg6 = RobotPositionLeg(self.l6a, self.l6b, self.l6t)
-                           
-        #self.legs = {
-        #    1: leg1, 2: leg2, 3: leg3, 4: leg4, 5: leg5, 6: leg6,
-        #}
-    
+            values[self._indices[k]] = v
+        if len(kwargs) != len(JOINTS):
+            missing = [joint for joint in JOINTS if joint not in kwargs]
+            raise TypeError(f'Missing attributes: {missing}')
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_hash', None)
+
+    @classmethod
+    def from_array(cls, values) -> 'RobotPosition':
+        """
+        Takes 18 angles in JOINTS order
+        """
+        rp = cls.__new__(cls)
+        values = array('d', np.asarray(values, dtype=float).ravel().tobytes())
+        if len(values) != len(JOINTS):
+            raise TypeError(f'Expected {len(JOINTS)} angles, got {len(values)}')
+        object.__setattr__(rp, '_values', values)
+        object.__setattr__(rp, '_hash', None)
+        return rp
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        Read-only view of angles of shape (18) in JOINTS order, without copying
+        """
+        view = np.frombuffer(self._values, dtype=float)
+        view.flags.writeable = False
+        return view
+
     @property
-    def servo_values(self):
-        return self.__dict__
+    def servo_values(self) -> dict:
+        return dict(zip(JOINTS, self._values))
+
+    def __getattr__(self, name):
+        if name in RobotPosition._indices:
+            return self._values[RobotPosition._indices[name]]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RobotPosition is immutable')
+
+    def quantized(self) -> np.ndarray:
+        return np.rint(self.array / POSITION_QUANTUM).astype(np.int64)
 
     def __hash__(self):
-        return hash(self.servo_values.values())
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(self.quantized().tobytes()))
+        return self._hash
 
-    def __repr__(self):
-        return self.__dict__.__repr__()
+    def __eq__(self, other):
+        if not isinstance(other, RobotPosition):
+            return NotImplemented
+        return self is other or np.array_equal(self.quantized(), other.quantized())
+
+    def __copy__(self):
+        return self
 
-    #def __repr__(self):
-    #    return f'\n1: {self.legs[1]}\n2: {self.legs[2]}\n3: {self.legs[3]}\n4: {self.legs[4]}\n5: {self.legs[5]}\n6: {self.legs[6]}\n'
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (RobotPosition.from_array, (self._values.tolist(),))
+
+    def __repr__(self):
+        return self.servo_values.__repr__()
 
 def build_position_from_servos(servo_angles: List[float]) -> RobotPosition:
     # incoming angles: beta, alpha, tetta for leg 1 to 6
@@ -100,11 +164,22 @@ def build_position_from_servos(servo_angles: List[float]) -> RobotPosition:
         leg6_tetta=tetta6,
     )
 
-@lru_cache(maxsize=None)
-def find_angles(Cx, Cy, logger):
+def get_ik_table():
+    # imported here, because ik_table itself uses find_legs_angles
+    from cybernetic_core.geometry.ik_table import get_ik_table as get_table
+    return get_table()
+
+@lru_cache(maxsize=4096)
+def find_angles(Cx, Cy):
+    if ik_table.enabled:
+        alpha, beta, reachable = get_ik_table().lookup(Cx, Cy)
+        if not reachable:
+            raise DistanceException('No decisions. Full distance : {0}'.format(math.sqrt(Cx ** 2 + Cy ** 2)))
+        return float(alpha), float(beta)
+
     a, b = leg.a, leg.b
     dist = math.sqrt(Cx ** 2 + Cy ** 2)
-    if dist > a + b:
+    if dist > a + b or dist < abs(a - b) or dist == 0:
         raise DistanceException('No decisions. Full distance : {0}'.format(dist))
 
     alpha1 = math.acos((a ** 2 + dist ** 2 - b ** 2) / (2 * a * dist))
@@ -114,8 +189,6 @@ def find_angles(Cx, Cy, logger):
     alpha2 = math.atan2(Cy, Cx)
     alpha = alpha1 + alpha2
 
-    logger.info(f'Alpha1: {round(math.degrees(alpha1), 2)}\nAlpha2: {round(math.degrees(alpha2), 2)}\nBeta1: {round(math.degrees(beta1), 2)}')
-
     return alpha, beta
 
 def calculate_leg_angles(C: Point, logger):    
@@ -123,12 +196,90 @@ def calculate_leg_angles(C: Point, logger):
 
     l = round(math.sqrt(C.x ** 2 + C.y ** 2), 2)
     delta_z = round(C.z, 2)
-    #print(f'Trying l {l} and delta_z {delta_z}')
-    alpha, beta = find_angles(l, delta_z, logger)
-    #print(f'Success : {[math.degrees(tetta), math.degrees(alpha), math.degrees(beta)]}')
+    alpha, beta = find_angles(l, delta_z)
+    logger.info(f'Leg angles: {[round(math.degrees(x), 2) for x in (tetta, alpha, beta)]}')
 
     return tetta, alpha, beta
 
+def find_legs_angles(l: np.ndarray, z: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized find_angles for leg end points given by horizontal distance l and height z.
+    Returns alphas, betas and a reachability mask, unreachable points get nan angles
+    """
+    a, b = leg.a, leg.b
+    dist = np.hypot(l, z)
+    reachable = (dist <= a + b) & (dist >= abs(a - b)) & (dist > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_alpha1 = (a ** 2 + dist ** 2 - b ** 2) / (2 * a * dist)
+    cos_beta1 = (a ** 2 + b ** 2 - dist ** 2) / (2 * a * b)
+    alpha1 = np.arccos(np.clip(cos_alpha1, -1, 1))
+    beta1 = np.arccos(np.clip(cos_beta1, -1, 1))
+
+    alphas = np.where(reachable, alpha1 + np.arctan2(z, l), np.nan)
+    betas = np.where(reachable, np.pi - beta1, np.nan)
+
+    return alphas, betas, reachable
+
+def calculate_legs_angles(C: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Batched calculate_leg_angles for all legs at once.
+    C is an array of leg end points with x, y, z in the last axis, usually of shape (6, 3).
+    Returns tettas, alphas, betas and a reachability mask, all of shape C.shape[:-1].
+    Unreachable legs get nan angles instead of raising DistanceException.
+    """
+    C = np.asarray(C, dtype=float)
+    x, y, z = C[..., 0], C[..., 1], C[..., 2]
+
+    tettas = np.arctan2(y, x)
+    if ik_table.enabled:
+        alphas, betas, reachable = get_ik_table().lookup(np.hypot(x, y), z)
+    else:
+        alphas, betas, reachable = find_legs_angles(np.hypot(x, y), z)
+
+    return tettas, alphas, betas, reachable
+
+def calculate_legs_jacobian(tettas: np.ndarray, alphas: np.ndarray, betas: np.ndarray) -> np.ndarray:
+    """
+    Analytic jacobian of leg end point (x, y, z) by (tetta, alpha, beta).
+    Takes angles of shape (...) and returns jacobians of shape (..., 3, 3)
+    """
+    a, b = leg.a, leg.b
+    cos_t, sin_t = np.cos(tettas), np.sin(tettas)
+    # r is horizontal distance to the end point, h is its height
+    r = a * np.cos(alphas) + b * np.cos(alphas - betas)
+    dr_dalpha = -a * np.sin(alphas) - b * np.sin(alphas - betas)
+    dh_dalpha = a * np.cos(alphas) + b * np.cos(alphas - betas)
+    dr_dbeta = b * np.sin(alphas - betas)
+    dh_dbeta = -b * np.cos(alphas - betas)
+
+    jacobian = np.empty(np.shape(tettas) + (3, 3))
+    jacobian[..., 0, 0] = -r * sin_t
+    jacobian[..., 1, 0] = r * cos_t
+    jacobian[..., 2, 0] = 0
+    jacobian[..., 0, 1] = dr_dalpha * cos_t
+    jacobian[..., 1, 1] = dr_dalpha * sin_t
+    jacobian[..., 2, 1] = dh_dalpha
+    jacobian[..., 0, 2] = dr_dbeta * cos_t
+    jacobian[..., 1, 2] = dr_dbeta * sin_t
+    jacobian[..., 2, 2] = dh_dbeta
+    return jacobian
+
+def calculate_legs_angles_differential(
+        tettas: np.ndarray,
+        alphas: np.ndarray,
+        betas: np.ndarray,
+        inverse_jacobian: np.ndarray,
+        delta_C: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    First order IK for small moves of end points from a solved position.
+    Angles have shape (N), inverse_jacobian (N, 3, 3), delta_C (..., N, 3).
+    Returns tettas, alphas, betas of shape (..., N)
+    """
+    delta_angles = np.einsum('nij,...nj->...ni', inverse_jacobian, delta_C)
+    return tettas + delta_angles[..., 0], alphas + delta_angles[..., 1], betas + delta_angles[..., 2]
+
 def calculate_C_point(tetta: float, alpha: float, beta: float) -> Point:
     B_xz = [leg.a * math.cos(alpha),
             leg.a * math.sin(alpha)]
@@ -176,6 +327,51 @@ def convert_tetta_to_kinematic(tetta_degrees: float, leg_number: int) -> float:
     
     return round(tetta_radians, 4)
 
+def convert_legs_tettas(tettas: np.ndarray) -> np.ndarray:
+    """
+    Vectorized convert_tetta for kinematic tettas of shape (..., 6), not rounded
+    """
+    tettas_degrees = np.degrees(tettas)
+    return np.where(LEG_NUMBERS <= 3, 90 - tettas_degrees, -(90 + tettas_degrees))
+
+def convert_legs_angles_to_servos(tettas: np.ndarray, alphas: np.ndarray, betas: np.ndarray) -> np.ndarray:
+    """
+    Vectorized convert_legs_angles_C.
+    Takes kinematic angles of shape (..., 6) and returns servo angles of shape (..., 18) in JOINTS order
+    """
+    frames = np.stack([convert_legs_tettas(tettas), np.degrees(alphas), np.degrees(betas) - 90], axis=-1)
+    return np.round(frames.reshape(*frames.shape[:-2], 18), 2)
+
+def convert_servos_to_legs_angles(frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized convert_legs_angles_to_kinematic_C, not rounded.
+    Takes servo angles of shape (..., 18) in JOINTS order and returns kinematic tettas, alphas, betas of shape (..., 6)
+    """
+    frames = np.asarray(frames, dtype=float)
+    joints = frames.reshape(*frames.shape[:-1], 6, 3)
+    # tetta conversion is symmetric
+    tettas = np.radians(convert_legs_tettas(np.radians(joints[..., 0])))
+    return tettas, np.radians(joints[..., 1]), np.radians(joints[..., 2] + 90)
+
+def calculate_legs_C_points(tettas: np.ndarray, alphas: np.ndarray, betas: np.ndarray) -> np.ndarray:
+    """
+    Vectorized calculate_C_point, not rounded.
+    Takes kinematic angles of shape (...) and returns end points of shape (..., 3)
+    """
+    horizontal = leg.a * np.cos(alphas) + leg.b * np.cos(alphas - betas)
+    return np.stack([
+        horizontal * np.cos(tettas),
+        horizontal * np.sin(tettas),
+        leg.a * np.sin(alphas) + leg.b * np.sin(alphas - betas)
+    ], axis=-1)
+
+def calculate_legs_C_points_from_servos(frames: np.ndarray) -> np.ndarray:
+    """
+    Forward kinematics for servo angles of shape (N, 18) in JOINTS order.
+    Returns end points of shape (N, 6, 3)
+    """
+    return calculate_legs_C_points(*convert_servos_to_legs_angles(frames))
+
 def get_converter_function(joint: str, back=False):
     if 'a' in joint:
         if back:
@@ -254,30 +450,30 @@ def tettas_ok(l1t, l2t, l3t, l4t, l5t, l6t, logger):
     l5t = convert_tetta(l5t, 5)
     l6t = convert_tetta(l6t, 6)
     
-    tettas_limit = 12
-    same_sign_tettas_limit = 30
-    if (l2t*l1t < 0 and l2t - l1t > tettas_limit) \
-        or (l2t*l1t > 0 and l2t - l1t > same_sign_tettas_limit):
-        logger.error(f"Alarm1: {l2t}, {l1t}")
-        return False
-
-    if (l3t*l2t < 0 and l3t - l2t > tettas_limit) \
-        or (l3t*l2t > 0 and l3t - l2t > same_sign_tettas_limit):
-        logger.error(f"Alarm2: {l3t}, {l2t}")
-        return False
-
-    if (l5t*l4t < 0 and l5t - l4t > tettas_limit) \
-        or (l5t*l4t > 0 and l5t - l4t > same_sign_tettas_limit):
-        logger.error(f"Alarm3: {l5t}, {l4t}")
-        return False
-
-    if (l6t*l5t < 0 and l6t - l5t > tettas_limit) \
-        or (l6t*l5t > 0 and l6t - l5t > same_sign_tettas_limit):
-        logger.error(f"Alarm4: {l6t}, {l5t}")
-        return False
+    tettas = {1: l1t, 2: l2t, 3: l3t, 4: l4t, 5: l5t, 6: l6t}
+    for alarm_num, (prev_leg, next_leg) in enumerate(TETTAS_PAIRS, 1):
+        prev_tetta, next_tetta = tettas[prev_leg], tettas[next_leg]
+        if (next_tetta*prev_tetta < 0 and next_tetta - prev_tetta > TETTAS_LIMIT) \
+            or (next_tetta*prev_tetta > 0 and next_tetta - prev_tetta > SAME_SIGN_TETTAS_LIMIT):
+            logger.error(f"Alarm{alarm_num}: {next_tetta}, {prev_tetta}")
+            return False
    
     return True
 
+def legs_tettas_ok(servo_tettas: np.ndarray) -> np.ndarray:
+    """
+    Vectorized tettas_ok.
+    Takes servo tettas of shape (..., 6) and returns a mask of shape (...), True where tettas are fine
+    """
+    ok = np.ones(servo_tettas.shape[:-1], dtype=bool)
+    for prev_leg, next_leg in TETTAS_PAIRS:
+        prev_tetta = servo_tettas[..., prev_leg - 1]
+        next_tetta = servo_tettas[..., next_leg - 1]
+        product = next_tetta * prev_tetta
+        diff = next_tetta - prev_tetta
+        ok &= ~(((product < 0) & (diff > TETTAS_LIMIT)) | ((product > 0) & (diff > SAME_SIGN_TETTAS_LIMIT)))
+    return ok
+
 
 if __name__ == '__main__':
     logging.config.dictConfig(code_config.logger_config)
@@ -286,4 +482,4 @@ if __name__ == '__main__':
     #fp = RobotPosition('physical', 44.51882068166497, 14.398429391637588, -82.79813097435527, -20.637939780612253, -26.762858610560755, 12.719663051904275, -128.64048416277242, 26.401895199628335, -135.24095796267952, 4.079459501331462, -131.7573745682841, 13.68223214772406, 114.59728860411596, 9.837685342396234, -134.63935227779214, 33.598245106471474)
     #print(fp.legs[1].alpha)
     # DeltaX: 16.71. DeltaZ: 12.72
-    print(find_angles(16.71, 12.72, logger))
+    print(find_angles(16.71, 12.72))
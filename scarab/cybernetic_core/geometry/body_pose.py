@@ -0,0 +1,57 @@
+from typing import Tuple
+import numpy as np
+
+
+def rotation_matrix(roll: np.ndarray, pitch: np.ndarray, yaw: np.ndarray) -> np.ndarray:
+    """
+    Angles in radians of shape (...). Returns matrices of shape (..., 3, 3): yaw * pitch * roll.
+    x is forward, y is to the left, z is up.
+    Positive roll lifts the left side, positive pitch lifts the front, positive yaw turns left
+    """
+    roll, pitch, yaw = np.broadcast_arrays(*(np.asarray(angle, dtype=float) for angle in (roll, pitch, yaw)))
+    cr, sr = np.cos(roll), np.sin(roll)
+    # front goes up for a negative rotation around y
+    cp, sp = np.cos(pitch), -np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    return np.stack([
+        np.stack([cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr], axis=-1),
+        np.stack([sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr], axis=-1),
+        np.stack([-sp, cp * sr, cp * cr], axis=-1),
+    ], axis=-2)
+
+def transform_legs_C(C: np.ndarray, mounts: np.ndarray, translation: np.ndarray, rotation: np.ndarray) -> np.ndarray:
+    """
+    End points C of shape (6, 3) in leg frames, mount points of shape (6, 3) in the body frame.
+    Body is moved to translation of shape (..., 3) and rotated by rotation of shape (..., 3, 3),
+    both in the current body frame, legs end points stay where they are.
+    Returns end points in leg frames of the new body of shape (..., 6, 3)
+    """
+    feet = np.asarray(C, dtype=float) + mounts
+    translation = np.asarray(translation, dtype=float)[..., np.newaxis, :]
+    # R^T (P - t) for every leg
+    return np.einsum('...ji,...lj->...li', rotation, feet - translation) - mounts
+
+def legs_plane_angles(C: np.ndarray, mounts: np.ndarray) -> Tuple[float, float]:
+    """
+    Roll and pitch of the body in radians relative to the plane of legs end points,
+    fitted by least squares, so it is the ground for a robot on a flat surface
+    """
+    feet = np.asarray(C, dtype=float) + mounts
+    A = np.stack([feet[:, 0], feet[:, 1], np.ones(len(feet))], axis=-1)
+    a, b, _ = np.linalg.lstsq(A, feet[:, 2], rcond=None)[0]
+    # ground normal in the body frame is the last row of rotation_matrix
+    normal = np.array([-a, -b, 1]) / np.linalg.norm([a, b, 1])
+    return float(np.arctan2(normal[1], normal[2])), float(np.arcsin(normal[0]))
+
+def legs_yaw(C: np.ndarray, neutral_C: np.ndarray, mounts: np.ndarray) -> float:
+    """
+    Yaw of the body in radians relative to neutral end points, best fit rotation of centered xy
+    """
+    feet = np.asarray(C, dtype=float)[:, :2] + mounts[:, :2]
+    neutral = np.asarray(neutral_C, dtype=float)[:, :2] + mounts[:, :2]
+    feet = feet - feet.mean(axis=0)
+    neutral = neutral - neutral.mean(axis=0)
+    # body turned by yaw sees its legs turned by -yaw
+    cross = (neutral[:, 0] * feet[:, 1] - neutral[:, 1] * feet[:, 0]).sum()
+    dot = (neutral * feet).sum()
+    return float(-np.arctan2(cross, dot))
@@ -0,0 +1,128 @@
+import os
+import glob
+import math
+from typing import Tuple
+import numpy as np
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from cybernetic_core.geometry.angles import find_legs_angles
+from configs.config import leg, ik_table as ik_table_cfg
+import configs.code_config as code_config
+
+
+# channels of the table
+ALPHA, BETA, REACHABLE, CELL_OK = range(4)
+
+class IKTable:
+    """
+    Alpha and beta of the two-link leg, precomputed on a dense (l, z) grid
+    and stored as .npy file in code_config.cache_dir.
+    l goes from 0 to a + b, z goes from -(a + b) to a + b with a fixed step.
+    Table is memory-mapped and answered with bilinear interpolation.
+    Cells near the edge of the workspace, or with interpolation error
+    above ik_table.max_error degrees, are flagged and solved exactly instead.
+    File name contains leg dimensions, so table is rebuilt when they change.
+    """
+    def __init__(self, cache_dir: str = code_config.cache_dir, rebuild: bool = False):
+        self.a, self.b = leg.a, leg.b
+        self.step = ik_table_cfg.step
+        self.max_error = math.radians(ik_table_cfg.max_error)
+        self.reach = self.a + self.b
+        self.z_min = -self.reach
+        self.nl = int(round(self.reach / self.step)) + 1
+        self.nz = int(round(2 * self.reach / self.step)) + 1
+
+        self.cache_dir = cache_dir
+        self.path = os.path.join(
+            cache_dir,
+            f'ik_table_a{self.a}_b{self.b}_d{leg.d}_step{self.step}.npy'
+        )
+        if rebuild or not os.path.exists(self.path):
+            self.build()
+        self.table = np.load(self.path, mmap_mode='r')
+
+    def build(self) -> None:
+        l = np.arange(self.nl) * self.step
+        z = self.z_min + np.arange(self.nz) * self.step
+        grid_l, grid_z = np.meshgrid(l, z, indexing='ij')
+
+        table = np.zeros((self.nl, self.nz, 4), dtype=np.float32)
+        alphas, betas, reachable = find_legs_angles(grid_l, grid_z)
+        table[..., ALPHA] = np.nan_to_num(alphas)
+        table[..., BETA] = np.nan_to_num(betas)
+        table[..., REACHABLE] = reachable
+
+        # a cell can be interpolated if all 4 corners are reachable
+        # and interpolation error in the middle of it and its edges is small enough
+        cell_ok = reachable[:-1, :-1] & reachable[1:, :-1] & reachable[:-1, 1:] & reachable[1:, 1:]
+        for fl, fz in [(0.5, 0.5), (0.5, 0), (0, 0.5), (0.5, 1), (1, 0.5)]:
+            check_l = grid_l[:-1, :-1] + fl * self.step
+            check_z = grid_z[:-1, :-1] + fz * self.step
+            exact_alphas, exact_betas, check_reachable = find_legs_angles(check_l, check_z)
+            cell_ok &= check_reachable
+            for channel, exact in [(ALPHA, exact_alphas), (BETA, exact_betas)]:
+                values = table[..., channel].astype(float)
+                interpolated = \
+                    values[:-1, :-1] * (1 - fl) * (1 - fz) + values[1:, :-1] * fl * (1 - fz) + \
+                    values[:-1, 1:] * (1 - fl) * fz + values[1:, 1:] * fl * fz
+                with np.errstate(invalid='ignore'):
+                    cell_ok &= np.abs(interpolated - exact) <= self.max_error
+        table[:-1, :-1, CELL_OK] = cell_ok
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for stale_table in glob.glob(os.path.join(self.cache_dir, 'ik_table_*.npy')):
+            os.remove(stale_table)
+        tmp_path = self.path + '.tmp.npy'
+        np.save(tmp_path, table)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, l: np.ndarray, z: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Same contract as find_legs_angles: returns alphas, betas and a reachability mask.
+        """
+        l = np.asarray(l, dtype=float)
+        z = np.asarray(z, dtype=float)
+        u = l / self.step
+        v = (z - self.z_min) / self.step
+        inside = (u >= 0) & (u < self.nl - 1) & (v >= 0) & (v < self.nz - 1)
+        i = np.clip(np.floor(u).astype(int), 0, self.nl - 2)
+        j = np.clip(np.floor(v).astype(int), 0, self.nz - 2)
+        fu = (u - i)[..., np.newaxis]
+        fv = (v - j)[..., np.newaxis]
+
+        corners = self.table[i, j], self.table[i + 1, j], self.table[i, j + 1], self.table[i + 1, j + 1]
+        interpolated = \
+            corners[0] * (1 - fu) * (1 - fv) + corners[1] * fu * (1 - fv) + \
+            corners[2] * (1 - fu) * fv + corners[3] * fu * fv
+        alphas = interpolated[..., ALPHA]
+        betas = interpolated[..., BETA]
+        reachable = inside & (corners[0][..., CELL_OK] > 0)
+
+        if not reachable.all():
+            # edge of the workspace, solving exactly
+            exact = ~reachable
+            exact_alphas, exact_betas, exact_reachable = find_legs_angles(l[exact], z[exact])
+            alphas = np.where(reachable, alphas, np.nan)
+            betas = np.where(reachable, betas, np.nan)
+            alphas[exact] = exact_alphas
+            betas[exact] = exact_betas
+            reachable = reachable.copy()
+            reachable[exact] = exact_reachable
+
+        return alphas, betas, reachable
+
+_ik_table = None
+
+def get_ik_table() -> IKTable:
+    global _ik_table
+    if _ik_table is None:
+        _ik_table = IKTable()
+    return _ik_table
+
+
+if __name__ == '__main__':
+    # build step: python ik_table.py
+    table = IKTable(rebuild=True)
+    print(f'IK table {table.nl}x{table.nz} saved to {table.path}')
@@ -1,5 +1,10 @@
 import sys
 import os
+import math
+import copy
+import pickle
+import logging
+import numpy as np
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 from angles import (
@@ -12,7 +17,25 @@ from angles import (
     RobotPosition,
     convert_legs_angles_C,
     convert_legs_angles_to_kinematic_C,
+    calculate_leg_angles,
+    calculate_legs_angles,
+    find_legs_angles,
+    calculate_legs_jacobian,
+    calculate_legs_C_points_from_servos,
+    calculate_legs_angles_differential,
+    convert_legs_angles_to_servos,
+    legs_tettas_ok,
+    tettas_ok,
+    JOINTS,
+    POSITION_QUANTUM,
 )
+from cybernetic_core.geometry.lines import Point
+from cybernetic_core.geometry.trajectories import swing_trajectory
+from cybernetic_core.geometry.validation import first_violation
+from cybernetic_core.geometry.body_pose import rotation_matrix, transform_legs_C, legs_plane_angles, legs_yaw
+from cybernetic_core.geometry.ik_table import IKTable
+from configs.config import ik_table
+from configs import config as cfg
 
 def test_convert_alpha():
     for angle in [-60, -30, 0, 30, 60]:
@@ -37,9 +60,145 @@ def test_convert_position():
         'l6t': -45.0, 'l6a': -17.46, 'l6b': -16.84
     })
     position_altered = convert_legs_angles_C(convert_legs_angles_to_kinematic_C(position))
-    for k, v in position.__dict__.items():
+    for k, v in position.servo_values.items():
         print(k)
-        assert v == position_altered.__dict__[k]
+        assert v == position_altered.servo_values[k]
+
+def test_robot_position():
+    angles = {joint: float(i) for i, joint in enumerate(JOINTS)}
+    position = RobotPosition(**angles)
+    assert position.servo_values == angles
+    assert position.array.tolist() == list(angles.values())
+    assert position.l2a == 4.0
+
+    same_position = RobotPosition.from_array(position.array + POSITION_QUANTUM / 10)
+    assert same_position == position and hash(same_position) == hash(position)
+    assert RobotPosition.from_array(position.array + 0.01) != position
+    assert copy.deepcopy(position) is position
+    assert pickle.loads(pickle.dumps(position)) == position
+
+def test_calculate_legs_angles():
+    C = np.array([
+        [11, 11, -10], [0, 17, -10], [-11, 11, -10],
+        [-11, -11, -10], [0, -17, -10], [40, 0, -10]
+    ])
+    tettas, alphas, betas, reachable = calculate_legs_angles(C)
+    assert reachable.tolist() == [True, True, True, True, True, False]
+    assert math.isnan(alphas[5]) and math.isnan(betas[5])
+    for i in range(5):
+        tetta, alpha, beta = calculate_leg_angles(Point(*C[i]), logging.getLogger())
+        assert math.isclose(tettas[i], tetta, abs_tol=1e-3)
+        assert math.isclose(alphas[i], alpha, abs_tol=1e-3)
+        assert math.isclose(betas[i], beta, abs_tol=1e-3)
+
+def test_calculate_legs_angles_differential():
+    C = np.array([
+        [11, 11, -10], [0, 17, -10], [-11, 11, -10],
+        [-11, -11, -10], [0, -17, -10], [11, -11, -10]
+    ])
+    tettas, alphas, betas, _ = calculate_legs_angles(C)
+    inverse_jacobian = np.linalg.inv(calculate_legs_jacobian(tettas, alphas, betas))
+    delta_C = np.array([[0, 0, 0.5], [0.3, -0.3, 0], [0, 0, -1], [0.5, 0.5, 0.5], [0, 0, 0], [-0.2, 0, 0.7]])
+    exact = calculate_legs_angles(C + delta_C)[:3]
+    differential = calculate_legs_angles_differential(tettas, alphas, betas, inverse_jacobian, delta_C)
+    for exact_angles, differential_angles in zip(exact, differential):
+        assert np.allclose(exact_angles, differential_angles, atol=math.radians(0.15))
+
+def test_calculate_legs_C_points_from_servos():
+    C = np.array([
+        [[11, 11, -10], [0, 17, -10], [-11, 11, -10], [-11, -11, -10], [0, -17, -10], [11, -11, -10]],
+        [[19, 11, -4], [8, 17, -4], [-3, 11, -4], [-11, -11, -12], [0, -17, -12], [11, -11, -12]],
+    ])
+    frames = convert_legs_angles_to_servos(*calculate_legs_angles(C)[:3])
+    assert np.allclose(calculate_legs_C_points_from_servos(frames), C, atol=0.02)
+
+def test_swing_trajectory():
+    start = np.array([[11, 11, -10], [-11, 11, -10]])
+    end = start + [8, 0, 0]
+    points = swing_trajectory(start, end, 9, 8)
+    assert points.shape == (8, 2, 3)
+    assert np.allclose(points[-1], end)
+    assert np.allclose(points[3, :, 2], -1)
+    assert (np.diff(points[:, :, 0], axis=0) > 0).all()
+
+def test_body_pose():
+    C = np.array([[11, 11, -10], [0, 17, -10], [-11, 11, -10], [-11, -11, -10], [0, -17, -10], [11, -11, -10]], dtype=float)
+    mounts = np.array([[10, 6, 0], [0, 8, 0], [-10, 6, 0], [-10, -6, 0], [0, -8, 0], [10, -6, 0]], dtype=float)
+    assert np.allclose(transform_legs_C(C, mounts, [1, 2, 3], np.eye(3)), C - [1, 2, 3])
+
+    angles = np.radians([3, -5, 7])
+    rotation = rotation_matrix(*angles)
+    assert np.allclose(rotation @ rotation.T, np.eye(3))
+    # front goes up for a positive pitch
+    assert rotation_matrix(0, 0.1, 0)[2, 0] > 0
+
+    posed = transform_legs_C(C, mounts, np.zeros(3), rotation)
+    assert np.allclose(legs_plane_angles(posed, mounts), angles[:2])
+    assert abs(legs_yaw(posed, C, mounts) - angles[2]) < 0.01
+
+    frames = transform_legs_C(C, mounts, np.zeros((4, 3)), rotation_matrix(*np.outer([0.25, 0.5, 0.75, 1], angles).T))
+    assert frames.shape == (4, 6, 3)
+    assert np.allclose(frames[-1], posed)
+
+def test_first_violation():
+    C = np.array([[11, 11, -10], [0, 17, -10], [-11, 11, -10], [-11, -11, -10], [0, -17, -10], [11, -11, -10]], dtype=float)
+    C = np.stack([C, C + [1, 0, 0], C + [2, 0, 0]])
+    frames = convert_legs_angles_to_servos(*calculate_legs_angles(C)[:3])
+    assert first_violation(frames) is None
+
+    out_of_limits = frames.copy()
+    out_of_limits[2, JOINTS.index('l4t')] = -270
+    violation = first_violation(out_of_limits)
+    assert (violation.frame, violation.check) == (2, 'limits')
+
+    jump = frames.copy()
+    jump[1:, JOINTS.index('l2a')] += 20
+    assert first_violation(jump) is None
+    violation = first_violation(jump, durations=np.full(3, 40.))
+    assert (violation.frame, violation.check) == (1, 'velocity')
+    violation = first_violation(frames, start=frames[0] + 30, durations=np.full(3, 40.))
+    assert (violation.frame, violation.check) == (0, 'velocity')
+
+def test_first_violation_clearance(monkeypatch):
+    C = np.array([[11, 11, -10], [0, 17, -10], [-11, 11, -10], [-11, -11, -10], [0, -17, -10], [11, -11, -10]], dtype=float)
+    close = C.copy()
+    # leg 2 end point is put next to the one of leg 1
+    close[1] = C[0] + np.append(np.array(cfg.body.mounts[0][:2]) - cfg.body.mounts[1][:2], 0) + [0, 1, 0]
+    frames = convert_legs_angles_to_servos(*calculate_legs_angles(np.stack([C, close]))[:3])
+    monkeypatch.setattr(cfg.validation, 'min_feet_distance', None)
+    assert first_violation(frames) is None
+    monkeypatch.setattr(cfg.validation, 'min_feet_distance', 5)
+    violation = first_violation(frames)
+    assert (violation.frame, violation.check) == (1, 'clearance')
+
+def test_convert_legs_angles_to_servos():
+    C = np.array([
+        [[11, 11, -10], [0, 17, -10], [-11, 11, -10], [-11, -11, -10], [0, -17, -10], [11, -11, -10]],
+        [[19, 11, -4], [8, 17, -4], [-3, 11, -4], [-11, -11, -12], [0, -17, -12], [11, -11, -12]],
+    ])
+    tettas, alphas, betas, _ = calculate_legs_angles(C)
+    frames = convert_legs_angles_to_servos(tettas, alphas, betas)
+    assert frames.shape == (2, 18)
+    for frame_num in range(2):
+        position = RobotPosition(**{
+            f'l{i + 1}{joint}': float(angles[frame_num, i])
+            for i in range(6)
+            for joint, angles in zip('tab', (tettas, alphas, betas))
+        })
+        converted = convert_legs_angles_C(position).servo_values
+        assert frames[frame_num].tolist() == [converted[joint] for joint in JOINTS]
+        assert legs_tettas_ok(frames[frame_num, 0::3]) == tettas_ok(*tettas[frame_num], logging.getLogger())
+
+def test_ik_table(tmp_path):
+    table = IKTable(cache_dir=str(tmp_path))
+    rng = np.random.default_rng(0)
+    l = rng.uniform(0, 32, 10000)
+    z = rng.uniform(-32, 32, 10000)
+    alphas, betas, reachable = table.lookup(l, z)
+    exact_alphas, exact_betas, exact_reachable = find_legs_angles(l, z)
+    assert (reachable == exact_reachable).all()
+    assert np.nanmax(np.abs(alphas - exact_alphas)) <= math.radians(ik_table.max_error)
+    assert np.nanmax(np.abs(betas - exact_betas)) <= math.radians(ik_table.max_error)
 
 """
 if __name__ == '__main__':
@@ -0,0 +1,33 @@
+import sys
+import os
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from cybernetic_core.geometry.angles import calculate_legs_angles, convert_legs_angles_to_servos
+from cybernetic_core.geometry.workspace import WorkspaceIndex
+from cybernetic_core.kinematics import Kinematics
+from configs import config as cfg
+
+
+def test_workspace_index(tmp_path):
+    index = WorkspaceIndex(cache_dir=str(tmp_path))
+    rng = np.random.default_rng(0)
+    reach = cfg.leg.a + cfg.leg.b
+    C = rng.uniform([-reach, -reach, -reach], [reach, reach, reach], (5000, 6, 3))
+
+    tettas, alphas, betas, reachable = calculate_legs_angles(C)
+    with np.errstate(invalid='ignore'):
+        servo_angles = convert_legs_angles_to_servos(tettas, alphas, betas).reshape(-1, 6, 3)
+        allowed = reachable \
+            & (cfg.angles_limits.tetta.min <= servo_angles[..., 0]) & (servo_angles[..., 0] <= cfg.angles_limits.tetta.max) \
+            & (cfg.angles_limits.alpha.min <= servo_angles[..., 1]) & (servo_angles[..., 1] <= cfg.angles_limits.alpha.max)
+    legs_ok = index.legs_ok(C)
+
+    # index is conservative: a cell is allowed only if all its corners are
+    assert not (legs_ok & ~allowed).any()
+    # and it loses only points within a cell of the border
+    assert (legs_ok == allowed).mean() > 0.99
+    assert allowed.mean() > 0.1
+
+    # the stance is allowed
+    assert index.frames_ok(Kinematics.neutral_C()[np.newaxis]).all()
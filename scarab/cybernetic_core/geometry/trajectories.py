@@ -0,0 +1,54 @@
+import math
+from typing import Tuple
+import numpy as np
+
+
+def bezier_curve(control_points: np.ndarray, s: np.ndarray) -> np.ndarray:
+    """
+    Control points of shape (K, ...), curve parameter s of shape (N).
+    Returns points of shape (N, ...)
+    """
+    control_points = np.asarray(control_points, dtype=float)
+    s = np.asarray(s, dtype=float)[:, np.newaxis]
+    degree = len(control_points) - 1
+    i = np.arange(degree + 1)
+    binomials = np.array([math.comb(degree, k) for k in i])
+    coefficients = binomials * s ** i * (1 - s) ** (degree - i)
+    return np.tensordot(coefficients, control_points, axes=(1, 0))
+
+def swing_control_points(start: np.ndarray, end: np.ndarray, height: float) -> np.ndarray:
+    """
+    Cubic swing arc: leg is lifted vertically, moved and put down vertically.
+    Middle control points are 4/3 of height above the ends, so the top of the arc is at height
+    """
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    lift = np.array([0, 0, 4 / 3 * height])
+    return np.stack([start, start + lift, end + lift, end])
+
+def curve_parameters(points_number: int) -> np.ndarray:
+    # start point itself is not included, it is the current position
+    return np.arange(1, points_number + 1) / points_number
+
+def swing_trajectory(start: np.ndarray, end: np.ndarray, height: float, points_number: int) -> np.ndarray:
+    """
+    start and end points of shape (..., 3). Returns points of shape (points_number, ..., 3)
+    """
+    return bezier_curve(swing_control_points(start, end, height), curve_parameters(points_number))
+
+def smoothstep(s: np.ndarray) -> np.ndarray:
+    return s * s * (3 - 2 * s)
+
+def body_shift_curve(delta: np.ndarray, points_number: int) -> np.ndarray:
+    """
+    Body shift by delta of shape (3), which starts and stops smoothly.
+    Returns shifts from the start of shape (points_number, 3)
+    """
+    return smoothstep(curve_parameters(points_number))[:, np.newaxis] * np.asarray(delta, dtype=float)
+
+def swing_profile(s: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Swing arc of swing_control_points at parameter s:
+    horizontal part of the way done and lift as part of the height
+    """
+    return smoothstep(s), 4 * s * (1 - s)
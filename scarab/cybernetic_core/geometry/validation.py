@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from cybernetic_core.geometry.angles import JOINTS, legs_tettas_ok, calculate_legs_C_points_from_servos
+from configs import config as cfg
+
+
+# neighbour legs around the body, end points of them should not meet
+NEIGHBOUR_LEGS = ((1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 1))
+
+@dataclass
+class Violation:
+    frame: int
+    check: str
+    details: str
+
+    def __str__(self):
+        return f'Frame {self.frame}. {self.check}: {self.details}'
+
+def joints_limits() -> np.ndarray:
+    """
+    angles_limits for every joint, shape (2, 18) in JOINTS order
+    """
+    limits = {'t': cfg.angles_limits.tetta, 'a': cfg.angles_limits.alpha, 'b': cfg.angles_limits.beta}
+    if not cfg.angles_limits.check_beta:
+        limits['b'] = cfg.limit(-np.inf, np.inf)
+    return np.array([[limits[joint[-1]].min for joint in JOINTS], [limits[joint[-1]].max for joint in JOINTS]], dtype=float)
+
+def max_joint_steps(durations: np.ndarray) -> np.ndarray:
+    """
+    durations in ms of shape (T), time servos get to reach every frame, nan if it is not fixed.
+    Returns largest allowed change of a joint for every frame
+    """
+    durations = np.asarray(durations, dtype=float)
+    return np.where(np.isnan(durations), cfg.validation.max_joint_step, durations * cfg.motion_timing.servo_max_speed)
+
+def first_violation(angles: np.ndarray, start: np.ndarray = None, durations: np.ndarray = None) -> Optional[Violation]:
+    """
+    Checks a whole sequence of servo angles of shape (T, 18) in JOINTS order at once:
+    angles_limits, tettas of neighbour legs, speed of joints from frame to frame
+    (from start of shape (18) for the first frame) and distance between end points of neighbour legs,
+    if validation.min_feet_distance is set.
+    Returns the earliest violation or None
+    """
+    angles = np.asarray(angles, dtype=float)
+    frames_number = len(angles)
+    checks = {}
+
+    limits = joints_limits()
+    in_limits = (limits[0] <= angles) & (angles <= limits[1])
+    checks['limits'] = in_limits.all(axis=-1)
+
+    checks['tettas'] = legs_tettas_ok(angles[:, 0::3])
+
+    previous = angles[:-1] if start is None else np.concatenate([np.asarray(start, dtype=float)[np.newaxis], angles[:-1]])
+    steps = np.abs(angles[frames_number - len(previous):] - previous)
+    if durations is None:
+        durations = np.full(frames_number, np.nan)
+    steps_ok = steps <= max_joint_steps(durations[frames_number - len(previous):])[:, np.newaxis]
+    checks['velocity'] = np.concatenate([np.ones(frames_number - len(previous), dtype=bool), steps_ok.all(axis=-1)])
+
+    if cfg.validation.min_feet_distance is not None:
+        feet = calculate_legs_C_points_from_servos(angles)[..., :2] + np.array(cfg.body.mounts, dtype=float)[:, :2]
+        neighbours = np.array(NEIGHBOUR_LEGS) - 1
+        distances = np.linalg.norm(feet[:, neighbours[:, 0]] - feet[:, neighbours[:, 1]], axis=-1)
+        checks['clearance'] = (distances >= cfg.validation.min_feet_distance).all(axis=-1)
+
+    violation = None
+    for check, ok in checks.items():
+        if ok.all():
+            continue
+        frame = int(np.argmin(ok))
+        if violation is not None and violation.frame <= frame:
+            continue
+        if check == 'limits':
+            details = {JOINTS[joint]: float(angles[frame, joint]) for joint in np.flatnonzero(~in_limits[frame])}
+        elif check == 'tettas':
+            details = angles[frame, 0::3].tolist()
+        elif check == 'velocity':
+            step = steps[frame - (frames_number - len(previous))]
+            joint = int(np.argmax(step))
+            details = f'{JOINTS[joint]} changed by {round(float(step[joint]), 2)}'
+        else:
+            pair = int(np.argmin(distances[frame]))
+            details = f'legs {NEIGHBOUR_LEGS[pair]} are {round(float(distances[frame, pair]), 2)} cm apart'
+        violation = Violation(frame, check, str(details))
+    return violation
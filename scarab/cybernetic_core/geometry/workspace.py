@@ -0,0 +1,132 @@
+import os
+import glob
+from typing import Optional
+import numpy as np
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from cybernetic_core.geometry.angles import (
+    find_legs_angles,
+    convert_legs_tettas,
+    legs_tettas_ok,
+)
+from configs.config import leg, angles_limits, workspace as workspace_cfg
+import configs.code_config as code_config
+
+
+class WorkspaceIndex:
+    """
+    Precomputed reachability of leg end points, to check whole sequences before any servo moves.
+    Alpha and beta depend only on horizontal distance l and height z of the end point,
+    so they are checked on a (l, z) grid of cells, stored as .npy in code_config.cache_dir.
+    A cell is allowed if IK has a decision in all its corners and alpha, beta are within angles_limits
+    (beta only with angles_limits.check_beta).
+    Tetta depends only on x, y and on the leg number, it is checked against angles_limits per leg,
+    tettas of neighbour legs are checked with the rules of tettas_ok.
+    File name contains leg dimensions and limits, so index is rebuilt when they change.
+    """
+    def __init__(self, cache_dir: str = code_config.cache_dir, rebuild: bool = False):
+        self.step = workspace_cfg.step
+        self.reach = leg.a + leg.b
+        self.z_min = -self.reach
+        self.nl = int(round(self.reach / self.step)) + 1
+        self.nz = int(round(2 * self.reach / self.step)) + 1
+
+        self.cache_dir = cache_dir
+        beta_limits = f'_beta{angles_limits.beta.min}_{angles_limits.beta.max}' if angles_limits.check_beta else ''
+        self.path = os.path.join(
+            cache_dir,
+            f'workspace_a{leg.a}_b{leg.b}_d{leg.d}'
+            f'_alpha{angles_limits.alpha.min}_{angles_limits.alpha.max}'
+            f'{beta_limits}_step{self.step}.npy'
+        )
+        if rebuild or not os.path.exists(self.path):
+            self.build()
+        self.cells = np.load(self.path, mmap_mode='r')
+
+    def build(self) -> None:
+        l = np.arange(self.nl) * self.step
+        z = self.z_min + np.arange(self.nz) * self.step
+        grid_l, grid_z = np.meshgrid(l, z, indexing='ij')
+
+        alphas, betas, reachable = find_legs_angles(grid_l, grid_z)
+        with np.errstate(invalid='ignore'):
+            servo_alphas = np.degrees(alphas)
+            servo_betas = np.degrees(betas) - 90
+            nodes = reachable \
+                & (angles_limits.alpha.min <= servo_alphas) & (servo_alphas <= angles_limits.alpha.max)
+            if angles_limits.check_beta:
+                nodes &= (angles_limits.beta.min <= servo_betas) & (servo_betas <= angles_limits.beta.max)
+        cells = nodes[:-1, :-1] & nodes[1:, :-1] & nodes[:-1, 1:] & nodes[1:, 1:]
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for stale_index in glob.glob(os.path.join(self.cache_dir, 'workspace_*.npy')):
+            os.remove(stale_index)
+        tmp_path = self.path + '.tmp.npy'
+        np.save(tmp_path, cells)
+        os.replace(tmp_path, self.path)
+
+    def legs_ok(self, C: np.ndarray) -> np.ndarray:
+        """
+        C has shape (..., 6, 3). Returns mask of shape (..., 6), True for allowed end points
+        """
+        C = np.asarray(C, dtype=float)
+        x, y, z = C[..., 0], C[..., 1], C[..., 2]
+        u = np.hypot(x, y) / self.step
+        v = (z - self.z_min) / self.step
+        inside = (u < self.nl - 1) & (v >= 0) & (v < self.nz - 1)
+        i = np.clip(u.astype(int), 0, self.nl - 2)
+        j = np.clip(np.floor(v).astype(int), 0, self.nz - 2)
+
+        servo_tettas = convert_legs_tettas(np.arctan2(y, x))
+        tettas_in_limits = (angles_limits.tetta.min <= servo_tettas) & (servo_tettas <= angles_limits.tetta.max)
+
+        return inside & self.cells[i, j] & tettas_in_limits
+
+    def frames_ok(self, C: np.ndarray) -> np.ndarray:
+        """
+        C has shape (..., 6, 3). Returns mask of shape (...), True for frames,
+        where all legs are allowed and tettas of neighbour legs are fine
+        """
+        C = np.asarray(C, dtype=float)
+        servo_tettas = np.round(convert_legs_tettas(np.arctan2(C[..., 1], C[..., 0])), 2)
+        return self.legs_ok(C).all(axis=-1) & legs_tettas_ok(servo_tettas)
+
+    def first_bad_frame(self, C: np.ndarray) -> Optional[int]:
+        frames_ok = self.frames_ok(C)
+        if frames_ok.all():
+            return None
+        return int(np.argmin(frames_ok))
+
+    def feasible_body_shift(self, C: np.ndarray, start_C: np.ndarray) -> Optional[float]:
+        """
+        Finds the smallest body shift along z, that makes the whole sequence feasible.
+        C are keyframes of shape (T, 6, 3), start_C is current position of shape (6, 3).
+        Body is shifted first, so start_C with the shift is checked too.
+        Returns None if there is no such shift within workspace.max_body_shift
+        """
+        shifts = np.arange(0, workspace_cfg.max_body_shift + workspace_cfg.body_shift_step, workspace_cfg.body_shift_step)
+        # 0, step, -step, 2*step, -2*step, ...
+        shifts = np.stack([shifts, -shifts], axis=-1).ravel()[1:]
+
+        frames = np.concatenate([np.asarray(start_C, dtype=float)[np.newaxis], C])
+        shifted = frames[np.newaxis] - np.stack([np.zeros_like(shifts), np.zeros_like(shifts), shifts], axis=-1)[:, np.newaxis, np.newaxis, :]
+        feasible = self.frames_ok(shifted).all(axis=-1)
+        if not feasible.any():
+            return None
+        return float(shifts[np.argmax(feasible)])
+
+_workspace_index = None
+
+def get_workspace_index() -> WorkspaceIndex:
+    global _workspace_index
+    if _workspace_index is None:
+        _workspace_index = WorkspaceIndex()
+    return _workspace_index
+
+
+if __name__ == '__main__':
+    # build step: python workspace.py
+    index = WorkspaceIndex(rebuild=True)
+    print(f'Workspace index {index.nl - 1}x{index.nz - 1} saved to {index.path}')
@@ -1,20 +1,26 @@
 import math
 import copy
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from configs import config as cfg
 from cybernetic_core.geometry.angles import (
+    DistanceException,
     TettasException,
+    AnglesException,
     RobotPosition, 
-    calculate_leg_angles, 
+    calculate_legs_angles, 
     turn_on_angle, 
-    convert_legs_angles_C, 
-    calculate_C_point,
-    tettas_ok
+    convert_legs_angles_to_servos, 
+    calculate_legs_C_points,
+    calculate_legs_jacobian,
+    calculate_legs_angles_differential
 )
+from cybernetic_core.geometry.trajectories import swing_trajectory, body_shift_curve
+from cybernetic_core.geometry.validation import first_violation
+from cybernetic_core.geometry.body_pose import rotation_matrix, transform_legs_C, legs_plane_angles, legs_yaw
 from cybernetic_core.geometry.lines import Point, LinearFunc, calculate_intersection, move_on_a_line
 import configs.code_config as code_config
 import logging.config
@@ -81,201 +87,300 @@ def move_robot_legs(leg1_x, leg1_y, leg2_x, leg2_y, leg3_x, leg3_y, leg4_x, leg4
     return leg1_x, leg1_y, leg2_x, leg2_y, leg3_x, leg3_y, leg4_x, leg4_y
 
 class Leg:
-    def __init__(self, C: Point):
-        logging.config.dictConfig(code_config.logger_config)
-        self.logger = logging.getLogger('main_logger')
-        self.C = C
-        self.update_angles()
-
-    def update_angles(self):
-        # tetta is not fully correct, because it uses atan2
-        # tetta is corrected via convert_tetta function
-        #print(self.O, self.D)
-        self.tetta, self.alpha, self.beta = calculate_leg_angles(self.C, self.logger)
-        self.logger.info(f'Leg angles: {math.degrees(self.tetta), math.degrees(self.alpha), math.degrees(self.beta)}')
-
-    def move_mount_point(self, delta_x, delta_y, delta_z):
-        self.C.move(-delta_x, -delta_y, -delta_z)
-        self.update_angles()
-    
-    def move_end_point(self, delta_x, delta_y, delta_z):
-        #print(f'C before: {self.C}')
-        self.C.move(delta_x, delta_y, delta_z)
-        #print(f'C after: {self.C}')
-        self.update_angles()
-    
+    """
+    View of a single leg of the Kinematics model.
+    Leg state itself is kept in the arrays of the Kinematics object
+    """
+    def __init__(self, kinematics: 'Kinematics', leg_num: int):
+        self.kinematics = kinematics
+        self.index = leg_num - 1
+        self.solved_C = None
+        self.solved_angles = None
+
+    @property
+    def C(self) -> Point:
+        x, y, z = self.kinematics.C[self.index]
+        return Point(float(x), float(y), float(z))
+
+    # tetta is not fully correct, because it uses atan2
+    # tetta is corrected via convert_tetta function
+    @property
+    def tetta(self) -> float:
+        return self.angles[0]
+
+    @property
+    def alpha(self) -> float:
+        return self.angles[1]
+
+    @property
+    def beta(self) -> float:
+        return self.angles[2]
+
+    @property
+    def angles(self) -> Tuple[float, float, float]:
+        """
+        Only this leg is solved, and only again when its end point is changed
+        """
+        C = self.kinematics.C[self.index]
+        if self.solved_C is None or not np.array_equal(C, self.solved_C):
+            tetta, alpha, beta, reachable = calculate_legs_angles(C)
+            if not reachable:
+                raise DistanceException(f'No decisions for leg {self.index + 1}. C: {C.tolist()}')
+            self.solved_angles = float(tetta), float(alpha), float(beta)
+            self.solved_C = C.copy()
+        return self.solved_angles
+
     def __repr__(self):
         return f't: {round(math.degrees(self.tetta), 2)}, a: {round(math.degrees(self.alpha), 2)}, b: {round(math.degrees(self.beta), 2)}'
 
+class Keyframes:
+    """
+    Bounded buffer of keyframes, preallocated for keyframes.buffer_size frames.
+    Frames are numbered from the creation of the buffer, frame i is kept in slot i % size,
+    so old frames are overwritten by new ones.
+    Frames [solved, added) have end points, but no servo angles yet
+    """
+    def __init__(self, size: int = cfg.keyframes.buffer_size):
+        self.size = size
+        self.points = np.empty((size, 6, 3))
+        self.angles = np.empty((size, 18))
+        self.move_types = [None] * size
+        self.added = 0
+        self.solved = 0
+
+    @property
+    def pending(self) -> int:
+        return self.added - self.solved
+
+    def add(self, move_type: str, C: np.ndarray) -> None:
+        slot = self.added % self.size
+        self.points[slot] = C
+        self.move_types[slot] = move_type
+        self.added += 1
+
+    def slots(self, start: int, stop: int) -> np.ndarray:
+        if start < self.added - self.size:
+            raise IndexError(f'Frames from {start} are overwritten, buffer keeps last {self.size} frames')
+        return np.arange(start, stop) % self.size
+
 class Kinematics:
     """
     Either take initial position from config
     or provide horizontal x, y and vertical v
     or provide exact angles to create a kinematic model
+
+    End points of all legs are kept in C array of shape (6, 3),
+    row i is leg i + 1. Moves only change C, every snapshot stores a copy of it as a keyframe.
+    Angles for new keyframes are solved at once, when they are read,
+    every keyframe is converted to servo angles only once.
+    If model is built from angles, legs that stay within ik_differential.max_delta
+    from their start points are solved with jacobian of the start position
     """
     def __init__(self, robot_position: RobotPosition = None, init_snapshot=True):
         logging.config.dictConfig(code_config.logger_config)
         self.logger = logging.getLogger('main_logger')
 
+        self.anchor = None
         if robot_position is None:
-            self.legs = self.initiate_legs()
+            self.C = self.initiate_legs()
         else:
-            self.legs = self.build_legs_from_angles(robot_position)
-            
-        self.angles_history = []
+            self.C = self.build_legs_from_angles(robot_position)
+        self.legs = {leg_num: Leg(self, leg_num) for leg_num in range(1, 7)}
+
+        self.keyframes = Keyframes()
+        self.history_start = 0
         if init_snapshot:
             self.add_angles_snapshot('init')
-    
-    def check_tettas(self):
-        if not tettas_ok(
-            self.legs[1].tetta,
-            self.legs[2].tetta,
-            self.legs[3].tetta,
-            self.legs[4].tetta,
-            self.legs[5].tetta,
-            self.legs[6].tetta,
-            self.logger
-        ):
-            raise TettasException('Bad tettas')
-
-    #def move_leg_endpoint(self, legnum, delta_x, delta_y, delta_z):
-    #    self.legs[legnum].move_end_point(delta_x, delta_y, delta_z)
-
-    def move_leg_endpoint(self, leg_num, delta_x, delta_y, delta_z, snapshot_type='endpoint', add_snapshot=False):        
-        self.legs[leg_num].move_end_point(delta_x, delta_y, delta_z)
+
+    def solve(self, C: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if C is None:
+            C = self.C
+        tettas, alphas, betas, reachable = calculate_legs_angles(C)
+        if not reachable.all():
+            unreachable = [leg_num for leg_num, ok in enumerate(reachable, 1) if not ok]
+            raise DistanceException(f'No decisions for legs {unreachable}. C: {C.tolist()}')
+        return tettas, alphas, betas
+
+    def move_leg_endpoint(self, leg_num, delta_x, delta_y, delta_z, snapshot_type='endpoint', add_snapshot=False):
+        self.C[leg_num - 1] += [delta_x, delta_y, delta_z]
         if add_snapshot:
             self.add_angles_snapshot(snapshot_type)
-        self.check_tettas()
     
     def move_leg_mountpoint(self, legnum, delta_x, delta_y, delta_z):
-        self.logger.info(f'Leg {legnum}. {self.legs[legnum]}')
-        self.legs[legnum].move_mount_point(delta_x, delta_y, delta_z)
-        self.logger.info(f'Leg {legnum}. {self.legs[legnum]}')
+        self.logger.info(f'Leg {legnum}. C: {self.C[legnum - 1].tolist()}')
+        self.C[legnum - 1] -= [delta_x, delta_y, delta_z]
+        self.logger.info(f'Leg {legnum}. C: {self.C[legnum - 1].tolist()}')
         
 
     def reset_history(self):
-        self.angles_history = []
+        self.history_start = self.keyframes.added
 
     def add_angles_snapshot(self, move_type: str = 'unknown'):
-        rp = RobotPosition(
-            l1t=self.legs[1].tetta,
-            l1a=self.legs[1].alpha,
-            l1b=self.legs[1].beta,
-
-            l2t=self.legs[2].tetta,
-            l2a=self.legs[2].alpha,
-            l2b=self.legs[2].beta,
-
-            l3t=self.legs[3].tetta,
-            l3a=self.legs[3].alpha,
-            l3b=self.legs[3].beta,
-
-            l4t=self.legs[4].tetta,
-            l4a=self.legs[4].alpha,
-            l4b=self.legs[4].beta,
-
-            l5t=self.legs[5].tetta,
-            l5a=self.legs[5].alpha,
-            l5b=self.legs[5].beta,
-
-            l6t=self.legs[6].tetta,
-            l6a=self.legs[6].alpha,
-            l6b=self.legs[6].beta,
+        if self.keyframes.pending == self.keyframes.size:
+            self.solve_pending()
+        self.keyframes.add(move_type, self.C)
+
+    @property
+    def keyframe_points(self) -> np.ndarray:
+        """
+        End points of all keyframes since reset_history, shape (T, 6, 3)
+        """
+        return self.keyframes.points[self.keyframes.slots(self.history_start, self.keyframes.added)]
+
+    def solve_keyframes(self, C: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Same contract as calculate_legs_angles for C of shape (T, 6, 3).
+        Full IK is skipped if all end points are close enough to the anchor
+        """
+        if self.anchor is None:
+            return calculate_legs_angles(C)
+
+        anchor_C, anchor_tettas, anchor_alphas, anchor_betas, inverse_jacobian, jacobian_ok = self.anchor
+        delta_C = C - anchor_C
+        differential = jacobian_ok & (np.linalg.norm(delta_C, axis=-1) <= cfg.ik_differential.max_delta)
+        tettas, alphas, betas = calculate_legs_angles_differential(
+            anchor_tettas, anchor_alphas, anchor_betas, inverse_jacobian, delta_C
+        )
+        if differential.all():
+            return tettas, alphas, betas, np.ones(differential.shape, dtype=bool)
+
+        exact_tettas, exact_alphas, exact_betas, reachable = calculate_legs_angles(C)
+        return (
+            np.where(differential, tettas, exact_tettas),
+            np.where(differential, alphas, exact_alphas),
+            np.where(differential, betas, exact_betas),
+            differential | reachable
         )
 
-        #new_move = MoveSnapshot(move_type, convert_legs_angles(angles_in))
-        new_move = MoveSnapshot(move_type, rp)
-        self.angles_history.append(new_move)
+    def solve_pending(self) -> None:
+        """
+        Solves all keyframes, that are not solved yet, in one call
+        """
+        keyframes = self.keyframes
+        if keyframes.pending == 0:
+            return
+        slots = keyframes.slots(keyframes.solved, keyframes.added)
+        C = keyframes.points[slots]
+
+        tettas, alphas, betas, reachable = self.solve_keyframes(C)
+        if not reachable.all():
+            frame, leg_index = np.argwhere(~reachable)[0]
+            raise DistanceException(f'No decisions for leg {leg_index + 1} in frame {keyframes.solved + frame}. C: {C[frame, leg_index].tolist()}')
+
+        angles = convert_legs_angles_to_servos(tettas, alphas, betas)
+        start = None
+        if keyframes.solved > 0 and keyframes.added - keyframes.solved < keyframes.size:
+            start = keyframes.angles[(keyframes.solved - 1) % keyframes.size]
+        durations = np.array([
+            cfg.trajectories.period * cfg.trajectories.overlap if keyframes.move_types[slot] == 'swing' else np.nan
+            for slot in slots
+        ])
+        violation = first_violation(angles, start, durations)
+        if violation is not None:
+            violation.frame += keyframes.solved
+            self.logger.error(f'Bad keyframe. {violation}')
+            if violation.check == 'tettas':
+                raise TettasException(f'Bad tettas. {violation}')
+            raise AnglesException(str(violation))
+
+        keyframes.angles[slots] = angles
+        keyframes.solved = keyframes.added
+
+    def frames_since(self, index: int) -> Tuple[List[str], np.ndarray, int]:
+        """
+        Keyframes from index on, only new keyframes are solved.
+        Returns move types, servo angles of shape (n, 18) in JOINTS order
+        and the index to read next frames from
+        """
+        self.solve_pending()
+        slots = self.keyframes.slots(index, self.keyframes.added)
+        move_types = [self.keyframes.move_types[slot] for slot in slots]
+        return move_types, self.keyframes.angles[slots], self.keyframes.added
+
+    @property
+    def trajectory(self) -> Tuple[List[str], np.ndarray]:
+        """
+        All keyframes since reset_history.
+        Returns move types and servo angles of shape (T, 18) in JOINTS order
+        """
+        move_types, angles, _ = self.frames_since(self.history_start)
+        return move_types, angles
 
     @property
     def height(self):
-        return sum([(leg.O.z - leg.C.z) for leg in self.legs.values()])/4
+        return -float(np.mean(self.C[:, 2]))
         #return self.current_legs_offset_v
 
     @property
     def sequence(self):
         sequence = []
-        for move in self.angles_history:
-            sequence.append(MoveSnapshot(move.move_type, convert_legs_angles_C(move.angles_snapshot, self.logger)))
+        move_types, angles = self.trajectory
+        for move_type, frame in zip(move_types, angles):
+            sequence.append(MoveSnapshot(move_type, RobotPosition.from_array(frame)))
         return sequence
-        #return self.angles_history
     
-    def build_legs_from_angles(self, rp: RobotPosition):
-        C1 = calculate_C_point(rp.l1t, rp.l1a, rp.l1b)
-        self.logger.info('[Init] Building leg 1')
-        #print(f'Building leg 1: {math.degrees(alpha1), math.degrees(beta1), math.degrees(gamma1)}')
-        Leg1 = Leg(C1)
-
-        C2 = calculate_C_point(rp.l2t, rp.l2a, rp.l2b)
-        self.logger.info('[Init] Building leg 2')
-        Leg2 = Leg(C2)
-        #print(f'Leg2.2:{[round(math.degrees(x), 2) for x in [Leg2.tetta, Leg2.alpha, Leg2.beta, Leg2.gamma]]}')
+    def build_legs_from_angles(self, rp: RobotPosition) -> np.ndarray:
+        angles = rp.array.reshape(6, 3)
+        C = np.round(calculate_legs_C_points(angles[:, 0], angles[:, 1], angles[:, 2]), 2)
 
-        C3 = calculate_C_point(rp.l3t, rp.l3a, rp.l3b)
-        self.logger.info('[Init] Building leg 3')
-        Leg3 = Leg(C3)
+        if cfg.ik_differential.enabled:
+            self.anchor = self.build_anchor(angles[:, 0], angles[:, 1], angles[:, 2])
 
-        C4 = calculate_C_point(rp.l4t, rp.l4a, rp.l4b)
-        self.logger.info('[Init] Building leg 4')
-        Leg4 = Leg(C4)
+        self.logger.info('[Init] Build successful')
 
-        C5 = calculate_C_point(rp.l5t, rp.l5a, rp.l5b)
-        self.logger.info('[Init] Building leg 5')
-        Leg5 = Leg(C5)
+        return C
 
-        C6 = calculate_C_point(rp.l6t, rp.l6a, rp.l6b)
-        self.logger.info('[Init] Building leg 6')
-        Leg6 = Leg(C6)
+    def build_anchor(self, tettas: np.ndarray, alphas: np.ndarray, betas: np.ndarray) -> tuple:
+        """
+        Start angles with exact (not rounded) end points and inverse jacobians for the differential IK
+        """
+        anchor_C = calculate_legs_C_points(tettas, alphas, betas)
 
-        self.logger.info('[Init] Build successful')
+        jacobian = calculate_legs_jacobian(tettas, alphas, betas)
+        jacobian_ok = np.linalg.cond(jacobian) < cfg.ik_differential.max_condition
+        inverse_jacobian = np.zeros_like(jacobian)
+        inverse_jacobian[jacobian_ok] = np.linalg.inv(jacobian[jacobian_ok])
 
-        return {1: Leg1, 2: Leg2, 3: Leg3, 4: Leg4, 5: Leg5, 6: Leg6}
+        return anchor_C, tettas, alphas, betas, inverse_jacobian, jacobian_ok
 
     @property
     def current_position(self):
-        #return convert_legs_angles_back(self.sequence[-1].angles_snapshot)
-        return self.angles_history[-1].angles_snapshot
-
-    def initiate_legs(self):
-        C1 = Point(cfg.robot.horizontal_x - cfg.robot.x_offset,
-                   cfg.robot.horizontal_y - cfg.robot.y_offset,
-                   -cfg.robot.vertical)
-        self.logger.info('[Init] Initiating leg 1')
-        Leg1 = Leg(C1)
-
-        C2 = Point(cfg.robot.x_offset,
-                   cfg.robot.horizontal_y - cfg.robot.y_offset + cfg.robot.middle_leg_offset,
-                   -cfg.robot.vertical)
-        self.logger.info('[Init] Initiating leg 2')
-        Leg2 = Leg(C2)
-
-        C3 = Point(-cfg.robot.horizontal_x - cfg.robot.x_offset,
-                   cfg.robot.horizontal_y - cfg.robot.y_offset,
-                   -cfg.robot.vertical)
-        self.logger.info('[Init] Initiating leg 3')
-        Leg3 = Leg(C3)
-
-        C4 = Point(-cfg.robot.horizontal_x - cfg.robot.x_offset,
-                   -cfg.robot.horizontal_y - cfg.robot.y_offset,
-                   -cfg.robot.vertical)
-        self.logger.info('[Init] Initiating leg 4')
-        Leg4 = Leg(C4)
-
-        C5 = Point(- cfg.robot.x_offset,
-                   -cfg.robot.horizontal_y - cfg.robot.y_offset - cfg.robot.middle_leg_offset,
-                   -cfg.robot.vertical)
-        self.logger.info('[Init] Initiating leg 5')
-        Leg5 = Leg(C5)
-
-        C6 = Point(cfg.robot.horizontal_x - cfg.robot.x_offset,
-                   -cfg.robot.horizontal_y - cfg.robot.y_offset,
-                   -cfg.robot.vertical)
-        self.logger.info('[Init] Initiating leg 6')
-        Leg6 = Leg(C6)
-
+        if self.keyframes.added > self.history_start:
+            C = self.keyframes.points[(self.keyframes.added - 1) % self.keyframes.size]
+        else:
+            C = self.C
+        tettas, alphas, betas, reachable = self.solve_keyframes(C[np.newaxis])
+        if not reachable.all():
+            raise DistanceException(f'No decisions for current position. C: {C.tolist()}')
+        return RobotPosition.from_array(np.stack([tettas[0], alphas[0], betas[0]], axis=-1))
+
+    def initiate_legs(self) -> np.ndarray:
+        C = self.neutral_C()
         self.logger.info('[Init] Initialization successful')
-
-        return {1: Leg1, 2: Leg2, 3: Leg3, 4: Leg4, 5: Leg5, 6: Leg6}
+        return C
+
+    @staticmethod
+    def neutral_C() -> np.ndarray:
+        return np.array([
+            [cfg.robot.horizontal_x - cfg.robot.x_offset,
+             cfg.robot.horizontal_y - cfg.robot.y_offset,
+             -cfg.robot.vertical],
+            [cfg.robot.x_offset,
+             cfg.robot.horizontal_y - cfg.robot.y_offset + cfg.robot.middle_leg_offset,
+             -cfg.robot.vertical],
+            [-cfg.robot.horizontal_x - cfg.robot.x_offset,
+             cfg.robot.horizontal_y - cfg.robot.y_offset,
+             -cfg.robot.vertical],
+            [-cfg.robot.horizontal_x - cfg.robot.x_offset,
+             -cfg.robot.horizontal_y - cfg.robot.y_offset,
+             -cfg.robot.vertical],
+            [- cfg.robot.x_offset,
+             -cfg.robot.horizontal_y - cfg.robot.y_offset - cfg.robot.middle_leg_offset,
+             -cfg.robot.vertical],
+            [cfg.robot.horizontal_x - cfg.robot.x_offset,
+             -cfg.robot.horizontal_y - cfg.robot.y_offset,
+             -cfg.robot.vertical],
+        ], dtype=float)
     
     ################## MOVEMENTS START HERE ##################
     def leg_movement(self, leg_num, leg_delta, snapshot=True):
@@ -291,16 +396,65 @@ class Kinematics:
         if delta_x == delta_y == delta_z == 0:
             return
 
-        for leg_num in self.legs.keys():
-            self.move_leg_mountpoint(leg_num, delta_x, delta_y, delta_z)
-        self.check_tettas()
+        self.C -= [delta_x, delta_y, delta_z]
         if snapshot:
             self.add_angles_snapshot('body')
 
+    @property
+    def mounts(self) -> np.ndarray:
+        return np.array(cfg.body.mounts, dtype=float)
+
+    def body_orientation(self) -> Tuple[float, float, float]:
+        """
+        Roll, pitch and yaw of the body in degrees. Roll and pitch are relative to the plane of legs end points,
+        yaw is relative to the neutral position of legs
+        """
+        roll, pitch = legs_plane_angles(self.C, self.mounts)
+        yaw = legs_yaw(self.C, self.neutral_C(), self.mounts)
+        return math.degrees(roll), math.degrees(pitch), math.degrees(yaw)
+
+    def add_body_poses(self, C: np.ndarray, snapshot=True) -> None:
+        for frame_C in C:
+            self.C = frame_C.copy()
+            if snapshot:
+                self.add_angles_snapshot('body')
+
+    def body_pose(self, delta_x=0, delta_y=0, delta_z=0, roll=0, pitch=0, yaw=0, frames=1, snapshot=True):
+        """
+        6-DOF body move relative to the current body position, angles in degrees.
+        Legs end points stay on the ground, all frames are transformed at once
+        """
+        self.logger.info(f'Body pose [{delta_x}, {delta_y}, {delta_z}], [{roll}, {pitch}, {yaw}]')
+        steps = np.arange(1, frames + 1) / frames
+        rotation = rotation_matrix(*(np.radians(angle) * steps for angle in (roll, pitch, yaw)))
+        translation = steps[:, np.newaxis] * [delta_x, delta_y, delta_z]
+        self.add_body_poses(transform_legs_C(self.C, self.mounts, translation, rotation), snapshot)
+
+    def body_orientation_to(self, roll=None, pitch=None, yaw=None, frames=cfg.body.pose_frames, snapshot=True):
+        """
+        Rotates body to the absolute orientation of body_orientation, angles in degrees. None keeps the current angle
+        """
+        current = np.radians(self.body_orientation())
+        target = np.array([c if t is None else math.radians(t) for c, t in zip(current, (roll, pitch, yaw))])
+        self.logger.info(f'Body orientation {np.degrees(current).round(2).tolist()} -> {np.degrees(target).round(2).tolist()}')
+
+        steps = np.arange(1, frames + 1)[:, np.newaxis] / frames
+        # rotation from the current body frame to the target ones
+        rotation = np.einsum('ji,...jk->...ik', rotation_matrix(*current), rotation_matrix(*(current + (target - current) * steps).T))
+        self.add_body_poses(transform_legs_C(self.C, self.mounts, np.zeros(3), rotation), snapshot)
+
+    def look_on_angle(self, angle: float):
+        self.body_orientation_to(pitch=angle)
+
+    def look_on_angle_new(self, up: bool = True):
+        _, pitch, _ = self.body_orientation()
+        target = pitch + (cfg.body.look_angle if up else -cfg.body.look_angle)
+        self.body_orientation_to(pitch=max(-cfg.body.max_look_angle, min(cfg.body.max_look_angle, target)))
+
     def reset(self):
         self.logger.info('Processing reset command')
         self.body_to_center()
-        delta_z = -self.legs[1].C.z - cfg.robot.vertical
+        delta_z = -self.C[0, 2] - cfg.robot.vertical
         self.body_movement(0, 0, -delta_z)
 
     # ?
@@ -393,13 +547,7 @@ class Kinematics:
     
     def body_delta_xy(self, delta_y=cfg.robot.y_offset, delta_x=cfg.robot.x_offset):
         # move body to center
-        avg_c_x, avg_c_y = 0, 0
-        for leg in self.legs.values():
-            avg_c_x += leg.C.x
-            avg_c_y += leg.C.y
-
-        avg_c_x /= 6
-        avg_c_y /= 6
+        avg_c_x, avg_c_y = self.C[:, :2].mean(axis=0)
 
         return [round(-avg_c_x - delta_x, 2),
                 round(-avg_c_y - delta_y, 2)]
@@ -464,12 +612,30 @@ class Kinematics:
 
         self.body_to_center()
 
+    def swing_legs(self, legs: List[int], delta_x: float, delta_y: float, body_delta_x: float = 0, body_delta_y: float = 0) -> None:
+        """
+        Legs are moved by delta along swing arcs, while body is shifted by body delta along a smooth curve.
+        Adds trajectories.swing_points keyframes of type 'swing', to be streamed at a fixed period
+        """
+        points_number = cfg.trajectories.swing_points
+        indices = np.array(legs) - 1
+        start_C = self.C.copy()
+        swing = swing_trajectory(start_C[indices], start_C[indices] + [delta_x, delta_y, 0], cfg.robot.leg_up, points_number)
+        body_shift = body_shift_curve([body_delta_x, body_delta_y, 0], points_number)
+        for frame in range(points_number):
+            self.C[:] = start_C - body_shift[frame]
+            self.C[indices] = swing[frame] - body_shift[frame]
+            self.add_angles_snapshot('swing')
+
     """
     Two phased moves
     """
     # phased 2-legged movement
     def move_2_legs_phased_13(self, delta_x: int = 0, delta_y: int = 0) -> None:
-        
+        if cfg.trajectories.swing_points:
+            self.swing_legs([1, 3, 5], delta_x, delta_y, round(delta_x / 2, 1), round(delta_y / 2, 1))
+            return
+
         #self.body_movement(round(delta_x / 4, 1), round(delta_y / 4, 1), 0)
 
         for leg_num in [1, 3, 5]:
@@ -484,7 +650,10 @@ class Kinematics:
         self.add_angles_snapshot('endpoints')
         
     def move_2_legs_phased_24(self, delta_x: int = 0, delta_y: int = 0) -> None:
-        
+        if cfg.trajectories.swing_points:
+            self.swing_legs([2, 4, 6], delta_x, delta_y, round(delta_x / 2, 1), round(delta_y / 2, 1))
+            return
+
         #self.body_movement(round(delta_x / 4, 1), round(delta_y / 4, 1), 0)
 
         for leg_num in [2, 4, 6]:
@@ -684,12 +853,12 @@ class Kinematics:
             )
     
     def move_body_abs(self, z):
-        min_z = min([leg.C.z for leg in self.legs.values()])
+        min_z = self.C[:, 2].min()
         print(f'Min_z, z, z + min_z: {min_z, z, z + min_z}')
         self.body_movement(0, 0, z + min_z)
 
     def move_leg_endpoint_abs(self, leg_num, leg_delta, snapshot_type='endpoint', add_snapshot=True):
-        min_z = min([leg.C.z for leg in self.legs.values()])
+        min_z = self.C[:, 2].min()
         
         leg = self.legs[leg_num]
         target_x = leg_delta[0]
@@ -1,16 +1,16 @@
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 import sys
 import os
 import math
+import numpy as np
+import joblib
 from joblib import Memory
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from cybernetic_core.kinematics import Kinematics
 from configs import config as cfg
 from configs import code_config
-from cybernetic_core.geometry.angles import RobotPosition
-
-#from functools import cache
-memory = Memory(code_config.cache_dir, verbose=0)
+from cybernetic_core.geometry.angles import RobotPosition, POSITION_QUANTUM, calculate_legs_C_points
+from cybernetic_core.cybernetic_utils.moves import MoveSnapshot
 
 UP_OR_DOWN_CM   = cfg.moves.up_or_down_cm
 FORWARD_BODY_CM = cfg.moves.move_body_cm
@@ -29,14 +29,23 @@ class VirtualRobot():
         self.logger = logger
         self.side_look_angle = 0
         self.vertical_look_angle = 0
+        # GaitGraph, built at startup, is checked before SequenceCache
+        self.gait_graph = None
 
     def get_sequence(self, command: str, robot_position: RobotPosition, kwargs=None):
+        if self.gait_graph is not None:
+            solved = self.gait_graph.lookup(command, robot_position, kwargs)
+            if solved is not None:
+                move_types, angles, new_position = solved
+                return build_sequence(move_types, angles), new_position
+        # cached on disk, see SequenceCache
         sequence, new_position = get_sequence_for_command_cached(command, robot_position, kwargs)
         return sequence, new_position
 
     def get_height(self, robot_position: RobotPosition):
-        fk = Kinematics(robot_position=robot_position)
-        return fk.height + 13
+        angles = robot_position.array.reshape(6, 3)
+        C = calculate_legs_C_points(angles[:, 0], angles[:, 1], angles[:, 2])
+        return -C[:, 2].mean() + 13
 
     def get_leg_angle_to_surface(self, robot_position: RobotPosition, leg_num: int):
         fk = Kinematics(robot_position=robot_position)
@@ -44,14 +53,133 @@ class VirtualRobot():
         return math.degrees(fk.legs[leg_num].alpha - fk.legs[leg_num].beta)
 
     def get_legs_zs(self, robot_position: RobotPosition):
-        fk = Kinematics(robot_position=robot_position)
-        return [leg.O.z - leg.C.z for leg in fk.legs.values()]
+        # mount points are at z = 0
+        angles = robot_position.array.reshape(6, 3)
+        C = calculate_legs_C_points(angles[:, 0], angles[:, 1], angles[:, 2])
+        return (-C[:, 2]).tolist()
 
-#@cache
-#@memory.cache
-def get_sequence_for_command_cached(command: str, robot_position: RobotPosition, kwargs=None):
+def get_trajectory_for_command(command: str, robot_position: RobotPosition, kwargs=None) -> Tuple[List[str], np.ndarray, RobotPosition]:
+    """
+    Collects all keyframes of a command into a (T, 6, 3) array and solves them in one call.
+    Returns move types, servo angles of shape (T, 18) in JOINTS order and the end position
+    """
     fk = Kinematics(robot_position=robot_position)
-    
+    apply_command(fk, command, kwargs)
+    move_types, angles = fk.trajectory
+    return move_types, angles, fk.current_position
+
+def sources_fingerprint() -> str:
+    """
+    Hash of cybernetic_core sources, joblib only hashes the source of solve_command itself
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sources = {}
+    for directory, _, files in sorted(os.walk(package_dir)):
+        for file in sorted(files):
+            if file.endswith('.py') and not file.startswith('test_'):
+                path = os.path.join(directory, file)
+                with open(path, 'rb') as f:
+                    sources[os.path.relpath(path, package_dir)] = f.read()
+    return joblib.hash(sources)
+
+def config_fingerprint() -> str:
+    """
+    Hash of all config values and of the code that solves sequences,
+    cached sequences are not used after any of them changes
+    """
+    values = {
+        name: {k: v for k, v in vars(section).items() if not k.startswith('__') and not callable(v)}
+        for name, section in vars(cfg).items()
+        if isinstance(section, type) and section.__module__ == cfg.__name__
+    }
+    values['servos_mapping'] = cfg.servos_mapping
+    values['sources'] = sources_fingerprint()
+    return joblib.hash(values)
+
+def solve_command(command: str, pose_key: tuple, kwargs=None, fingerprint: str = None, solved=None):
+    """
+    Function cached on disk by SequenceCache.
+    solved is not a part of the key, it stores a sequence that is already solved
+    """
+    if solved is not None:
+        return solved
+    return get_trajectory_for_command(command, SequenceCache.pose_from_key(pose_key), kwargs)
+
+class SequenceCache:
+    """
+    Persistent cache of solved commands in code_config.cache_dir.
+    Key is command, start pose quantized to POSITION_QUANTUM, kwargs and config fingerprint,
+    value is move types, servo angles of shape (T, 18) and the end position.
+    Least recently used sequences are removed above sequence_cache.items_limit
+    """
+    def __init__(self, cache_dir: str = code_config.cache_dir):
+        self.memory = Memory(cache_dir, verbose=0)
+        self.solve = self.memory.cache(solve_command, ignore=['solved'])
+        self.fingerprint = config_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    @staticmethod
+    def pose_key(robot_position: RobotPosition) -> tuple:
+        return tuple(robot_position.quantized().tolist())
+
+    @staticmethod
+    def pose_from_key(pose_key: tuple) -> RobotPosition:
+        return RobotPosition.from_array(np.array(pose_key) * POSITION_QUANTUM)
+
+    def key(self, command: str, robot_position: RobotPosition, kwargs=None) -> tuple:
+        return command, self.pose_key(robot_position), kwargs, self.fingerprint
+
+    def lookup(self, command: str, robot_position: RobotPosition, kwargs=None) -> Optional[Tuple[List[str], np.ndarray, RobotPosition]]:
+        key = self.key(command, robot_position, kwargs)
+        if not self.solve.check_call_in_cache(*key):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.solve(*key)
+
+    def store(self, command: str, robot_position: RobotPosition, kwargs, solved: Tuple[List[str], np.ndarray, RobotPosition]) -> None:
+        self.solve(*self.key(command, robot_position, kwargs), solved=solved)
+        self.stored += 1
+        if self.stored % cfg.sequence_cache.reduce_every == 0:
+            self.reduce_size()
+
+    def get(self, command: str, robot_position: RobotPosition, kwargs=None) -> Tuple[List[str], np.ndarray, RobotPosition]:
+        solved = self.lookup(command, robot_position, kwargs)
+        if solved is None:
+            solved = get_trajectory_for_command(command, robot_position, kwargs)
+            self.store(command, robot_position, kwargs, solved)
+        return solved
+
+    def reduce_size(self) -> None:
+        self.memory.reduce_size(items_limit=cfg.sequence_cache.items_limit)
+
+    def __repr__(self):
+        return f'SequenceCache(hits={self.hits}, misses={self.misses})'
+
+_sequence_cache = None
+
+def get_sequence_cache() -> Optional[SequenceCache]:
+    global _sequence_cache
+    if not cfg.sequence_cache.enabled:
+        return None
+    if _sequence_cache is None:
+        _sequence_cache = SequenceCache()
+    return _sequence_cache
+
+def build_sequence(move_types: List[str], angles: np.ndarray) -> List[MoveSnapshot]:
+    return [MoveSnapshot(move_type, RobotPosition.from_array(frame)) for move_type, frame in zip(move_types, angles)]
+
+def get_sequence_for_command_cached(command: str, robot_position: RobotPosition, kwargs=None):
+    cache = get_sequence_cache()
+    if cache is None:
+        move_types, angles, end_position = get_trajectory_for_command(command, robot_position, kwargs)
+    else:
+        move_types, angles, end_position = cache.get(command, robot_position, kwargs)
+    return build_sequence(move_types, angles), end_position
+
+def apply_command(fk: Kinematics, command: str, kwargs=None) -> None:
     if command == 'forward_1':
         # Legs 1 and 3 moved x1
         fk.move_2_legs_phased_24(FORWARD_LEGS_2LEG_CM, 0)
@@ -208,12 +336,11 @@ def get_sequence_for_command_cached(command: str, robot_position: RobotPosition,
     elif command == 'look_down':
         fk.look_on_angle_new(up=False)
     elif command == 'look_left':
-        fk.turn(-24, only_body=True)
+        fk.body_pose(yaw=24, frames=cfg.body.pose_frames)
     elif command == 'look_right':
-        fk.turn(24, only_body=True)
+        fk.body_pose(yaw=-24, frames=cfg.body.pose_frames)
     elif command == 'sight_to_normal':
-        fk.look_on_angle(0)
-        fk.turn(-fk.side_look_angle, only_body=True)
+        fk.body_orientation_to(0, 0, 0)
     elif command == 'turn_left_two_legged':
         fk.turn_move(40)
     elif command == 'turn_right_two_legged':
@@ -278,5 +405,3 @@ def get_sequence_for_command_cached(command: str, robot_position: RobotPosition,
         fk.body_to_center()
     else:
         print(f'Unknown command')
-    
-    return fk.sequence, fk.current_position
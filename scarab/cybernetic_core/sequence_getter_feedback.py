@@ -368,6 +368,10 @@ def get_sequence_for_command(command: str, kwargs=None):
 
 def get_angles_for_sequence(move: Move, robot_position: RobotPosition):
     rk = Kinematics(robot_position=robot_position, init_snapshot=False)
+    apply_move(rk, move)
+    return rk.sequence
+
+def apply_move(rk: Kinematics, move: Move) -> None:
     print(f'Move: {move.move_type}. {move.values}')
     # print(f'robot_position: {robot_position}')
     if move.move_type == 'add_snapshot':
@@ -477,6 +481,10 @@ def get_angles_for_sequence(move: Move, robot_position: RobotPosition):
             rk.add_angles_snapshot('endpoint')
     elif move.move_type == 'body_absolute':
         rk.move_body_abs(move.values['z'])
+    elif move.move_type == 'legs_z':
+        for leg, z in move.values['z'].items():
+            rk.move_leg_endpoint(leg, 0, 0, z - rk.C[leg - 1, 2])
+        rk.add_angles_snapshot('endpoint')
     elif move.move_type == 'endpoints':
         rk.move_leg_endpoint(move.values['legs'][0], move.values['deltas'], add_snapshot=False)
         rk.move_leg_endpoint(move.values['legs'][1], move.values['deltas'])
@@ -626,5 +634,3 @@ def get_angles_for_sequence(move: Move, robot_position: RobotPosition):
             #else:
             #    rk.leg_move_custom(2, 'balance1', [0, 0, -balance_value])
             #    print(f'{pitch, roll}. Branch 16. Balance [2] {-balance_value}')
-
-    return rk.sequence
@@ -0,0 +1,80 @@
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configs import config as cfg
+
+
+class TerrainMap:
+    """
+    Ground heights, where legs found ground, keyed by world x, y.
+    World frame is the body position at startup. Body is tracked by legs, that stay on the ground:
+    if they move by delta in the body frame, body has moved by -delta.
+    Turns are not tracked, so the map is good for the next steps, not for the whole walk.
+    Heights are averaged in cells of terrain.cell_size cm, the last terrain.max_samples count.
+    Where nothing is known, ground is expected at the height, where the same leg stood last time
+    """
+    def __init__(self, cell_size: float = cfg.terrain.cell_size):
+        self.cell_size = cell_size
+        self.mounts = np.array(cfg.body.mounts, dtype=float)
+        self.body = np.zeros(3)
+        self.cells: Dict[Tuple[int, int], Tuple[float, int]] = {}
+        self.legs_ground = np.full(6, np.nan)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __repr__(self):
+        return f'TerrainMap(cells={len(self.cells)}, body={np.round(self.body, 2).tolist()})'
+
+    def cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size))
+
+    def feet_world(self, C: np.ndarray) -> np.ndarray:
+        """
+        End points of shape (6, 3) in leg frames to world coordinates
+        """
+        return np.asarray(C, dtype=float) + self.mounts + self.body
+
+    def move_body(self, prev_C: np.ndarray, C: np.ndarray, stance: np.ndarray) -> None:
+        """
+        stance is a mask of shape (6), True for legs on the ground before and after the move
+        """
+        if stance.any():
+            self.body -= (np.asarray(C, dtype=float) - prev_C)[stance].mean(axis=0)
+
+    def record(self, C: np.ndarray, legs_down: np.ndarray) -> None:
+        feet = self.feet_world(C)
+        self.legs_ground[legs_down] = feet[legs_down, 2]
+        for x, y, z in feet[legs_down]:
+            key = self.cell(x, y)
+            height, samples = self.cells.get(key, (z, 0))
+            samples = min(samples + 1, cfg.terrain.max_samples)
+            self.cells[key] = (height + (z - height) / samples, samples)
+
+    def height(self, x: float, y: float) -> Optional[float]:
+        """
+        Expected ground height at world x, y: the cell itself or the mean of known cells around it
+        """
+        i, j = self.cell(x, y)
+        if (i, j) in self.cells:
+            return self.cells[(i, j)][0]
+        radius = cfg.terrain.search_cells
+        heights = [
+            self.cells[(i + di, j + dj)][0]
+            for di in range(-radius, radius + 1)
+            for dj in range(-radius, radius + 1)
+            if (i + di, j + dj) in self.cells
+        ]
+        return float(np.mean(heights)) if heights else None
+
+    def expected_legs_z(self, C: np.ndarray) -> np.ndarray:
+        """
+        Expected ground under every leg in leg frames, shape (6), nan where ground is unknown
+        """
+        feet = self.feet_world(C)
+        heights = np.array([self.height(x, y) for x, y, _ in feet], dtype=float)
+        return np.where(np.isnan(heights), self.legs_ground, heights) - self.body[2]
@@ -0,0 +1,46 @@
+import sys
+import os
+import math
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cybernetic_core.kinematics import Kinematics
+from cybernetic_core.gait_engine import GaitEngine
+from configs import config as cfg
+
+
+def test_stop_to_neutral():
+    neutral_C = Kinematics.neutral_C()
+    for gait, (cycle_time, max_speed, max_yaw_rate) in cfg.gait_engine.limits.items():
+        engine = GaitEngine(neutral_C, gait)
+        frames_per_cycle = round(cycle_time * cfg.gait_engine.rate)
+        engine.set_command(max_speed, 0, max_yaw_rate)
+        # speed of servos is checked on every frame
+        engine.servo_frames(2 * frames_per_cycle)
+        assert engine.off_neutral().any()
+
+        engine.set_command(0, 0, 0)
+        frames = 0
+        while engine.moving:
+            engine.servo_frames(1)
+            frames += 1
+            assert frames <= 2 * frames_per_cycle, f'{gait} did not stop'
+        assert np.allclose(engine.C[:, 2], neutral_C[:, 2])
+        assert (np.linalg.norm(engine.C[:, :2] - neutral_C[:, :2], axis=-1) <= cfg.gait_engine.neutral_tolerance).all()
+
+        # a stopped gait stays where it is
+        C = engine.C.copy()
+        assert np.array_equal(engine.frames(frames_per_cycle)[-1], C)
+
+def test_command_limits():
+    engine = GaitEngine(Kinematics.neutral_C(), 'tripod')
+    _, max_speed, max_yaw_rate = cfg.gait_engine.limits['tripod']
+    engine.set_command(3 * max_speed, 4 * max_speed, -2 * max_yaw_rate)
+    assert np.allclose(engine.velocity, [0.6 * max_speed, 0.8 * max_speed])
+    assert math.isclose(engine.yaw_rate, math.radians(-max_yaw_rate))
+
+    # command is clamped again for a slower gait
+    engine.set_gait('wave')
+    _, wave_max_speed, wave_max_yaw_rate = cfg.gait_engine.limits['wave']
+    assert math.isclose(np.linalg.norm(engine.velocity), wave_max_speed)
+    assert math.isclose(engine.yaw_rate, math.radians(-wave_max_yaw_rate))
@@ -0,0 +1,55 @@
+import sys
+import os
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cybernetic_core.kinematics import Kinematics
+from cybernetic_core.gait_graph import GaitGraph
+from cybernetic_core.sequence_getter import get_trajectory_for_command
+from cybernetic_core.geometry.angles import DistanceException
+from core.utils.multiphase_moves import CommandsForwarder
+
+
+def test_explore():
+    moves = {'forward_two_legged': CommandsForwarder.moves['forward_two_legged']}
+    start = Kinematics().current_position
+    solved = []
+
+    def solve(command, position):
+        solved.append((command, position))
+        return get_trajectory_for_command(command, position)
+
+    graph = GaitGraph()
+    graph.explore(moves, [start], solve, max_cycles=4)
+    # every edge is solved once
+    assert len(solved) == len(set(solved)) == len(graph)
+
+    # walking with CommandsForwarder finds every move in the graph
+    forwarder = CommandsForwarder()
+    position = start
+    for command in ['forward_two_legged'] * 9 + ['none']:
+        move = forwarder.get_move(command)
+        move_types, angles, end_position = graph.lookup(move, position)
+        expected_move_types, expected_angles, expected_end_position = get_trajectory_for_command(move, position)
+        assert move_types == expected_move_types and np.array_equal(angles, expected_angles)
+        assert end_position == expected_end_position
+        position = end_position
+    assert (graph.hits, graph.misses) == (10, 0)
+
+    assert graph.lookup('forward_1', start, {'value': 1}) is None
+    assert graph.lookup('backward_1', start) is None
+    assert graph.misses == 2
+
+def test_explore_skips_failed_moves():
+    moves = {'forward_two_legged': CommandsForwarder.moves['forward_two_legged']}
+    start = Kinematics().current_position
+
+    def solve(command, position):
+        if command == 'forward_2':
+            raise DistanceException('unreachable')
+        return get_trajectory_for_command(command, position)
+
+    graph = GaitGraph()
+    graph.explore(moves, [start], solve, max_cycles=4)
+    # start and exit moves are kept, the gait does not go on after the failed move
+    assert [command for command, _ in graph.edges] == ['forward_1', 'forward_22']
@@ -0,0 +1,58 @@
+import sys
+import os
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cybernetic_core.kinematics import Kinematics, Keyframes
+from cybernetic_core.geometry.angles import DistanceException
+
+
+def test_leg_angles():
+    kinematics = Kinematics()
+    tettas, alphas, betas = kinematics.solve()
+    for leg_num, leg in kinematics.legs.items():
+        assert np.allclose(leg.angles, (tettas[leg_num - 1], alphas[leg_num - 1], betas[leg_num - 1]))
+
+    # angles are solved again after the end point is moved
+    leg = kinematics.legs[2]
+    start_angles = leg.angles
+    kinematics.move_leg_endpoint(2, 0, 0, 2)
+    assert leg.angles != start_angles
+    assert np.isclose(leg.alpha, kinematics.solve()[1][1])
+
+    kinematics.move_leg_endpoint(2, 100, 0, 0)
+    with pytest.raises(DistanceException):
+        leg.beta
+
+def test_keyframes_wrap():
+    keyframes = Keyframes(size=4)
+    for frame in range(6):
+        keyframes.add(f'move {frame}', np.full((6, 3), frame))
+    # frames 4 and 5 took the slots of frames 0 and 1
+    assert keyframes.slots(2, 6).tolist() == [2, 3, 0, 1]
+    assert [keyframes.move_types[slot] for slot in keyframes.slots(2, 6)] == ['move 2', 'move 3', 'move 4', 'move 5']
+    assert keyframes.points[keyframes.slots(5, 6)][0, 0, 0] == 5
+    with pytest.raises(IndexError):
+        keyframes.slots(1, 6)
+
+def test_keyframes_overflow():
+    def walk(kinematics):
+        for step in range(10):
+            kinematics.move_leg_endpoint(1 + step % 6, 0, 0, 1 if step % 2 else -1, add_snapshot=True)
+
+    expected = Kinematics()
+    walk(expected)
+    expected_move_types, expected_angles = expected.trajectory
+
+    # frames are solved before they are overwritten, the last ones are still in the buffer
+    kinematics = Kinematics(init_snapshot=False)
+    kinematics.keyframes = Keyframes(size=4)
+    kinematics.add_angles_snapshot('init')
+    walk(kinematics)
+    move_types, angles, next_index = kinematics.frames_since(7)
+    assert next_index == 11
+    assert move_types == expected_move_types[7:]
+    assert np.array_equal(angles, expected_angles[7:])
+    with pytest.raises(IndexError):
+        kinematics.frames_since(0)
@@ -0,0 +1,93 @@
+import sys
+import os
+import logging
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cybernetic_core.kinematics import Kinematics
+from cybernetic_core import sequence_getter
+from cybernetic_core.sequence_getter import VirtualRobot, SequenceCache, get_trajectory_for_command
+from cybernetic_core.geometry.angles import DistanceException, convert_legs_angles_to_kinematic_C
+from configs import config as cfg
+
+
+def test_sequence_cache_hit_and_miss(tmp_path):
+    cache = SequenceCache(cache_dir=str(tmp_path))
+    position = Kinematics().current_position
+    assert cache.lookup('up', position) is None
+
+    move_types, angles, end_position = cache.get('up', position)
+    expected_move_types, expected_angles, expected_end_position = get_trajectory_for_command('up', position)
+    assert move_types == expected_move_types and np.array_equal(angles, expected_angles)
+    assert end_position == expected_end_position
+
+    # a new cache on the same directory finds the stored sequence
+    cache = SequenceCache(cache_dir=str(tmp_path))
+    move_types, angles, end_position = cache.lookup('up', position)
+    assert move_types == expected_move_types and np.array_equal(angles, expected_angles)
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    assert cache.lookup('down', position) is None
+    assert cache.lookup('up', position, {'value': 1}) is None
+    cache.fingerprint = 'changed config'
+    assert cache.lookup('up', position) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+def test_sequence_cache_lru(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg.sequence_cache, 'items_limit', 2)
+    monkeypatch.setattr(cfg.sequence_cache, 'reduce_every', 3)
+    cache = SequenceCache(cache_dir=str(tmp_path))
+    position = Kinematics().current_position
+    cache.get('up', position)
+    cache.get('down', position)
+
+    # up is used after down, so down is the least recently used one.
+    # Eviction goes by access time of the output files, they are set explicitly,
+    # because file systems do not always update it on reads
+    up_angles = get_trajectory_for_command('up', position)[1]
+    backend = cache.memory.store_backend
+    for item in backend.get_items():
+        _, angles, _ = backend.load_item([item.path])
+        access_time = 2000 if np.array_equal(angles, up_angles) else 1000
+        os.utime(os.path.join(item.path, 'output.pkl'), (access_time, access_time))
+
+    # third stored sequence reduces the cache to items_limit
+    cache.get('up_4', position)
+    assert len(cache.memory.store_backend.get_items()) == 2
+    assert cache.lookup('down', position) is None
+    assert cache.lookup('up', position) is not None
+    assert cache.lookup('up_4', position) is not None
+
+def test_swing_points(monkeypatch):
+    position = Kinematics().current_position
+    move_types, _, end_position = get_trajectory_for_command('forward_1', position)
+    assert 'swing' not in move_types
+
+    # swing arcs replace lift and lower keyframes, the step ends at the same position
+    monkeypatch.setattr(cfg.trajectories, 'swing_points', 8)
+    swing_move_types, _, swing_end_position = get_trajectory_for_command('forward_1', position)
+    assert swing_move_types.count('swing') == 8
+    assert len(swing_move_types) == len(move_types) - move_types.count('endpoints') + 8
+    assert np.allclose(swing_end_position.array, end_position.array)
+
+def test_get_sequence(monkeypatch):
+    monkeypatch.setattr(cfg.sequence_cache, 'enabled', False)
+    robot = VirtualRobot(logging.getLogger('test'))
+    position = Kinematics().current_position
+    sequence, end_position = robot.get_sequence('forward_1', position)
+    move_types, angles, expected_end_position = get_trajectory_for_command('forward_1', position)
+    assert [snapshot.move_type for snapshot in sequence] == move_types
+    assert end_position == expected_end_position
+    # robot stands where the last snapshot puts it, servo angles are rounded to 0.01 degrees
+    last_position = convert_legs_angles_to_kinematic_C(sequence[-1].angles_snapshot)
+    assert np.allclose(last_position.array, end_position.array, atol=1e-3)
+
+    # a command that can not be solved fails as a whole, before anything is sent
+    def unreachable(fk, command, kwargs=None):
+        fk.move_leg_endpoint(1, 0, 0, -2, add_snapshot=True)
+        fk.move_leg_endpoint(1, 100, 0, 0, add_snapshot=True)
+
+    monkeypatch.setattr(sequence_getter, 'apply_command', unreachable)
+    with pytest.raises(DistanceException):
+        robot.get_sequence('forward_1', position)
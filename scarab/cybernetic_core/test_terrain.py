@@ -0,0 +1,78 @@
+import sys
+import os
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cybernetic_core.kinematics import Kinematics
+from cybernetic_core.terrain import TerrainMap
+from configs import config as cfg
+
+
+def test_body_tracking():
+    terrain = TerrainMap()
+    C = Kinematics.neutral_C()
+    all_down = np.ones(6, dtype=bool)
+
+    # body moves forward by 3 cm: legs on the ground move back in the body frame
+    moved_C = C - [0, 3, 0]
+    feet = terrain.feet_world(C)
+    terrain.move_body(C, moved_C, all_down)
+    assert np.allclose(terrain.body, [0, 3, 0])
+    # feet stay where they are in the world
+    assert np.allclose(terrain.feet_world(moved_C), feet)
+
+    # legs in the air do not move the body
+    lifted = moved_C.copy()
+    lifted[0] += [0, 4, 2]
+    stance = all_down.copy()
+    stance[0] = False
+    terrain.move_body(moved_C, lifted, stance)
+    assert np.allclose(terrain.body, [0, 3, 0])
+
+    # nothing is known without legs on the ground
+    terrain.move_body(lifted, lifted + 5, np.zeros(6, dtype=bool))
+    assert np.allclose(terrain.body, [0, 3, 0])
+
+def test_expected_legs_z():
+    terrain = TerrainMap()
+    C = Kinematics.neutral_C()
+    assert np.isnan(terrain.expected_legs_z(C)).all()
+
+    terrain.record(C, np.ones(6, dtype=bool))
+    assert np.allclose(terrain.expected_legs_z(C), C[:, 2])
+
+    # leg 1 steps forward onto a 3 cm step
+    step_C = C.copy()
+    step_C[0] += [0, 6, 3]
+    legs_down = np.zeros(6, dtype=bool)
+    legs_down[0] = True
+    terrain.record(step_C, legs_down)
+    expected_z = terrain.expected_legs_z(step_C)
+    assert np.isclose(expected_z[0], step_C[0, 2])
+
+    # body walks forward, so that leg 3 comes to the step found by leg 1
+    body_delta = step_C[0, :2] + terrain.mounts[0, :2] - C[2, :2] - terrain.mounts[2, :2]
+    terrain.move_body(C, C - np.append(body_delta, 0), np.ones(6, dtype=bool))
+    assert np.isclose(terrain.expected_legs_z(C)[2], step_C[0, 2])
+
+    # leg 2 is far from everything known, ground is expected where it stood
+    far_C = C.copy()
+    far_C[1] += [0, 10 * cfg.terrain.cell_size, 0]
+    assert np.isclose(terrain.expected_legs_z(far_C)[1], C[1, 2])
+
+    # lowered body sees the ground higher in leg frames
+    terrain.move_body(C, C - [0, 0, 1], np.ones(6, dtype=bool))
+    assert np.isclose(terrain.expected_legs_z(C)[2], step_C[0, 2] - 1)
+
+def test_cell_averaging():
+    terrain = TerrainMap()
+    C = Kinematics.neutral_C()
+    legs_down = np.zeros(6, dtype=bool)
+    legs_down[0] = True
+    for z in range(cfg.terrain.max_samples + 5):
+        measured = C.copy()
+        measured[0, 2] += 1 if z % 2 else -1
+        terrain.record(measured, legs_down)
+    height = terrain.height(*terrain.feet_world(C)[0, :2])
+    assert abs(height - (C[0, 2] + terrain.mounts[0, 2])) < 1
+    assert len(terrain) == 1
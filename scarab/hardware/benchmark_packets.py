@@ -0,0 +1,62 @@
+"""
+Packets per second HTD45H encodes, written to a port that discards everything.
+Writes go to the port directly, without retries and TX delay, and logging is off,
+so the time is the time of encoding.
+Peak is the most memory allocated at once during a call.
+python3 hardware/benchmark_packets.py [seconds per test]
+"""
+import time
+import logging
+import tracemalloc
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import hardware.htd45h as htd45h
+
+
+class NullSerial:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def setDTR(self, value):
+        pass
+
+    def write(self, data):
+        return len(data)
+
+def packets_per_second(function, packets: int, seconds: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(100):
+            function()
+        calls += 100
+    return calls * packets / (time.perf_counter() - start)
+
+def peak_bytes(function) -> int:
+    function()
+    tracemalloc.start()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - current
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    htd45h.Serial = NullSerial
+    logging.disable(logging.CRITICAL)
+    board = htd45h.HTD45H(port='null')
+    board.write = board.serial.write
+
+    ids = list(htd45h.neutral)[:9]
+    pose = [(id, 10.0, 40) for id in ids]
+    tests = {
+        'SERVO_MOVE_TIME_WAIT_WRITE': (lambda: board.move_servo_wait(ids[0], 500, 40), 1),
+        'SERVO_MOVE_START': (lambda: board.move_servo_start(ids[0]), 1),
+        'SERVO_LOAD_OR_UNLOAD_WRITE': (lambda: board.enable_torque(ids[0]), 1),
+        'pose of 9 joints': (lambda: board.move_servos_to_angles(pose), len(pose)),
+    }
+    for name, (function, packets) in tests.items():
+        print(f'{name:28} {packets_per_second(function, packets, seconds):10.0f} packets/s, peak {peak_bytes(function):5d} bytes')
@@ -2,7 +2,7 @@
 import time
 from serial import Serial, SerialException
 import struct
-from typing import Union, List
+from typing import Union, List, NamedTuple
 import sys
 import os
 import subprocess
@@ -33,6 +33,99 @@ neutral = {
     23 : 500
 }
 
+class Response(NamedTuple):
+    id: int
+    command: int
+    params: bytes
+    # whole frame with header and checksum
+    frame: bytes
+    received_at: float
+
+class ResponseDecoder:
+    """
+    Decodes servo responses from a byte stream with echo, noise and partial frames.
+    Bytes are kept in a ring buffer, a frame starts with the 0x55 0x55 header
+    and is accepted if its length is possible and its checksum is right.
+    Otherwise the first byte is dropped and the scan goes on from the next one,
+    so garbage costs some dropped bytes, not a reopened port
+    """
+    HEADER = 0x55
+    # id, length, command, checksum and up to 4 bytes of parameters
+    MIN_LENGTH = 3
+    MAX_LENGTH = 7
+    MIN_FRAME_SIZE = MIN_LENGTH + 3
+
+    def __init__(self, capacity: int = 512):
+        self.ring = bytearray(capacity)
+        self.start = 0
+        self.size = 0
+        self.frames = 0
+        self.dropped_bytes = 0
+        self.bad_checksums = 0
+
+    def __repr__(self):
+        return f'ResponseDecoder(frames={self.frames}, dropped_bytes={self.dropped_bytes}, bad_checksums={self.bad_checksums})'
+
+    def clear(self) -> None:
+        self.start = 0
+        self.size = 0
+
+    def byte(self, index: int) -> int:
+        return self.ring[(self.start + index) % len(self.ring)]
+
+    def peek(self, size: int) -> bytes:
+        end = self.start + size
+        if end <= len(self.ring):
+            return bytes(self.ring[self.start:end])
+        return bytes(self.ring[self.start:]) + bytes(self.ring[:end - len(self.ring)])
+
+    def drop(self, size: int) -> None:
+        self.start = (self.start + size) % len(self.ring)
+        self.size -= size
+
+    def feed(self, data: bytes) -> List[Response]:
+        """
+        Adds bytes read from the port, returns responses completed by them
+        """
+        capacity = len(self.ring)
+        if len(data) > capacity:
+            self.dropped_bytes += len(data) - capacity
+            data = data[-capacity:]
+        overflow = self.size + len(data) - capacity
+        if overflow > 0:
+            # oldest bytes are lost
+            self.dropped_bytes += overflow
+            self.drop(overflow)
+        end = (self.start + self.size) % capacity
+        head = min(len(data), capacity - end)
+        self.ring[end:end + head] = data[:head]
+        self.ring[:len(data) - head] = data[head:]
+        self.size += len(data)
+        return self.decode()
+
+    def decode(self) -> List[Response]:
+        responses = []
+        while self.size >= self.MIN_FRAME_SIZE:
+            if self.byte(0) != self.HEADER or self.byte(1) != self.HEADER \
+                    or not self.MIN_LENGTH <= self.byte(3) <= self.MAX_LENGTH:
+                self.dropped_bytes += 1
+                self.drop(1)
+                continue
+            frame_size = self.byte(3) + 3
+            if self.size < frame_size:
+                break
+            frame = self.peek(frame_size)
+            if ~sum(frame[2:-1]) & 0xff != frame[-1]:
+                # the header could be a part of garbage, the frame can start inside of it
+                self.bad_checksums += 1
+                self.dropped_bytes += 1
+                self.drop(1)
+                continue
+            self.drop(frame_size)
+            self.frames += 1
+            responses.append(Response(frame[2], frame[4], frame[5:-1], frame, time.perf_counter()))
+        return responses
+
 class HTD45H:
 
     LED_OFF = 1
@@ -48,6 +141,7 @@ class HTD45H:
     LED_ERROR_OVER_ALL                     = 7
 
     SERVO_FRAME_HEADER         = 0x55
+    BROADCAST_ID               = 0xFE
     SERVO_MOVE_TIME_WRITE      = 1
     SERVO_MOVE_TIME_READ       = 2
     SERVO_MOVE_TIME_WAIT_WRITE = 7
@@ -77,14 +171,62 @@ class HTD45H:
     SERVO_LED_ERROR_WRITE      = 35
     SERVO_LED_ERROR_READ       = 36
 
+    # parameters of every command, a packet is header, header, id, length, command, parameters, checksum
+    PACKETS = {
+        command: struct.Struct(f'<BBBBB{params}B')
+        for command, params in {
+            SERVO_MOVE_TIME_WRITE: 'HH',
+            SERVO_MOVE_TIME_READ: '',
+            SERVO_MOVE_TIME_WAIT_WRITE: 'HH',
+            SERVO_MOVE_TIME_WAIT_READ: '',
+            SERVO_MOVE_START: '',
+            SERVO_MOVE_STOP: '',
+            SERVO_ID_WRITE: 'B',
+            SERVO_ID_READ: '',
+            SERVO_ANGLE_OFFSET_ADJUST: 'b',
+            SERVO_ANGLE_OFFSET_WRITE: 'b',
+            SERVO_ANGLE_OFFSET_READ: '',
+            SERVO_ANGLE_LIMIT_WRITE: 'HH',
+            SERVO_ANGLE_LIMIT_READ: '',
+            SERVO_VIN_LIMIT_WRITE: 'HH',
+            SERVO_VIN_LIMIT_READ: '',
+            SERVO_TEMP_MAX_LIMIT_WRITE: 'B',
+            SERVO_TEMP_MAX_LIMIT_READ: '',
+            SERVO_TEMP_READ: '',
+            SERVO_VIN_READ: '',
+            SERVO_POS_READ: '',
+            SERVO_OR_MOTOR_MODE_WRITE: 'BBh',
+            SERVO_OR_MOTOR_MODE_READ: '',
+            SERVO_LOAD_OR_UNLOAD_WRITE: 'B',
+            SERVO_LOAD_OR_UNLOAD_READ: '',
+            SERVO_LED_CTRL_WRITE: 'B',
+            SERVO_LED_CTRL_READ: '',
+            SERVO_LED_ERROR_WRITE: 'B',
+            SERVO_LED_ERROR_READ: '',
+        }.items()
+    }
+    MOVE_PACKET = PACKETS[SERVO_MOVE_TIME_WRITE]
+    MOVE_PACKET_SIZE = MOVE_PACKET.size
+    # commands with one byte of parameters, signed values are packed as their low byte
+    BYTE_PACKET = struct.Struct('<BBBBBBB')
+    # seconds to wait for a response to a read and for bytes of it in one read of the port
+    RESPONSE_TIMEOUT = 0.1
+    READ_TIMEOUT = 0.001
+
     def __init__(self, port: str = "/dev/ttyUSB0", Baudrate: int = 115200, Timeout: float = 0.001):
         logging.config.dictConfig(code_config.logger_config)
         self.logger = logging.getLogger('main_logger')
         self.serial = Serial(port, baudrate=Baudrate, timeout=Timeout)
         self.serial.setDTR(1)
         self.TX_DELAY_TIME = 0.00002 
-        self.Header = struct.pack("<BB",0x55,0x55)
         self.port = port
+        # packets are packed into these buffers, see send_command and move_servos_to_angles
+        self.packet_buffers = {command: (packet, bytearray(packet.size)) for command, packet in self.PACKETS.items()}
+        self.frame_buffer = bytearray(self.MOVE_PACKET_SIZE * len(neutral))
+        self.frame_view = memoryview(self.frame_buffer)
+        # target positions returned by move_servos_to_angles
+        self.positions = [0] * len(neutral)
+        self.decoder = ResponseDecoder()
 
     def reset(self) -> None:
         print('............. Resetting .............')
@@ -93,16 +235,48 @@ class HTD45H:
         self.serial.setDTR(1)
         time.sleep(0.1)
 
-    # send the packet with header and checksum
-    def send_packet(self, packet: bytes) -> None:
-        sum = 0
-        for item in packet:
-            sum = sum + item
-        full_packet = bytearray(self.Header + packet + struct.pack("<B",(~sum) & 0xff))
- 
+    # SERVO_MOVE_TIME_WRITE, SERVO_MOVE_TIME_WAIT_WRITE and other commands with two words of parameters
+    # packed into buffer at offset, the checksum is summed from the values
+    def pack_move_into(self, buffer: bytearray, offset: int, id: int, command: int, position: int, rate: int) -> None:
+        checksum = id + 7 + command + (position & 0xff) + (position >> 8) + (rate & 0xff) + (rate >> 8)
+        self.MOVE_PACKET.pack_into(
+            buffer, offset, self.SERVO_FRAME_HEADER, self.SERVO_FRAME_HEADER, id, 7, command, position, rate, ~checksum & 0xff
+        )
+
+    # send a command with two words of parameters
+    def send_words_command(self, id: int, command: int, first: int, second: int) -> None:
+        _, buffer = self.packet_buffers[command]
+        self.pack_move_into(buffer, 0, id, command, first, second)
+        self.write(buffer)
+
+    # send a command with one byte of parameters, the checksum is summed from the values
+    def send_byte_command(self, id: int, command: int, value: int) -> None:
+        _, buffer = self.packet_buffers[command]
+        value &= 0xff
+        self.BYTE_PACKET.pack_into(
+            buffer, 0, self.SERVO_FRAME_HEADER, self.SERVO_FRAME_HEADER, id, 4, command, value, ~(id + 4 + command + value) & 0xff
+        )
+        self.write(buffer)
+
+    # send a command with its parameters, commands with one byte or two words
+    # of parameters are sent faster by send_byte_command and send_words_command
+    # the packet is packed into the buffer of the command, the checksum is summed in the buffer
+    def send_command(self, id: int, command: int, *params) -> None:
+        self.write(self.pack_command(id, command, *params))
+
+    def pack_command(self, id: int, command: int, *params) -> bytearray:
+        packet, buffer = self.packet_buffers[command]
+        if params:
+            packet.pack_into(buffer, 0, self.SERVO_FRAME_HEADER, self.SERVO_FRAME_HEADER, id, packet.size - 3, command, *params, 0)
+            buffer[-1] = ~(sum(buffer) - 2 * self.SERVO_FRAME_HEADER) & 0xff
+        else:
+            packet.pack_into(buffer, 0, self.SERVO_FRAME_HEADER, self.SERVO_FRAME_HEADER, id, 3, command, ~(id + 3 + command) & 0xff)
+        return buffer
+
+    def write(self, data) -> None:
         for i in range(3):
             try:
-                self.serial.write(full_packet)
+                self.serial.write(data)
                 break
             except SerialException as e:
                 print(f'!!!!!!!! Send packet Serial ALARM {i+1} !!!!!!!!!!!!!!!!!!!!!')
@@ -118,19 +292,34 @@ class HTD45H:
 
         time.sleep(self.TX_DELAY_TIME)
 
-    # send packet and return response
-    def send_receive_packet(self, packet: bytes, receive_size: int) -> bytes:
+    # send packet and return the whole response frame
+    # receive_size is the size of the response without header and checksum
+    # echo and garbage on the bus are skipped by the decoder
+    # the port is polled with the short READ_TIMEOUT, setting a timeout reconfigures the port,
+    # so it is set once and the previous one is restored
+    def send_receive_packet(self, id: int, command: int, receive_size: int) -> bytes:
         num_attempts = 3
-        for _ in range(num_attempts):
-            # t_id = packet[0]     
-            # t_command = packet[2]
-            self.serial.flushInput()
-            self.serial.timeout = 0.1
-            self.send_packet(packet)
-            r_packet = self.read(receive_size + 3)
-            if len(r_packet) > 0:
-                return r_packet
-        raise Exception('Got empty response in {0} attempts'.format(num_attempts))
+        timeout = self.serial.timeout
+        if timeout != self.READ_TIMEOUT:
+            self.serial.timeout = self.READ_TIMEOUT
+        try:
+            for _ in range(num_attempts):
+                self.serial.flushInput()
+                self.decoder.clear()
+                self.send_command(id, command)
+                deadline = time.perf_counter() + self.RESPONSE_TIMEOUT
+                while time.perf_counter() < deadline:
+                    data = self.read(max(1, self.serial.in_waiting))
+                    if not data:
+                        continue
+                    for response in self.decoder.feed(data):
+                        if response.id == id and response.command == command and len(response.frame) == receive_size + 3:
+                            return response.frame
+                self.logger.info(f'No response from servo {id} to {command}. {self.decoder}')
+        finally:
+            if timeout != self.READ_TIMEOUT:
+                self.serial.timeout = timeout
+        raise Exception('Got no response in {0} attempts'.format(num_attempts))
     
     def read(self, size):
         for i in range(3):
@@ -154,36 +343,19 @@ class HTD45H:
     # 1000 means it will take 1 second to make a move, 
     # 30000 is very slow
     def move_servo(self, id: int, position: int, rate: int = 1000) -> None:
-        packet = struct.pack(
-            "<BBBHH",
-            id,
-            7,
-            self.SERVO_MOVE_TIME_WRITE,
-            position,
-            rate
-        )
-        self.send_packet(packet)
+        self.send_words_command(id, self.SERVO_MOVE_TIME_WRITE, position, rate)
 
     # several attempts are made to send servo to a certain angle
     # because sometimes command does not work and target stays unchanged
-    def move_servo_to_angle(self, id: int, angle: float, rate: int = 5000) -> None:
-        position = neutral[id] + int(angle/0.24)
-        self.logger.info(f'Id : {id}. Target required : {position}. Angle: {angle}. Rate: {rate}')
-        if position < 0:
-            self.logger.error(f'Id : {id}. Target required : {position}. Angle: {angle}. Rate: {rate}')
-            position = 0
+    # with verify the target is read back and the command is repeated, if the servo did not get it
+    def move_servo_to_angle(self, id: int, angle: float, rate: int = 5000, verify: bool = True) -> None:
+        position = self.angle_to_position(id, angle, rate)
         num_attempts = 3
         for i in range(num_attempts):
             try:
-                packet = struct.pack(
-                    "<BBBHH",
-                    id,
-                    7,
-                    self.SERVO_MOVE_TIME_WRITE,
-                    position,
-                    rate
-                )
-                self.send_packet(packet)
+                self.send_words_command(id, self.SERVO_MOVE_TIME_WRITE, position, rate)
+                if not verify:
+                    break
                 target = self.read_servo_target(id)[0]
                 if target != position:
                     self.logger.info(f'Id : {id}. Target required : {position}. Target real : {target}')
@@ -192,15 +364,39 @@ class HTD45H:
             except Exception as e:
                 self.logger.info(f'{i} attempt failed for servo {id}. Position: {position}. Angle: {angle}.\n{e}')
       
+    def angle_to_position(self, id: int, angle: float, rate: int) -> int:
+        position = neutral[id] + int(angle/0.24)
+        # formatted by logging, a frame is not slowed down when it is off
+        self.logger.info('Id : %s. Target required : %s. Angle: %s. Rate: %s', id, position, angle, rate)
+        if position < 0:
+            self.logger.error(f'Id : {id}. Target required : {position}. Angle: {angle}. Rate: {rate}')
+            position = 0
+        return position
+
+    # SERVO_MOVE_TIME_WRITE for several servos of the board with one write
+    # with wait it is SERVO_MOVE_TIME_WAIT_WRITE, servos move on move_servo_start
+    # targets are (id, angle, rate), target positions are returned in the first len(targets) items
+    # of the positions list of the board, the list is overwritten by the next call
+    def move_servos_to_angles(self, targets: List[tuple], wait: bool = False) -> List[int]:
+        command = self.SERVO_MOVE_TIME_WAIT_WRITE if wait else self.SERVO_MOVE_TIME_WRITE
+        size = self.MOVE_PACKET_SIZE * len(targets)
+        if len(self.frame_buffer) < size:
+            self.frame_buffer = bytearray(size)
+            self.frame_view = memoryview(self.frame_buffer)
+        positions = self.positions
+        if len(positions) < len(targets):
+            positions.extend([0] * (len(targets) - len(positions)))
+        index = 0
+        for id, angle, rate in targets:
+            position = positions[index] = self.angle_to_position(id, angle, rate)
+            self.pack_move_into(self.frame_buffer, index * self.MOVE_PACKET_SIZE, id, command, position, rate)
+            index += 1
+        self.write(self.frame_view[:size])
+        return positions
+
     # read target position and rate
     def read_servo_target(self, id: int) -> Union[int, int]:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_MOVE_TIME_READ
-        )
-        rpacket = self.send_receive_packet(packet, 7)
+        rpacket = self.send_receive_packet(id, self.SERVO_MOVE_TIME_READ, 7)
         s = struct.unpack("<BBBBBHHB", rpacket)
      
         return s[5:7]
@@ -208,199 +404,92 @@ class HTD45H:
     # Move servo to position at rate
     # Waiting for the command SERVO_MOVE_STOP
     def move_servo_wait(self, id: int, position: int, rate: int = 1000) -> None:
-        packet = struct.pack(
-            "<BBBHH",
-            id,
-            7,
-            self.SERVO_MOVE_TIME_WAIT_WRITE,
-            position,
-            rate
-        )
-        self.send_packet(packet)
+        self.send_words_command(id, self.SERVO_MOVE_TIME_WAIT_WRITE, position, rate)
 
     # Read the angle and the rate send by move_servo_wait
     def read_servo_target_wait(self, id: int) -> Union[int, int]:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_MOVE_TIME_WAIT_READ
-        )
-        rpacket = self.send_receive_packet(packet, 7)
+        rpacket = self.send_receive_packet(id, self.SERVO_MOVE_TIME_WAIT_READ, 7)
         s = struct.unpack("<BBBBBHHB", rpacket)
         return s[5:7]
 
     # Start a command from move_servo_wait
     def move_servo_start(self, id: int) -> None:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_MOVE_START
-        )
-        self.send_packet(packet)
+        self.send_command(id, self.SERVO_MOVE_START)
 
     # Stop a command from move_servo_wait
     def move_servo_stop(self, id: int) -> None:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_MOVE_STOP
-        )
-        self.send_packet(packet)
+        self.send_command(id, self.SERVO_MOVE_STOP)
 
     # change the ID of servo
     def set_id(self, id: int, newid: int) -> None:
-        packet = struct.pack(
-            "<BBBB",
-            id,
-            4,
-            self.SERVO_ID_WRITE,
-            newid
-        )
-        self.send_packet(packet)
+        self.send_byte_command(id, self.SERVO_ID_WRITE, newid)
 
     # read the servo ID
     def read_id(self, id: int) -> int:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_ID_READ
-        )
-        rpacket = self.send_receive_packet(packet, 4)
+        rpacket = self.send_receive_packet(id, self.SERVO_ID_READ, 4)
         s = struct.unpack("<BBBBBBB", rpacket)
         return s[5]
 
     # Change the angle offset without saving it during the next power ON
     # Angle between -125 and 125
     def set_angle_offset_adjust(self, id: int, angle: float) -> None:
-        packet = struct.pack(
-            "<BBBb",
-            id,
-            4,
-            self.SERVO_ANGLE_OFFSET_ADJUST,
-            angle
-        )
-        self.send_packet(packet)
+        self.send_byte_command(id, self.SERVO_ANGLE_OFFSET_ADJUST, angle)
 
     # Change the angle offset permanently
     # Angle between -125 and 125
     def set_angle_offset(self, id:int, angle: int) -> None:
-        packet = struct.pack(
-            "<BBBb",
-            id,
-            4,
-            self.SERVO_ANGLE_OFFSET_WRITE,
-            angle
-        )
-        self.send_packet(packet)
+        self.send_byte_command(id, self.SERVO_ANGLE_OFFSET_WRITE, angle)
 
     #lire l'offset de l'angle
     #angle entre -125 et 125
     def read_angle_offset(self,id):
-        packet = struct.pack("<BBB",id,3,self.SERVO_ANGLE_OFFSET_READ)
-        rpacket = self.send_receive_packet(packet,4)
+        rpacket = self.send_receive_packet(id, self.SERVO_ANGLE_OFFSET_READ, 4)
         s = struct.unpack("<BBBBBbB",rpacket)
         return s[5]
 
     # Define the minimum and maximum angle of the servo
     # Angle is between 0 and 1000 with resolution of 0.24 degrees
     def set_angle_limit(self, id: int, angle_min: int, angle_max: int) -> None:
-        packet = struct.pack(
-            "<BBBHH",
-            id,
-            7,
-            self.SERVO_ANGLE_LIMIT_WRITE,
-            angle_min,
-            angle_max
-        )
-        self.send_packet(packet)
+        self.send_words_command(id, self.SERVO_ANGLE_LIMIT_WRITE, angle_min, angle_max)
 
     # Read the minimum and maximum limit of the allowed angle
     def read_angle_limit(self, id: int) -> Union[int, int]:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_ANGLE_LIMIT_READ
-        )
-        rpacket = self.send_receive_packet(packet, 7)
+        rpacket = self.send_receive_packet(id, self.SERVO_ANGLE_LIMIT_READ, 7)
         s = struct.unpack("<BBBBBHHB", rpacket)
         return s[5:7]
 
     # define the minimum and maximum operating voltage of the servo
     # the values are in mv, min = 6500 max = 10000
     def set_voltage_limit(self, id: int, voltage_min: int, voltage_max: int) -> None:
-        packet = struct.pack(
-            "<BBBHH",
-            id,
-            7,
-            self.SERVO_VIN_LIMIT_WRITE,
-            voltage_min,
-            voltage_max
-        )
-        self.send_packet(packet)
+        self.send_words_command(id, self.SERVO_VIN_LIMIT_WRITE, voltage_min, voltage_max)
     
     # Read the minimum and maximum operating voltage of the servo
     # the values are in mv, min = 6500 max = 10000
     def read_voltage_limit(self, id: int) -> Union[int, int]:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_VIN_LIMIT_READ
-        )
-        rpacket = self.send_receive_packet(packet, 7)
+        rpacket = self.send_receive_packet(id, self.SERVO_VIN_LIMIT_READ, 7)
         s = struct.unpack("<BBBBBHHB", rpacket)
         return s[5:7]
 
     # Set the maximum operating temperature in celsius
     # default is 85 celsius, min = 50 and max = 100
     def set_temperature_limit(self, id: int, temperature_max: int) -> None:
-        packet = struct.pack(
-            "<BBBB",
-            id,
-            4,
-            self.SERVO_TEMP_MAX_LIMIT_WRITE,
-            temperature_max
-        )
-        self.send_packet(packet)
+        self.send_byte_command(id, self.SERVO_TEMP_MAX_LIMIT_WRITE, temperature_max)
 
     # Read the maximum temperature limit in celsius
     def read_temperature_limit(self, id: int) -> int:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_TEMP_MAX_LIMIT_READ
-        )
-        rpacket = self.send_receive_packet(packet, 4)
+        rpacket = self.send_receive_packet(id, self.SERVO_TEMP_MAX_LIMIT_READ, 4)
         s = struct.unpack("<BBBBBBB", rpacket)
         return s[5]
 
     # Read the temperature in celsius
     def read_temperature(self, id: int) -> int:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_TEMP_READ
-        )
-        rpacket = self.send_receive_packet(packet, 4)
+        rpacket = self.send_receive_packet(id, self.SERVO_TEMP_READ, 4)
         s = struct.unpack("<BBBBBBB", rpacket)
         return s[5]
 
     # Read the servo supply voltage in mv
     def read_voltage(self, id: int) -> int:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_VIN_READ
-        )
-        rpacket = self.send_receive_packet(packet, 5)
+        rpacket = self.send_receive_packet(id, self.SERVO_VIN_READ, 5)
         s = struct.unpack("<BBBBBHB", rpacket)
         return s[5]
 
@@ -410,13 +499,7 @@ class HTD45H:
         num_attempts = 3
         for attempt in range(num_attempts):
             try:
-                packet = struct.pack(
-                    "<BBB",
-                    id,
-                    3,
-                    self.SERVO_POS_READ
-                )
-                rpacket = self.send_receive_packet(packet, 5)
+                rpacket = self.send_receive_packet(id, self.SERVO_POS_READ, 5)
                 s = struct.unpack("<BBBBBhB", rpacket)
                 return s[5]
             except Exception as e:
@@ -437,50 +520,22 @@ class HTD45H:
     # Motor movement with speed : motor_mode = 1 motor_speed = rate
     # Otherwise set servo mode  : motor_mode = 0 
     def motor_or_servo(self, id: int, motor_mode: int, motor_speed: int) -> None:
-        packet = struct.pack(
-            "<BBBBBh",
-            id,
-            7,
-            self.SERVO_OR_MOTOR_MODE_WRITE,
-            motor_mode,
-            0,
-            motor_speed
-        )
-        self.send_packet(packet)
+        self.send_command(id, self.SERVO_OR_MOTOR_MODE_WRITE, motor_mode, 0, motor_speed)
 
     # Read the mode of servo
     def read_motor_or_servo(self, id: int) -> List[int]:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_OR_MOTOR_MODE_READ
-        )
-        rpacket = self.send_receive_packet(packet, 7)
+        rpacket = self.send_receive_packet(id, self.SERVO_OR_MOTOR_MODE_READ, 7)
         s = struct.unpack("<BBBBBBBhB", rpacket)
         return [s[5],s[7]]
 
     # Activate or deactivate the engine
     # 0 = motor OFF, 1 = motor ON
     def load_unload(self, id: int, mode: int) -> None:
-        packet = struct.pack(
-            "<BBBB",
-            id,
-            4,
-            self.SERVO_LOAD_OR_UNLOAD_WRITE,
-            mode
-        )
-        self.send_packet(packet)
+        self.send_byte_command(id, self.SERVO_LOAD_OR_UNLOAD_WRITE, mode)
 
     # Read the status of the servo activation
     def read_load_unload(self, id: int) -> int:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_LOAD_OR_UNLOAD_READ
-        )
-        rpacket = self.send_receive_packet(packet, 4)
+        rpacket = self.send_receive_packet(id, self.SERVO_LOAD_OR_UNLOAD_READ, 4)
         s = struct.unpack("<BBBBBBB", rpacket)
         return s[5]
 
@@ -488,48 +543,22 @@ class HTD45H:
     # 0 = on  => self.LED_ON
     # 1 = OFF => self.LED_OFF
     def set_led(self, id: int, led_state: int) -> None:
-        packet = struct.pack(
-            "<BBBB",
-            id,
-            4,
-            self.SERVO_LED_CTRL_WRITE,
-            led_state
-        )
-        self.send_packet(packet)
+        self.send_byte_command(id, self.SERVO_LED_CTRL_WRITE, led_state)
 
     # Read the status of the LED
     # 0 = LED active
     # 1 = LED OFF
     def read_led(self, id: int) -> int:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_LED_CTRL_READ
-        )
-        rpacket = self.send_receive_packet(packet, 4)
+        rpacket = self.send_receive_packet(id, self.SERVO_LED_CTRL_READ, 4)
         s = struct.unpack("<BBBBBBB", rpacket)
         return s[5]
 
     # Activate an error on the alarm led
     def set_led_error(self, id: int, led_error: int):
-        packet = struct.pack(
-            "<BBBB",
-            id,
-            4,
-            self.SERVO_LED_ERROR_WRITE,
-            led_error
-        )
-        self.send_packet(packet)
+        self.send_byte_command(id, self.SERVO_LED_ERROR_WRITE, led_error)
 
     def read_led_error(self, id: int) -> int:
-        packet = struct.pack(
-            "<BBB",
-            id,
-            3,
-            self.SERVO_LED_ERROR_READ
-        )
-        rpacket = self.send_receive_packet(packet, 4)
+        rpacket = self.send_receive_packet(id, self.SERVO_LED_ERROR_READ, 4)
         s = struct.unpack("<BBBBBBB", rpacket)
         return s[5]
    
@@ -544,40 +573,13 @@ class HTD45H:
         except:
             print('Could not read values from servo {0}'.format(id))
 
-    @staticmethod
-    def _checksum(packet: list[int]) -> int:
-        s = ~sum(packet[2:])
-        return s % 256
-    
-    def _send_packet(self, packet: list[int]) -> None:
-        packet = [0x55, 0x55, *packet]
-        packet.append(self._checksum(packet))
-        for i in range(3):
-            try:
-                self.serial.write(packet)
-                break
-            except SerialException as e:
-                print(f'!!!!!!!! _Send packet Serial ALARM {i+1} !!!!!!!!!!!!!!!!!!!!!')
-                print(f'Serial exception: {e}')
-            time.sleep(2)
-            #os.system("sudo chmod 666 /dev/ttyAMA0")
-            subprocess.check_output("sudo chmod 666 /dev/ttyAMA0", shell=True)
-            time.sleep(2)
-            try:
-                self.reset()
-            except SerialException as e:
-                print('Reset failed')
-                #self.serial.write(packet)
-
     def enable_torque(self, id) -> None:
-        packet = [id, 4, 31, 1]
-        self._send_packet(packet)
+        self.send_byte_command(id, self.SERVO_LOAD_OR_UNLOAD_WRITE, 1)
         self._torque_enabled = True
 
     def disable_torque(self, id) -> None:
         print('Disable torque command received')
-        packet = [id, 4, 31, 0]
-        self._send_packet(packet)
+        self.send_byte_command(id, self.SERVO_LOAD_OR_UNLOAD_WRITE, 0)
         self._torque_enabled = False
 
 
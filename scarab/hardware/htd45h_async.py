@@ -0,0 +1,145 @@
+import asyncio
+import struct
+import time
+from collections import deque
+from typing import Dict, Deque, List, Optional, Tuple
+from serial import SerialException
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from hardware.htd45h import HTD45H, Response, ResponseDecoder, neutral
+import configs.config as config
+
+
+class Request:
+    def __init__(self, id: int, command: int, response_size: int, future: asyncio.Future):
+        self.id = id
+        self.command = command
+        self.response_size = response_size
+        self.future = future
+        self.sent_at = None
+        self.received_at = None
+
+class AsyncHTD45H:
+    """
+    asyncio driver for reads on the bus of an HTD45H board.
+    Requests are written back to back, up to htd45h_async.max_in_flight of them wait for responses at once.
+    Requests are written once, without the retries of HTD45H.write, which sleep and would block the event loop.
+    A request that could not be written is handled as a servo that did not respond.
+    Responses are read by a reader callback of the event loop, decoded by ResponseDecoder and matched to requests
+    by servo id and command. Echo of a request on the half-duplex bus has the same id and command,
+    it is told apart by its length. Every request has its own deadline.
+    Reader is registered only for a batch of reads, so blocking reads of HTD45H are not disturbed
+    """
+    def __init__(self, board: HTD45H):
+        self.board = board
+        self.logger = board.logger
+        self.pending: Dict[Tuple[int, int], Deque[Request]] = {}
+        self.decoder = ResponseDecoder()
+        self.timeouts = 0
+
+    @property
+    def serial(self):
+        # HTD45H.reset opens a new Serial
+        return self.board.serial
+
+    def on_readable(self) -> None:
+        data = self.serial.read(self.serial.in_waiting or 1)
+        for response in self.decoder.feed(data):
+            self.resolve(response)
+
+    def resolve(self, response: Response) -> None:
+        requests = self.pending.get((response.id, response.command))
+        while requests:
+            request = requests[0]
+            if request.future.done():
+                # deadline has passed
+                requests.popleft()
+                continue
+            if len(response.frame) != request.response_size:
+                # echo of the request itself
+                return
+            requests.popleft()
+            request.received_at = response.received_at
+            request.future.set_result(response.params)
+            return
+
+    async def request(self, id: int, command: int, response_size: int, deadline: float) -> Tuple[bytes, float]:
+        """
+        Sends a request with no parameters, response_size is the size of the whole response packet.
+        Returns response parameters and time.perf_counter() of the response,
+        raises asyncio.TimeoutError after deadline seconds and SerialException if it could not be written
+        """
+        request = Request(id, command, response_size, asyncio.get_running_loop().create_future())
+        request.sent_at = time.perf_counter()
+        self.serial.write(self.board.pack_command(id, command))
+        self.pending.setdefault((id, command), deque()).append(request)
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future), deadline), request.received_at
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            request.future.cancel()
+            raise
+
+    async def read_all(self, ids: List[int], command: int, response_size: int, format: str, deadline: float = None) -> Dict[int, Optional[Tuple[tuple, float]]]:
+        """
+        Sends command to all ids at once. Response parameters unpacked with format
+        and time of the response by id, None for servos that did not respond in time
+        """
+        if deadline is None:
+            deadline = config.htd45h_async.deadline
+        in_flight = asyncio.Semaphore(config.htd45h_async.max_in_flight)
+
+        async def read_one(id):
+            async with in_flight:
+                try:
+                    response, received_at = await self.request(id, command, response_size, deadline)
+                except asyncio.TimeoutError:
+                    self.logger.info(f'[ASYNC] Servo {id} did not respond to {command} in {deadline} s')
+                    return None
+                except SerialException as e:
+                    self.logger.info(f'[ASYNC] Request {command} to servo {id} was not sent - {e}')
+                    return None
+                return struct.unpack(format, response), received_at
+
+        loop = asyncio.get_running_loop()
+        dropped_bytes = self.decoder.dropped_bytes
+        self.decoder.clear()
+        self.serial.reset_input_buffer()
+        loop.add_reader(self.serial.fileno(), self.on_readable)
+        try:
+            responses = await asyncio.gather(*(read_one(id) for id in ids))
+        finally:
+            loop.remove_reader(self.serial.fileno())
+            self.pending.clear()
+        if self.decoder.dropped_bytes > dropped_bytes:
+            self.logger.info(f'[ASYNC] {self.decoder}')
+        return dict(zip(ids, responses))
+
+    async def read_positions(self, ids: List[int], deadline: float = None) -> Dict[int, Optional[Tuple[int, float]]]:
+        """
+        SERVO_POS_READ for all ids at once. Position and time of the response by id,
+        None for servos that did not respond in time
+        """
+        responses = await self.read_all(ids, HTD45H.SERVO_POS_READ, 8, "<h", deadline)
+        return {id: None if response is None else (response[0][0], response[1]) for id, response in responses.items()}
+
+    async def read_targets(self, ids: List[int], deadline: float = None, wait: bool = False) -> Dict[int, Optional[tuple]]:
+        """
+        SERVO_MOVE_TIME_READ for all ids at once, SERVO_MOVE_TIME_WAIT_READ with wait.
+        (position, rate) by id, None for servos that did not respond in time
+        """
+        command = HTD45H.SERVO_MOVE_TIME_WAIT_READ if wait else HTD45H.SERVO_MOVE_TIME_READ
+        responses = await self.read_all(ids, command, 10, "<HH", deadline)
+        return {id: None if response is None else response[0] for id, response in responses.items()}
+
+    async def read_angles(self, ids: List[int], deadline: float = None) -> Dict[int, Optional[Tuple[float, float]]]:
+        """
+        Angles as HTD45H.read_angle and time of the response by id,
+        None for servos with no response or a wrong value
+        """
+        angles = {}
+        for id, response in (await self.read_positions(ids, deadline)).items():
+            angle = None if response is None else round((response[0] - neutral[id]) * 0.24, 2)
+            angles[id] = (angle, response[1]) if angle is not None and -150 <= angle <= 150 else None
+        return angles
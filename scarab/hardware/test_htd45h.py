@@ -0,0 +1,156 @@
+import sys
+import os
+import random
+import struct
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import hardware.htd45h as htd45h
+from hardware.htd45h import HTD45H, ResponseDecoder
+
+
+class BusSerial:
+    """
+    Half-duplex bus: written packets are read back, followed by the responses of servos
+    """
+    def __init__(self, *args, timeout=None, **kwargs):
+        self._timeout = timeout
+        self.timeout_sets = 0
+        self.written = []
+        self.responses = {}
+        self.incoming = b''
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self.timeout_sets += 1
+
+    def setDTR(self, value):
+        pass
+
+    def flushInput(self):
+        self.incoming = b''
+
+    def write(self, data):
+        data = bytes(data)
+        self.written.append(data)
+        self.incoming += data + self.responses.get(data, b'')
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.incoming)
+
+    def read(self, size):
+        data, self.incoming = self.incoming[:size], self.incoming[size:]
+        return data
+
+def bus_board(monkeypatch) -> HTD45H:
+    monkeypatch.setattr(htd45h, 'Serial', BusSerial)
+    board = HTD45H(port='bus', Timeout=0.5)
+    board.TX_DELAY_TIME = 0
+    return board
+
+def frame(id: int, command: int, params: bytes = b'') -> bytes:
+    body = bytes([id, len(params) + 3, command]) + params
+    return b'\x55\x55' + body + bytes([~sum(body) & 0xff])
+
+def test_decoder_partial_frames():
+    decoder = ResponseDecoder()
+    response = frame(3, HTD45H.SERVO_POS_READ, b'\xf4\x01')
+    assert decoder.feed(response[:3]) == []
+    assert decoder.feed(response[3:-1]) == []
+    [decoded] = decoder.feed(response[-1:])
+    assert (decoded.id, decoded.command, decoded.params, decoded.frame) == (3, HTD45H.SERVO_POS_READ, b'\xf4\x01', response)
+    assert decoder.size == 0 and decoder.dropped_bytes == 0
+
+def test_decoder_resync():
+    decoder = ResponseDecoder()
+    response = frame(4, HTD45H.SERVO_POS_READ, b'\x10\x02')
+    # noise, a header in the noise and a frame with a bad checksum
+    bad = bytearray(frame(5, HTD45H.SERVO_POS_READ, b'\x00\x01'))
+    bad[-1] ^= 0xff
+    decoded = decoder.feed(b'\x00\x13\x55' + b'\x55\x55\x09' + bytes(bad) + response)
+    assert [response.frame for response in decoded] == [frame(4, HTD45H.SERVO_POS_READ, b'\x10\x02')]
+    assert decoder.bad_checksums == 1
+    assert decoder.size == 0
+
+def test_decoder_echo():
+    decoder = ResponseDecoder()
+    # the request is read back from the half-duplex bus before the response
+    request = frame(3, HTD45H.SERVO_MOVE_TIME_READ)
+    response = frame(3, HTD45H.SERVO_MOVE_TIME_READ, b'\xf4\x01\x28\x00')
+    echo, decoded = decoder.feed(request + response)
+    assert (echo.frame, decoded.frame) == (request, response)
+    assert len(decoded.frame) == 7 + 3
+    assert decoded.params == b'\xf4\x01\x28\x00'
+
+def test_decoder_ring_wraps():
+    decoder = ResponseDecoder(capacity=16)
+    response = frame(2, HTD45H.SERVO_POS_READ, b'\x01\x02')
+    for _ in range(10):
+        [decoded] = decoder.feed(b'\x00' + response)
+        assert decoded.frame == response
+    assert decoder.frames == 10 and decoder.dropped_bytes == 10
+
+def test_send_receive_packet(monkeypatch):
+    board = bus_board(monkeypatch)
+    response = frame(3, HTD45H.SERVO_POS_READ, b'\xf4\x01')
+    board.serial.responses[frame(3, HTD45H.SERVO_POS_READ)] = b'\x00' + response
+    assert board.read_position(3) == 500
+    # timeout is set once for the read and restored after it
+    assert board.serial.timeout == 0.5 and board.serial.timeout_sets == 2
+
+def packet(format: str, *values) -> bytes:
+    """
+    Packet as the protocol describes it: header, body and the inverted sum of the body
+    """
+    body = struct.pack(format, *values)
+    return b'\x55\x55' + body + bytes([~sum(body) & 0xff])
+
+def test_packets(monkeypatch):
+    board = bus_board(monkeypatch)
+    rng = random.Random(0)
+    for _ in range(200):
+        id = rng.randrange(256)
+        first, second = rng.randrange(1001), rng.randrange(1001)
+        byte, signed, speed = rng.randrange(256), rng.randrange(-125, 126), rng.randrange(-1000, 1001)
+        writes = [
+            (lambda: board.move_servo(id, first, second), packet('<BBBHH', id, 7, HTD45H.SERVO_MOVE_TIME_WRITE, first, second)),
+            (lambda: board.move_servo_wait(id, first, second), packet('<BBBHH', id, 7, HTD45H.SERVO_MOVE_TIME_WAIT_WRITE, first, second)),
+            (lambda: board.move_servo_start(id), packet('<BBB', id, 3, HTD45H.SERVO_MOVE_START)),
+            (lambda: board.move_servo_stop(id), packet('<BBB', id, 3, HTD45H.SERVO_MOVE_STOP)),
+            (lambda: board.set_id(id, byte), packet('<BBBB', id, 4, HTD45H.SERVO_ID_WRITE, byte)),
+            (lambda: board.set_angle_offset_adjust(id, signed), packet('<BBBb', id, 4, HTD45H.SERVO_ANGLE_OFFSET_ADJUST, signed)),
+            (lambda: board.set_angle_offset(id, signed), packet('<BBBb', id, 4, HTD45H.SERVO_ANGLE_OFFSET_WRITE, signed)),
+            (lambda: board.set_angle_limit(id, first, second), packet('<BBBHH', id, 7, HTD45H.SERVO_ANGLE_LIMIT_WRITE, first, second)),
+            (lambda: board.set_voltage_limit(id, first, second), packet('<BBBHH', id, 7, HTD45H.SERVO_VIN_LIMIT_WRITE, first, second)),
+            (lambda: board.set_temperature_limit(id, byte), packet('<BBBB', id, 4, HTD45H.SERVO_TEMP_MAX_LIMIT_WRITE, byte)),
+            (lambda: board.motor_or_servo(id, byte % 2, speed), packet('<BBBBBh', id, 7, HTD45H.SERVO_OR_MOTOR_MODE_WRITE, byte % 2, 0, speed)),
+            (lambda: board.load_unload(id, byte % 2), packet('<BBBB', id, 4, HTD45H.SERVO_LOAD_OR_UNLOAD_WRITE, byte % 2)),
+            (lambda: board.set_led(id, byte % 2), packet('<BBBB', id, 4, HTD45H.SERVO_LED_CTRL_WRITE, byte % 2)),
+            (lambda: board.set_led_error(id, byte % 8), packet('<BBBB', id, 4, HTD45H.SERVO_LED_ERROR_WRITE, byte % 8)),
+            (lambda: board.enable_torque(id), packet('<BBBB', id, 4, HTD45H.SERVO_LOAD_OR_UNLOAD_WRITE, 1)),
+            (lambda: board.disable_torque(id), packet('<BBBB', id, 4, HTD45H.SERVO_LOAD_OR_UNLOAD_WRITE, 0)),
+        ]
+        for write, expected in writes:
+            board.serial.written.clear()
+            write()
+            assert board.serial.written == [expected]
+
+def test_move_servos_to_angles(monkeypatch):
+    board = bus_board(monkeypatch)
+    ids = list(htd45h.neutral)
+    for wait, command in [(False, HTD45H.SERVO_MOVE_TIME_WRITE), (True, HTD45H.SERVO_MOVE_TIME_WAIT_WRITE)]:
+        # more targets than the buffers are allocated for
+        for targets in [[(id, 10.0, 40) for id in ids[:9]], [(id, -5.0, 100) for id in ids + ids[:3]]]:
+            board.serial.written.clear()
+            positions = board.move_servos_to_angles(targets, wait=wait)
+            expected = [htd45h.neutral[id] + int(angle / 0.24) for id, angle, _ in targets]
+            assert positions[:len(targets)] == expected
+            assert board.serial.written == [b''.join(
+                packet('<BBBHH', id, 7, command, position, rate) for (id, _, rate), position in zip(targets, expected)
+            )]
@@ -0,0 +1,111 @@
+import sys
+import os
+import asyncio
+import struct
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import hardware.htd45h as htd45h
+from hardware.htd45h import HTD45H
+from hardware.htd45h_async import AsyncHTD45H
+from hardware.test_htd45h import BusSerial, frame
+from serial import SerialException
+import configs.config as config
+
+
+class PipeSerial(BusSerial):
+    """
+    Half-duplex bus the event loop can watch. A request is echoed at once,
+    a servo answers after response_time, and only when no other servo is answering,
+    otherwise both responses are lost in a collision
+    """
+    response_time = 0.002
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        self.answering = 0
+        self.collisions = 0
+        self.fail_writes = False
+
+    def fileno(self):
+        return self.read_fd
+
+    def reset_input_buffer(self):
+        self.flushInput()
+
+    def write(self, data):
+        if self.fail_writes:
+            raise SerialException('device disconnected')
+        data = bytes(data)
+        self.written.append(data)
+        response = self.respond(data)
+        # echo is read back at once, the response comes in two parts
+        self.deliver(data)
+        if response:
+            self.answering += 1
+            loop = asyncio.get_running_loop()
+            loop.call_later(self.response_time / 2, self.deliver, response[:3])
+            loop.call_later(self.response_time, self.answer, response[3:])
+        return len(data)
+
+    def respond(self, data: bytes) -> bytes:
+        return self.responses.get(data, b'')
+
+    def answer(self, rest: bytes):
+        if self.answering > 1:
+            self.collisions += 1
+        else:
+            self.deliver(rest)
+        self.answering -= 1
+
+    def deliver(self, data: bytes):
+        os.write(self.write_fd, data)
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size):
+        try:
+            return os.read(self.read_fd, 1024)
+        except BlockingIOError:
+            return b''
+
+def async_board(monkeypatch) -> AsyncHTD45H:
+    monkeypatch.setattr(htd45h, 'Serial', PipeSerial)
+    board = HTD45H(port='bus', Timeout=0.5)
+    return AsyncHTD45H(board)
+
+def test_read_positions(monkeypatch):
+    bus = async_board(monkeypatch)
+    serial = bus.serial
+    for id, position in [(1, 500), (2, 510), (3, 520)]:
+        serial.responses[frame(id, HTD45H.SERVO_POS_READ)] = frame(id, HTD45H.SERVO_POS_READ, struct.pack('<h', position))
+
+    positions = asyncio.run(bus.read_positions([1, 2, 3, 4], deadline=0.05))
+    assert {id: response and response[0] for id, response in positions.items()} == {1: 500, 2: 510, 3: 520, 4: None}
+    # one request is in flight at a time, so responses do not collide
+    assert serial.collisions == 0
+    assert serial.written == [frame(id, HTD45H.SERVO_POS_READ) for id in [1, 2, 3, 4]]
+    assert bus.timeouts == 1
+    assert positions[1][1] < positions[2][1] < positions[3][1]
+
+def test_collisions_with_several_in_flight(monkeypatch):
+    monkeypatch.setattr(config.htd45h_async, 'max_in_flight', 3)
+    bus = async_board(monkeypatch)
+    for id in [1, 2, 3]:
+        bus.serial.responses[frame(id, HTD45H.SERVO_POS_READ)] = frame(id, HTD45H.SERVO_POS_READ, b'\xf4\x01')
+    positions = asyncio.run(bus.read_positions([1, 2, 3], deadline=0.02))
+    assert bus.serial.collisions > 0
+    assert None in positions.values()
+
+def test_failed_write_does_not_block(monkeypatch):
+    bus = async_board(monkeypatch)
+    bus.serial.fail_writes = True
+
+    def no_sleep(seconds):
+        raise AssertionError('event loop is blocked')
+
+    monkeypatch.setattr(htd45h.time, 'sleep', no_sleep)
+    assert asyncio.run(bus.read_positions([1, 2], deadline=0.01)) == {1: None, 2: None}
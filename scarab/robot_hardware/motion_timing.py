@@ -0,0 +1,52 @@
+from typing import Sequence, Tuple
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from configs import config as cfg
+
+
+class MotionTiming:
+    """
+    Per-joint rates for one frame, so that all joints arrive at the target together.
+    Move packets of a bus go out one after another, a joint at send position i starts its move
+    i * packet_time ms after the first one, so its rate is the frame duration minus this offset.
+    Frame duration is the requested one (speed in ms per 45 degrees of the largest delta),
+    but not shorter than any joint needs at motion_timing.servo_max_speed
+    and not shorter than sending the frame itself.
+    send_time is a moving average of measured frames, so frame duration follows the real bus
+    """
+    def __init__(self, joints_number: int = 18, send_positions: Sequence[int] = None):
+        self.joints_number = joints_number
+        # position of every joint in the packets of its bus
+        self.send_positions = np.arange(joints_number) if send_positions is None else np.asarray(send_positions)
+        self.send_time = float(cfg.motion_timing.send_time)
+
+    def offsets(self) -> np.ndarray:
+        return self.send_positions * cfg.motion_timing.packet_time
+
+    @staticmethod
+    def min_rates(deltas: np.ndarray) -> np.ndarray:
+        return np.abs(deltas) / cfg.motion_timing.servo_max_speed
+
+    def plan(self, deltas: np.ndarray, speed: float, min_rate: float = 0) -> Tuple[np.ndarray, float]:
+        """
+        deltas are angle differences in degrees of shape (joints_number) in JOINTS order.
+        Returns integer rates in ms of shape (joints_number) and frame duration in ms
+        from the start of sending to the arrival of all joints
+        """
+        deltas = np.asarray(deltas, dtype=float)
+        offsets = self.offsets()
+        requested = max(speed * np.abs(deltas).max(initial=0) / 45, min_rate)
+        duration = max(requested, (offsets + self.min_rates(deltas)).max(), self.send_time)
+        rates = np.ceil(np.maximum(duration - offsets, self.min_rates(deltas))).astype(int)
+        return rates, duration
+
+    def update(self, measured_send_time: float) -> None:
+        """
+        measured_send_time is ms spent to send a whole frame
+        """
+        smoothing = cfg.motion_timing.send_time_smoothing
+        self.send_time = (1 - smoothing) * self.send_time + smoothing * measured_send_time
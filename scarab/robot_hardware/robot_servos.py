@@ -2,16 +2,42 @@ import time
 import sys
 import os
 import math
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import numpy as np
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from hardware.htd45h import HTD45H, read_values
+from hardware.htd45h_async import AsyncHTD45H
 import logging
 import configs.config as config
 import configs.code_config as code_config
 import logging.config
 logging.config.dictConfig(code_config.logger_config)
-from copy import deepcopy
 
-from cybernetic_core.geometry.angles import RobotPosition, build_position_from_servos
+from cybernetic_core.geometry.angles import JOINTS, RobotPosition, AnglesException, build_position_from_servos
+from robot_hardware.motion_timing import MotionTiming
+
+class FrameAbortedException(Exception):
+    pass
+
+@dataclass
+class Readback:
+    """
+    Angles of all joints read at once, arrays of shape (18) in JOINTS order.
+    timestamps are time.perf_counter() of responses, angles and timestamps are nan where not valid:
+    the servo did not respond in time or gave a wrong value
+    """
+    angles: np.ndarray
+    timestamps: np.ndarray
+    valid: np.ndarray
+
+    def position(self, fallback: np.ndarray) -> RobotPosition:
+        """
+        Position with fallback angles of shape (18) for joints that are not valid
+        """
+        return RobotPosition.from_array(np.where(self.valid, self.angles, fallback))
 
 class RobotServos:
     def __init__(self):
@@ -30,9 +56,124 @@ class RobotServos:
         # my max speed is for 45 degrees
         # that means that max speed should be 120 for 7.4V+ and 135 for 6V+
         self.servos = [2, 3, 4, 5, 8, 9, 10, 11, 14, 15, 16, 17, 20, 21, 22, 23]
+        # (joint index, servo number) for every board, a frame is sent with one write per board
+        self.boards_joints = {}
+        for joint_index, joint in enumerate(JOINTS):
+            servo_num = config.servos_mapping[joint]
+            self.boards_joints.setdefault(config.servos_boards[servo_num], []).append((joint_index, servo_num))
+        # boards are on separate buses and are written at the same time
+        send_positions = [0] * len(JOINTS)
+        for joints in self.boards_joints.values():
+            for position, (joint_index, _) in enumerate(joints):
+                send_positions[joint_index] = position
+        if config.motion_timing.synchronized_start:
+            # every joint starts with the broadcast start after preloads of the longest board
+            send_positions = [max(len(joints) for joints in self.boards_joints.values())] * len(JOINTS)
+        self.motion_timing = MotionTiming(len(JOINTS), send_positions)
+        # one worker per bus, so that both buses are busy at once
+        self.bus_workers = {
+            board_num: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'bus_m{board_num}')
+            for board_num in self.boards_joints
+        }
+        # reads with several requests in flight, buses of all boards are served by one event loop
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='servos_loop', daemon=True).start()
+        self.async_boards = {
+            board_num: AsyncHTD45H(self.__getattribute__(f'm{board_num}'))
+            for board_num in self.boards_joints
+        }
+        # read back of the last frame, see verify_frame
+        self.verification = None
+        self.verify_turn = 0
+        # joint indexes of servos that did not get the last frame
+        self.missed_joints = set()
 
     def servo_controller(self, servo_number: int) -> HTD45H:
         return self.__getattribute__(f"m{config.servos_boards[servo_number]}")
+
+    def on_boards(self, function) -> dict:
+        """
+        Runs function(board, joints) for every board in the worker of its bus, all boards in parallel.
+        joints are (joint index, servo number) of the board. Returns results by board number,
+        exceptions of workers are raised here
+        """
+        self.wait_verification()
+        futures = {
+            board_num: self.bus_workers[board_num].submit(function, self.__getattribute__(f'm{board_num}'), joints)
+            for board_num, joints in self.boards_joints.items()
+        }
+        return {board_num: future.result() for board_num, future in futures.items()}
+
+    def submit_async(self, function) -> Future:
+        """
+        Runs coroutine function(async_board, joints) for all boards at once in the event loop.
+        Returns a future of results by board number
+        """
+        async def run_all():
+            results = await asyncio.gather(*(
+                function(self.async_boards[board_num], joints)
+                for board_num, joints in self.boards_joints.items()
+            ))
+            return dict(zip(self.boards_joints, results))
+
+        return asyncio.run_coroutine_threadsafe(run_all(), self.loop)
+
+    def on_boards_async(self, function) -> dict:
+        """
+        As on_boards, but function(async_board, joints) is a coroutine function
+        """
+        self.wait_verification()
+        return self.submit_async(function).result()
+
+    def verified_joints(self, joints: list) -> list:
+        """
+        (index in board, (joint index, servo number)) of the board to read back after a frame
+        """
+        policy = config.verification.policy
+        if policy == 'every':
+            return list(enumerate(joints))
+        if policy == 'round_robin':
+            index = self.verify_turn % len(joints)
+            return [(index, joints[index])]
+        return []
+
+    def verify_frame(self, positions: dict) -> None:
+        """
+        Starts the read back of targets of the frame just sent, positions are target positions by board.
+        Does not wait for it, mismatches are collected by wait_verification before the bus is used again
+        """
+        if config.verification.policy == 'never':
+            return
+
+        # joints to check are chosen now, the turn moves on before the read back runs
+        checked_joints = {board_num: self.verified_joints(joints) for board_num, joints in self.boards_joints.items()}
+
+        async def verify(board, joints):
+            checked = checked_joints[config.servos_boards[joints[0][1]]]
+            # preloads are consumed by SERVO_MOVE_START, targets are read back with SERVO_MOVE_TIME_READ
+            targets = await board.read_targets([servo_num for _, (_, servo_num) in checked])
+            missed = []
+            for index, (joint_index, servo_num) in checked:
+                position = positions[config.servos_boards[servo_num]][index]
+                if targets[servo_num] is None:
+                    self.logger.info(f'Can not read target of servo {servo_num}')
+                elif targets[servo_num][0] != position:
+                    self.logger.info(f'Id : {servo_num}. Target required : {position}. Target real : {targets[servo_num][0]}')
+                    missed.append(joint_index)
+            return missed
+
+        self.verification = self.submit_async(verify)
+        self.verify_turn += 1
+
+    def wait_verification(self) -> None:
+        if self.verification is None:
+            return
+        verification, self.verification = self.verification, None
+        try:
+            for missed in verification.result().values():
+                self.missed_joints.update(missed)
+        except Exception as e:
+            self.logger.info(f'Verification failed.\n{e}')
     
     def print_status(self):
         for i in config.servos_boards.keys():
@@ -46,35 +187,105 @@ class RobotServos:
         self.speed = new_speed
         self.logger.info(f'RobotServos. Speed set to {self.speed}')
     
-    def get_current_angles(self) -> RobotPosition:
-        angles = {}
-        for joint, servo_num in config.servos_mapping.items():
-            sc = self.servo_controller(servo_num)
-            angles[joint] = sc.read_angle(servo_num)
+    def read_back(self) -> Readback:
+        """
+        Reads all joints with SERVO_POS_READ requests of a board sent back to back, both boards at once
+        """
+        async def read_angles(board, joints):
+            angles = await board.read_angles([servo_num for _, servo_num in joints])
+            return [(joint_index, angles[servo_num]) for joint_index, servo_num in joints]
+
+        angles = np.full(len(JOINTS), np.nan)
+        timestamps = np.full(len(JOINTS), np.nan)
+        for board_angles in self.on_boards_async(read_angles).values():
+            for joint_index, response in board_angles:
+                if response is not None:
+                    angles[joint_index], timestamps[joint_index] = response
+        readback = Readback(angles, timestamps, ~np.isnan(angles))
+        if readback.valid.any():
+            self.logger.info(f'Angles read in {round((np.nanmax(timestamps) - np.nanmin(timestamps)) * 1000, 1)} ms')
+        if not readback.valid.all():
+            self.logger.info(f'No angles of {[JOINTS[joint_index] for joint_index in np.flatnonzero(~readback.valid)]}')
+        return readback
 
-        current_position = RobotPosition(**angles)
+    def get_current_angles(self) -> RobotPosition:
+        readback = self.read_back()
+        angles = readback.angles.copy()
+        # servos, that did not respond in time, are read one by one with retries
+        for joint_index in np.flatnonzero(~readback.valid):
+            servo_num = config.servos_mapping[JOINTS[joint_index]]
+            angles[joint_index] = self.servo_controller(servo_num).read_angle(servo_num)
+
+        current_position = RobotPosition.from_array(angles)
         
         self.logger.info(f'Read current angles : {current_position}')
         
         return current_position
     
     def enable_torque(self):
-        for i in config.servos_boards.keys():
-            board = self.servo_controller(i)
-            board.enable_torque(i)
+        def enable(board, joints):
+            for _, servo_num in joints:
+                board.enable_torque(servo_num)
+
+        self.on_boards(enable)
 
     def disable_torque(self):
-        for i in config.servos_boards.keys():
-            board = self.servo_controller(i)
-            board.disable_torque(i)
+        def disable(board, joints):
+            for _, servo_num in joints:
+                board.disable_torque(servo_num)
+
+        self.on_boards(disable)
 
     def send_command_to_servos(self, rp: RobotPosition, rate):
-        for joint, servo_value in rp.servo_values.items():
-            servo_num = config.servos_mapping[joint]
-            sc = self.servo_controller(servo_num)
-            if 't' in joint:
-                assert config.angles_limits.tetta.min <= servo_value <= config.angles_limits.tetta.max
-            sc.move_servo_to_angle(servo_num, servo_value, rate)
+        # rate is one for all servos or a sequence of rates in JOINTS order
+        rates = [rate] * len(rp.servo_values) if isinstance(rate, (int, float)) else rate
+        # the whole frame is checked before the first packet goes out
+        tettas = rp.array[0::3]
+        if not ((config.angles_limits.tetta.min <= tettas) & (tettas <= config.angles_limits.tetta.max)).all():
+            raise AnglesException(f'Tettas out of limits: {tettas.tolist()}')
+        values = rp.array
+        synchronized = config.motion_timing.synchronized_start
+        start = threading.Barrier(len(self.boards_joints), timeout=1)
+
+        def send(board, joints):
+            targets = [(servo_num, float(values[joint_index]), int(rates[joint_index])) for joint_index, servo_num in joints]
+            # servos that missed the last frame get this one twice
+            targets += [target for (joint_index, _), target in zip(joints, targets) if joint_index in missed_joints]
+            try:
+                positions = board.move_servos_to_angles(targets, wait=synchronized)[:len(joints)]
+            except Exception as e:
+                # the other bus does not wait for this one and does not start its servos
+                start.abort()
+                raise FrameAbortedException(f'Frame not sent to board {board.port} - {e}') from e
+            if synchronized:
+                # the buses wait for each other, so that all servos start at the same moment
+                try:
+                    start.wait()
+                except threading.BrokenBarrierError:
+                    raise FrameAbortedException(f'Frame not started on board {board.port}, the other bus failed')
+                board.move_servo_start(board.BROADCAST_ID)
+            return positions
+
+        self.wait_verification()
+        missed_joints, self.missed_joints = self.missed_joints, set()
+        if missed_joints:
+            self.logger.info(f'Resending to {[JOINTS[joint_index] for joint_index in sorted(missed_joints)]}')
+        self.verify_frame(self.on_boards(send))
+
+    def send_synchronized(self, rp: RobotPosition, angles_diff: list) -> float:
+        """
+        Sends rp with per-joint rates of MotionTiming, waits until all joints arrive.
+        Returns frame duration in ms
+        """
+        rates, duration = self.motion_timing.plan(angles_diff, self.speed, self.max_speed)
+        start_time = time.perf_counter()
+        self.send_command_to_servos(rp, rates)
+        send_time = time.perf_counter() - start_time
+        self.motion_timing.update(send_time * 1000)
+        self.logger.info(f'Command sent. Duration: {round(duration)}, send time: {round(send_time * 1000)}, rates: {rates.tolist()}')
+
+        time.sleep(max(0, duration / 1000 - (time.perf_counter() - start_time)))
+        return duration
 
     """
     def set_servo_values_paced(self, angles):
@@ -136,7 +347,7 @@ class RobotServos:
                 self.logger.info(f'Unreachable. Moving further')
                 break
 
-            prev_angles = deepcopy(current_angles)
+            prev_angles = current_angles
     
     def set_servo_values_paced_wo_adjustment(self, angles):
         _, max_angle_diff = self.get_angles_diff(angles)
@@ -189,8 +400,7 @@ class RobotServos:
         time.sleep(rate / 1000)
     """
     def set_servo_values_paced_wo_feedback(self, angles: RobotPosition):
-        _, max_angle_diff = self.get_angles_diff(angles)
-        rate = round(max(self.speed * max_angle_diff / 45, self.max_speed)) # speed is normalized
+        angles_diff, max_angle_diff = self.get_angles_diff(angles)
         self.logger.info(f'max_angle_diff: {max_angle_diff}, self.speed : {self.speed}, self.speed * max_angle_diff / 45 : {self.speed * max_angle_diff / 45}')
         
         #print(type(angles), angles.__dict__)
@@ -214,13 +424,14 @@ class RobotServos:
             bad_move = True
         """
         #if not bad_move:
-        self.send_command_to_servos(angles, rate)
-        self.logger.info(f'Command sent. Rate: {rate}, angles: {angles}')
-
-        time.sleep(rate / 1000)
+        self.send_synchronized(angles, angles_diff)
+        self.logger.info(f'Command sent. Angles: {angles}')
         #else:
         #    self.logger.error('Move skipped due to tetta error')
-        return self.get_current_angles()
+        # the move is over, servos that did not respond are taken at their targets
+        current_position = self.read_back().position(angles.array)
+        self.logger.info(f'Read current angles : {current_position}')
+        return current_position
             
     def set_servo_values_not_paced(self, angles):
         # every command is executed over fixed time (1 sec for speed = 1000)
@@ -229,6 +440,12 @@ class RobotServos:
         self.logger.info(f'Wait time : {wait_time}, speed : {int(self.speed * 0.9)}')
         time.sleep(wait_time)
 
+    def set_servo_values_streamed(self, angles: RobotPosition, period: float, rate: int = None):
+        # frames are sent at a fixed period in ms, servos move to every frame for rate ms (period by default)
+        start_time = time.perf_counter()
+        self.send_command_to_servos(angles, int(period if rate is None else rate))
+        time.sleep(max(0, period / 1000 - (time.perf_counter() - start_time)))
+
     def set_servo_values_for_running(self, angles, rate=config.speed.run):
         wait_time = max(0, rate / 1000 - config.movement.command_advance_ms)
         self.logger.info(f'Wait time : {wait_time}')
@@ -255,16 +472,10 @@ class RobotServos:
 
     def set_servo_values_not_paced_v2(self, fp: RobotPosition, prev_fp: RobotPosition = None):
         # every command is executed over a computed time, depending on the angle
-        _, max_angle_diff = self.get_angles_diff(fp, prev_fp)
-        rate = round(max(self.speed * max_angle_diff / 45, self.max_speed)) # speed is normalized
-        wait_time = min(50, max(0, rate / 1000))
-
+        angles_diff, max_angle_diff = self.get_angles_diff(fp, prev_fp)
         self.logger.info(f'max_angle_diff: {max_angle_diff}, self.speed : {self.speed}, self.speed * max_angle_diff / 45 : {self.speed * max_angle_diff / 45}')
-        self.logger.info(f'Wait time : {wait_time}')
-        
-        self.send_command_to_servos(fp, rate)
-        
-        time.sleep(wait_time)
+
+        self.send_synchronized(fp, angles_diff)
         self.logger.info(f'[DIFF] Diff with target:')
         self.get_angles_diff(fp)
     
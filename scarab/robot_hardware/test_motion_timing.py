@@ -0,0 +1,47 @@
+import sys
+import os
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from robot_hardware.motion_timing import MotionTiming
+from configs import config as cfg
+
+
+def test_plan_arrives_together():
+    timing = MotionTiming(send_positions=np.tile(np.arange(9), 2))
+    deltas = np.linspace(-20, 30, 18)
+    rates, duration = timing.plan(deltas, speed=400)
+    # speed is ms per 45 degrees of the largest delta
+    assert duration == 400 * 30 / 45
+    arrivals = timing.offsets() + rates
+    assert (arrivals >= duration).all() and (arrivals < duration + 1).all()
+    assert (rates >= np.abs(deltas) / cfg.motion_timing.servo_max_speed).all()
+
+def test_plan_limits():
+    timing = MotionTiming()
+    # servos can not move faster than servo_max_speed
+    deltas = np.zeros(18)
+    deltas[17] = 45
+    rates, duration = timing.plan(deltas, speed=10)
+    min_rate = 45 / cfg.motion_timing.servo_max_speed
+    assert rates[17] >= min_rate
+    assert duration == timing.offsets()[17] + min_rate
+
+    # frame is not shorter than sending it, nor than min_rate
+    rates, duration = timing.plan(np.full(18, 0.1), speed=400)
+    assert duration == cfg.motion_timing.send_time
+    rates, duration = timing.plan(np.full(18, 0.1), speed=400, min_rate=100)
+    assert duration == 100
+    assert rates.dtype.kind == 'i'
+
+    # still robot is planned as a frame of send time
+    rates, duration = timing.plan(np.zeros(18), speed=400)
+    assert duration == cfg.motion_timing.send_time
+
+def test_update():
+    timing = MotionTiming()
+    for _ in range(50):
+        timing.update(40)
+    assert abs(timing.send_time - 40) < 0.1
+    rates, duration = timing.plan(np.zeros(18), speed=400)
+    assert duration == timing.send_time
@@ -0,0 +1,245 @@
+import sys
+import os
+import time
+import struct
+import threading
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import hardware.htd45h as htd45h
+from hardware.htd45h import HTD45H, ResponseDecoder, neutral
+from hardware.test_htd45h import frame
+from hardware.test_htd45h_async import PipeSerial
+from robot_hardware.robot_servos import RobotServos, FrameAbortedException
+from cybernetic_core.geometry.angles import RobotPosition
+import configs.config as config
+
+
+class ServoBus(PipeSerial):
+    """
+    Servos of a board. Targets of moves are kept and read back,
+    preloaded targets become targets on SERVO_MOVE_START. Servos in silent do not respond,
+    servos in deaf do not get moves
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.targets = {}
+        self.preloads = {}
+        self.silent = set()
+        self.deaf = set()
+        self.requests = ResponseDecoder()
+
+    def respond(self, data: bytes) -> bytes:
+        responses = b''
+        for packet in self.requests.feed(data):
+            id, command = packet.id, packet.command
+            if id in self.deaf and command in (HTD45H.SERVO_MOVE_TIME_WRITE, HTD45H.SERVO_MOVE_TIME_WAIT_WRITE):
+                continue
+            if command == HTD45H.SERVO_MOVE_TIME_WRITE:
+                self.targets[id] = packet.params
+            elif command == HTD45H.SERVO_MOVE_TIME_WAIT_WRITE:
+                self.preloads[id] = packet.params
+            elif command == HTD45H.SERVO_MOVE_START:
+                for started in (list(self.preloads) if id == HTD45H.BROADCAST_ID else [id]):
+                    self.targets[started] = self.preloads.pop(started)
+            elif id in self.silent:
+                continue
+            elif command == HTD45H.SERVO_MOVE_TIME_READ:
+                responses += frame(id, command, self.targets.get(id, bytes(4)))
+            elif command == HTD45H.SERVO_MOVE_TIME_WAIT_READ:
+                responses += frame(id, command, self.preloads.get(id, bytes(4)))
+            elif command == HTD45H.SERVO_POS_READ:
+                position = struct.unpack('<HH', self.targets[id])[0] if id in self.targets else neutral[id]
+                responses += frame(id, command, struct.pack('<h', position))
+        return responses
+
+def robot_servos(monkeypatch) -> RobotServos:
+    monkeypatch.setattr(htd45h, 'Serial', ServoBus)
+    return RobotServos()
+
+def target_reads(rs: RobotServos) -> dict:
+    """
+    Servos read with SERVO_MOVE_TIME_READ by board, in the order of requests
+    """
+    reads = {}
+    for board_num in rs.boards_joints:
+        written = rs.__getattribute__(f'm{board_num}').serial.written
+        reads[board_num] = [data[2] for data in written if data == frame(data[2], HTD45H.SERVO_MOVE_TIME_READ)]
+    return reads
+
+def move_frame(command: int, id: int, angle: float, rate: int) -> bytes:
+    return frame(id, command, struct.pack('<HH', neutral[id] + int(angle / 0.24), rate))
+
+def test_synchronized_start(monkeypatch):
+    monkeypatch.setattr(config.motion_timing, 'synchronized_start', True)
+    monkeypatch.setattr(config.verification, 'policy', 'never')
+    rs = robot_servos(monkeypatch)
+    # writes of both buses in the order they happen
+    bus_log = []
+    lock = threading.Lock()
+    for board_num in rs.boards_joints:
+        serial = rs.__getattribute__(f'm{board_num}').serial
+        def write(data, board_num=board_num, write=serial.write):
+            with lock:
+                bus_log.append((board_num, bytes(data)))
+            return write(data)
+        serial.write = write
+
+    angles = np.linspace(-20, 20, 18)
+    rs.send_command_to_servos(RobotPosition.from_array(angles), 300)
+
+    start = frame(HTD45H.BROADCAST_ID, HTD45H.SERVO_MOVE_START)
+    for board_num, joints in rs.boards_joints.items():
+        # all servos of a board are preloaded with one write, then started with one broadcast
+        preload = b''.join(
+            move_frame(HTD45H.SERVO_MOVE_TIME_WAIT_WRITE, servo_num, angles[joint_index], 300)
+            for joint_index, servo_num in joints
+        )
+        assert [data for bus, data in bus_log if bus == board_num] == [preload, start]
+    # no servo starts before both buses are preloaded
+    assert [data == start for _, data in bus_log] == [False, False, True, True]
+
+def test_synchronized_start_aborted(monkeypatch):
+    monkeypatch.setattr(config.motion_timing, 'synchronized_start', True)
+    monkeypatch.setattr(config.verification, 'policy', 'never')
+    rs = robot_servos(monkeypatch)
+    failing_board, other_board = (rs.__getattribute__(f'm{board_num}') for board_num in rs.boards_joints)
+
+    def move_servos_to_angles(targets, wait=False):
+        raise OSError('bus is gone')
+
+    failing_board.move_servos_to_angles = move_servos_to_angles
+    start_time = time.perf_counter()
+    with pytest.raises(FrameAbortedException):
+        rs.send_command_to_servos(RobotPosition.from_array(np.zeros(18)), 300)
+    for worker in rs.bus_workers.values():
+        worker.submit(lambda: None).result()
+    # the other bus does not wait for the barrier timeout and does not start its servos
+    assert time.perf_counter() - start_time < 0.5
+    assert frame(HTD45H.BROADCAST_ID, HTD45H.SERVO_MOVE_START) not in other_board.serial.written
+    assert other_board.serial.targets == {}
+
+@pytest.mark.parametrize('synchronized_start', [False, True])
+def test_verification_policies(monkeypatch, synchronized_start):
+    monkeypatch.setattr(config.motion_timing, 'synchronized_start', synchronized_start)
+    rs = robot_servos(monkeypatch)
+    servos = {board_num: [servo_num for _, servo_num in joints] for board_num, joints in rs.boards_joints.items()}
+    rp = RobotPosition.from_array(np.zeros(18))
+
+    monkeypatch.setattr(config.verification, 'policy', 'never')
+    rs.send_command_to_servos(rp, 300)
+    rs.wait_verification()
+    assert target_reads(rs) == {board_num: [] for board_num in servos}
+
+    monkeypatch.setattr(config.verification, 'policy', 'every')
+    rs.send_command_to_servos(rp, 300)
+    rs.wait_verification()
+    assert target_reads(rs) == servos
+    assert rs.missed_joints == set()
+
+    # one servo of every board per frame, in turns
+    monkeypatch.setattr(config.verification, 'policy', 'round_robin')
+    for board_num in servos:
+        rs.__getattribute__(f'm{board_num}').serial.written.clear()
+    for _ in range(3):
+        rs.send_command_to_servos(rp, 300)
+    rs.wait_verification()
+    turns = [rs.verify_turn - 3, rs.verify_turn - 2, rs.verify_turn - 1]
+    assert target_reads(rs) == {board_num: [ids[turn % len(ids)] for turn in turns] for board_num, ids in servos.items()}
+    assert rs.missed_joints == set()
+
+def test_missed_joints_resent(monkeypatch):
+    monkeypatch.setattr(config.verification, 'policy', 'every')
+    rs = robot_servos(monkeypatch)
+    board_num, joints = next(iter(rs.boards_joints.items()))
+    joint_index, servo_num = joints[2]
+    serial = rs.__getattribute__(f'm{board_num}').serial
+    serial.deaf.add(servo_num)
+    rs.send_command_to_servos(RobotPosition.from_array(np.zeros(18)), 300)
+    rs.wait_verification()
+    assert rs.missed_joints == {joint_index}
+
+    # the next frame goes to the servo twice
+    serial.deaf.clear()
+    serial.written.clear()
+    angles = np.full(18, 5.0)
+    rs.send_command_to_servos(RobotPosition.from_array(angles), 300)
+    command = HTD45H.SERVO_MOVE_TIME_WAIT_WRITE if config.motion_timing.synchronized_start else HTD45H.SERVO_MOVE_TIME_WRITE
+    move = move_frame(command, servo_num, 5.0, 300)
+    assert serial.written[0].count(move) == 2
+    rs.wait_verification()
+    assert rs.missed_joints == set()
+    assert serial.targets[servo_num] == move[5:9]
+
+def test_one_write_per_board(monkeypatch):
+    monkeypatch.setattr(config.motion_timing, 'synchronized_start', False)
+    monkeypatch.setattr(config.verification, 'policy', 'never')
+    rs = robot_servos(monkeypatch)
+    angles = np.linspace(-30, 30, 18)
+    rates = np.arange(300, 318)
+    rs.send_command_to_servos(RobotPosition.from_array(angles), rates)
+    for board_num, joints in rs.boards_joints.items():
+        written = rs.__getattribute__(f'm{board_num}').serial.written
+        assert written == [b''.join(
+            move_frame(HTD45H.SERVO_MOVE_TIME_WRITE, servo_num, angles[joint_index], rates[joint_index])
+            for joint_index, servo_num in joints
+        )]
+
+def test_buses_in_parallel(monkeypatch):
+    monkeypatch.setattr(config.motion_timing, 'synchronized_start', False)
+    monkeypatch.setattr(config.verification, 'policy', 'never')
+    rs = robot_servos(monkeypatch)
+    # a write takes as long as 18 packets at 115200 baud
+    write_time = 0.02
+    intervals = {}
+    for board_num in rs.boards_joints:
+        serial = rs.__getattribute__(f'm{board_num}').serial
+        def write(data, board_num=board_num, write=serial.write):
+            start_time = time.perf_counter()
+            time.sleep(write_time)
+            intervals[board_num] = (start_time, time.perf_counter())
+            return write(data)
+        serial.write = write
+
+    rs.send_command_to_servos(RobotPosition.from_array(np.zeros(18)), 300)
+    # writes of the two boards overlap
+    (start_1, end_1), (start_2, end_2) = intervals.values()
+    assert start_1 < end_2 and start_2 < end_1
+
+def test_read_back(monkeypatch):
+    monkeypatch.setattr(config.motion_timing, 'synchronized_start', False)
+    monkeypatch.setattr(config.verification, 'policy', 'never')
+    rs = robot_servos(monkeypatch)
+    angles = np.linspace(-24, 24, 18)
+    rs.send_command_to_servos(RobotPosition.from_array(angles), 300)
+    joint_index, servo_num = rs.boards_joints[3][1]
+    rs.m3.serial.silent.add(servo_num)
+
+    readback = rs.read_back()
+    valid = np.ones(18, dtype=bool)
+    valid[joint_index] = False
+    assert np.array_equal(readback.valid, valid)
+    # positions are steps of 0.24 degrees
+    assert np.allclose(readback.angles[valid], angles[valid], atol=0.24)
+    assert np.isnan(readback.angles[joint_index]) and np.isnan(readback.timestamps[joint_index])
+    # servos of a board are read one after another
+    for board_num, joints in rs.boards_joints.items():
+        timestamps = [readback.timestamps[index] for index, _ in joints if valid[index]]
+        assert timestamps == sorted(timestamps)
+
+    fallback = np.full(18, 99.0)
+    position = readback.position(fallback)
+    assert position.array[joint_index] == 99 and np.array_equal(position.array[valid], readback.angles[valid])
+
+    # a servo that did not respond in time is read again on its own
+    read_angle_calls = []
+    def read_angle(id):
+        read_angle_calls.append(id)
+        return 12.5
+
+    monkeypatch.setattr(rs.m3, 'read_angle', read_angle)
+    current_angles = rs.get_current_angles().array
+    assert read_angle_calls == [servo_num]
+    assert current_angles[joint_index] == 12.5
+    assert np.array_equal(current_angles[valid], readback.angles[valid])